@@ -118,4 +118,47 @@ SPCONV_ALLOW_TF32 = False
 
 SPCONV_INT8_DEBUG = os.getenv("SPCONV_INT8_DEBUG", "0") == "1"
 
-SPCONV_DO_SORT = os.getenv("SPCONV_DO_SORT", "1") == "1"
\ No newline at end of file
+SPCONV_DO_SORT = os.getenv("SPCONV_DO_SORT", "1") == "1"
+
+# hash table used by cpu subm indice generator, value of spconv.core.CPUHashType.
+# -1 (Auto) select direct table or linear probing by grid volume and number of voxels.
+SPCONV_CPU_HASH_TYPE = int(os.getenv("SPCONV_CPU_HASH_TYPE", "-1"))
+# number of rows (in mask argsort order) processed together by cpu implicit gemm.
+# all rows in a tile share the union of their masks, so a kernel offset is
+# skipped only when no row of the tile uses it.
+SPCONV_CPU_IGEMM_TILE_SIZE = int(os.getenv("SPCONV_CPU_IGEMM_TILE_SIZE", "4096"))
+# store cpu native indice pairs in csr format ([2, total] with exact size)
+# instead of dense [2, kv, N] padded with -1. opt-in because it changes
+# layout of pairs returned by ops.get_indice_pairs and saved in indice_dict.
+SPCONV_CPU_CSR_KERNEL_MAP = os.getenv("SPCONV_CPU_CSR_KERNEL_MAP", "0") == "1"
+# only store kernel offsets before center for cpu csr subm pairs, pairs of
+# mirrored offset are read from offset kv - 1 - k with in/out swapped.
+SPCONV_CPU_SUBM_HALF_KERNEL_MAP = os.getenv("SPCONV_CPU_SUBM_HALF_KERNEL_MAP", "1") == "1"
+# sort cpu native pairs of every kernel offset by "out" or "in" index,
+# see spconv.pytorch.ops.sort_indice_pairs. empty string disables sort.
+SPCONV_CPU_PAIR_SORT_KEY = os.getenv("SPCONV_CPU_PAIR_SORT_KEY", "")
+# generate cpu pairs of every sample in parallel with its own hash table.
+# helps when batch size >= number of threads.
+SPCONV_CPU_BATCH_SHARDED = os.getenv("SPCONV_CPU_BATCH_SHARDED", "0") == "1"
+# run cpu native conv by fused tiled gather-gemm-scatter kernel instead of
+# gather, torch.mm and scatter_add for every kernel offset.
+SPCONV_CPU_FUSED_GEMM = os.getenv("SPCONV_CPU_FUSED_GEMM", "1") == "1"
+# number of pairs gathered to scratch and multiplied together by fused kernel.
+SPCONV_CPU_FUSED_GEMM_TILE_SIZE = int(os.getenv("SPCONV_CPU_FUSED_GEMM_TILE_SIZE", "128"))
+# run tiles of all kernel offsets of fused cpu kernel in one parallel region
+# with a packed per-pair output buffer, which is reduced to outputs once.
+# better load balance for many threads and small offsets, costs a
+# [num_pairs, out_channels] buffer.
+SPCONV_CPU_GROUPED_GEMM = os.getenv("SPCONV_CPU_GROUPED_GEMM", "0") == "1"
+# number of output rows computed together by ConvAlgo.OutputStationary, every
+# kernel offset of a tile is a gemm with about tile_size * density rows.
+SPCONV_CPU_OUTPUT_STATIONARY_TILE_SIZE = int(
+    os.getenv("SPCONV_CPU_OUTPUT_STATIONARY_TILE_SIZE", "1024"))
+# select strategy (unfused, fused, grouped, output stationary) of cpu native
+# conv by timing all of them once per layer signature, overrides flags above.
+SPCONV_CPU_AUTOTUNE = os.getenv("SPCONV_CPU_AUTOTUNE", "0") == "1"
+# json file of cpu autotune results, loaded on first use and updated after
+# every new result. empty string keeps results in memory only.
+SPCONV_CPU_TUNE_CACHE_PATH = os.getenv(
+    "SPCONV_CPU_TUNE_CACHE_PATH",
+    str(Path.home() / ".cache" / "spconv" / "cpu_tune_cache.json"))
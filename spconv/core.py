@@ -26,6 +26,33 @@ class ConvAlgo(Enum):
     Native = 0
     MaskImplicitGemm = 1
     MaskSplitImplicitGemm = 2
+    # cpu only, uses native pairs. cuda tensors fall back to native.
+    OutputStationary = 3
+
+
+class CPUHashType(Enum):
+    """hash table used by cpu indice generators.
+    """
+    Auto = -1
+    UnorderedMap = 0
+    RobinMap = 1
+    LinearProbing = 2
+    DirectTable = 3
+
+
+class CPUConvStrategy(Enum):
+    """kernel of cpu native conv, selected by SPCONV_CPU_* flags or cpu
+    autotuner.
+    """
+    # gather, torch.mm and scatter add per kernel offset
+    Unfused = 0
+    Fused = 1
+    Grouped = 2
+    OutputStationary = 3
+    # layer level choices of SparseConvolution with dense fallback enabled:
+    # dense torch conv or sparse conv (kernel selected as above).
+    Dense = 4
+    Sparse = 5
 
 
 class AlgoHint(Enum):
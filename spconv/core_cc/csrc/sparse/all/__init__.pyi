@@ -1,6 +1,7 @@
 from typing import overload, Any, Callable, Dict, List, Optional, Set, Tuple, Type, Union
 from pccm.stubs import EnumValue, EnumClassValue
 from cumm.tensorview import Tensor
+from cumm.tensorview.gemm import Activation
 from cumm.tensorview import CUDAKernelTimer
 class ThrustCustomAllocatorV2:
     alloc_func: Callable[int, int]
@@ -215,8 +216,10 @@ class SpconvOps:
         """
         ...
     @staticmethod
-    def generate_conv_inds_cpu(indices: Tensor, indice_pairs: Tensor, out_inds: Tensor, indice_num_per_loc: Tensor, batch_size: int, output_dims: List[int], input_dims: List[int], ksize: List[int], stride: List[int], padding: List[int], dilation: List[int], transposed: bool = False) -> int: 
+    def generate_conv_inds_cpu(indices: Tensor, indice_pairs: Tensor, out_inds: Tensor, indice_num_per_loc: Tensor, batch_size: int, output_dims: List[int], input_dims: List[int], ksize: List[int], stride: List[int], padding: List[int], dilation: List[int], transposed: bool = False, batch_sharded: bool = False) -> int: 
         """
+        if batch_sharded, every sample is generated in parallel with
+        its own hash table, see generate_subm_conv_inds_cpu_csr.
         Args:
             indices: 
             indice_pairs: 
@@ -230,11 +233,34 @@ class SpconvOps:
             padding: 
             dilation: 
             transposed: 
+            batch_sharded: 
         """
         ...
     @staticmethod
-    def generate_subm_conv_inds_cpu(indices: Tensor, indice_pairs: Tensor, out_inds: Tensor, indice_num_per_loc: Tensor, batch_size: int, input_dims: List[int], ksize: List[int], dilation: List[int]) -> int: 
+    def generate_conv_inds_cpu_csr(allocator, indices: Tensor, indice_num_per_loc: Tensor, batch_size: int, output_dims: List[int], input_dims: List[int], ksize: List[int], stride: List[int], padding: List[int], dilation: List[int], transposed: bool = False, batch_sharded: bool = False) -> int: 
         """
+        pairs are allocated by allocator with exact size and stored
+        in csr format: [2, total], see generate_subm_conv_inds_cpu_csr.
+        Args:
+            allocator: 
+            indices: 
+            indice_num_per_loc: 
+            batch_size: 
+            output_dims: 
+            input_dims: 
+            ksize: 
+            stride: 
+            padding: 
+            dilation: 
+            transposed: 
+            batch_sharded: 
+        """
+        ...
+    @staticmethod
+    def generate_subm_conv_inds_cpu(indices: Tensor, indice_pairs: Tensor, out_inds: Tensor, indice_num_per_loc: Tensor, batch_size: int, input_dims: List[int], ksize: List[int], dilation: List[int], hash_type: int = -1, batch_sharded: bool = False) -> int: 
+        """
+        if batch_sharded, every sample is generated in parallel with
+        its own hash table, see generate_subm_conv_inds_cpu_csr.
         Args:
             indices: 
             indice_pairs: 
@@ -244,6 +270,32 @@ class SpconvOps:
             input_dims: 
             ksize: 
             dilation: 
+            hash_type: 
+            batch_sharded: 
+        """
+        ...
+    @staticmethod
+    def generate_subm_conv_inds_cpu_csr(allocator, indices: Tensor, indice_num_per_loc: Tensor, batch_size: int, input_dims: List[int], ksize: List[int], dilation: List[int], hash_type: int = -1, half: bool = False, batch_sharded: bool = False) -> int: 
+        """
+        generate subm pairs in csr format. pair is allocated by
+        allocator (AllocKeys.PairFwd) with shape [2, total], pairs of
+        offset k are stored in [offset[k], offset[k] + indice_num_per_loc[k]),
+        offset = exclusive cumsum of indice_num_per_loc. center (identity)
+        pairs are not stored. if half, only offsets before center are
+        stored, pairs of offset kv - 1 - k are pairs of k with in/out
+        swapped. if batch_sharded, every sample is generated in parallel
+        with its own hash table.
+        Args:
+            allocator: 
+            indices: 
+            indice_num_per_loc: 
+            batch_size: 
+            input_dims: 
+            ksize: 
+            dilation: 
+            hash_type: 
+            half: 
+            batch_sharded: 
         """
         ...
     @staticmethod
@@ -390,6 +442,125 @@ class SpconvOps:
         """
         ...
     @staticmethod
+    def pack_filters_cpu(filters: Tensor, all_w_is_krsc: bool, filter_hwio: bool, transposed: bool = False) -> Tensor: 
+        """
+        Args:
+            filters: 
+            all_w_is_krsc: 
+            filter_hwio: 
+            transposed: 
+        """
+        ...
+    @staticmethod
+    def indice_conv_cpu(out: Tensor, features: Tensor, filters_packed: Tensor, indice_pairs: Tensor, indice_pair_num: Tensor, inverse: bool, subm: bool, subm_half: bool, tile_size: int = 128, bias: Tensor =  Tensor(), output_add: Tensor =  Tensor(), act_type: Activation =  Activation.None_, act_alpha: float = 0.0) -> None: 
+        """
+        Args:
+            out: 
+            features: 
+            filters_packed: 
+            indice_pairs: 
+            indice_pair_num: 
+            inverse: 
+            subm: 
+            subm_half: 
+            tile_size: 
+            bias: 
+            output_add: 
+            act_type: 
+            act_alpha: 
+        """
+        ...
+    @staticmethod
+    def indice_conv_weight_grad_cpu(dfilters: Tensor, features: Tensor, out_bp: Tensor, indice_pairs: Tensor, indice_pair_num: Tensor, all_w_is_krsc: bool, filter_hwio: bool, inverse: bool, subm: bool, subm_half: bool, tile_size: int = 128) -> None: 
+        """
+        Args:
+            dfilters: 
+            features: 
+            out_bp: 
+            indice_pairs: 
+            indice_pair_num: 
+            all_w_is_krsc: 
+            filter_hwio: 
+            inverse: 
+            subm: 
+            subm_half: 
+            tile_size: 
+        """
+        ...
+    @staticmethod
+    def indice_conv_grouped_cpu(out: Tensor, features: Tensor, filters_packed: Tensor, indice_pairs: Tensor, indice_pair_num: Tensor, inverse: bool, subm: bool, subm_half: bool, tile_size: int = 128, bias: Tensor =  Tensor(), output_add: Tensor =  Tensor(), act_type: Activation =  Activation.None_, act_alpha: float = 0.0, workspace: Tensor =  Tensor()) -> None: 
+        """
+        Args:
+            out: 
+            features: 
+            filters_packed: 
+            indice_pairs: 
+            indice_pair_num: 
+            inverse: 
+            subm: 
+            subm_half: 
+            tile_size: 
+            bias: 
+            output_add: 
+            act_type: 
+            act_alpha: 
+            workspace: 
+        """
+        ...
+    @staticmethod
+    def grouped_workspace_size_cpu(indice_pairs: Tensor, indice_pair_num: Tensor, num_out: int, out_channel: int, dtype: int, inverse: bool, subm: bool, subm_half: bool) -> int: 
+        """
+        Args:
+            indice_pairs: 
+            indice_pair_num: 
+            num_out: 
+            out_channel: 
+            dtype: 
+            inverse: 
+            subm: 
+            subm_half: 
+        """
+        ...
+    @staticmethod
+    def neighbor_table_cpu(indice_pairs: Tensor, indice_pair_num: Tensor, num_out: int, inverse: bool, subm: bool, subm_half: bool, out: Tensor =  Tensor()) -> Tensor: 
+        """
+        Args:
+            indice_pairs: 
+            indice_pair_num: 
+            num_out: 
+            inverse: 
+            subm: 
+            subm_half: 
+            out: 
+        """
+        ...
+    @staticmethod
+    def indice_conv_output_stationary_cpu(out: Tensor, features: Tensor, filters_packed: Tensor, table: Tensor, tile_size: int = 128, bias: Tensor =  Tensor(), output_add: Tensor =  Tensor(), act_type: Activation =  Activation.None_, act_alpha: float = 0.0) -> None: 
+        """
+        Args:
+            out: 
+            features: 
+            filters_packed: 
+            table: 
+            tile_size: 
+            bias: 
+            output_add: 
+            act_type: 
+            act_alpha: 
+        """
+        ...
+    @staticmethod
+    def epilogue_cpu(out: Tensor, bias: Tensor =  Tensor(), output_add: Tensor =  Tensor(), act_type: Activation =  Activation.None_, act_alpha: float = 0.0) -> None: 
+        """
+        Args:
+            out: 
+            bias: 
+            output_add: 
+            act_type: 
+            act_alpha: 
+        """
+        ...
+    @staticmethod
     def sort_1d_by_key_allocator(data: Tensor, alloc_func, indices: Tensor =  Tensor(), stream: int = 0, mask_count: int = 1, do_sort: bool = True) -> Tensor: 
         """
         Args:
@@ -592,7 +763,7 @@ class SpconvOps:
         """
         ...
     @staticmethod
-    def get_indice_pairs(allocator, indices: Tensor, batch_size: int, input_dims: List[int], algo: int, ksize: List[int], stride: List[int], padding: List[int], dilation: List[int], out_padding: List[int], subm: bool, transposed: bool, stream_int: int = 0, num_out_act_bound: int = -1, num_input_act_bound: int = -1) -> int: 
+    def get_indice_pairs(allocator, indices: Tensor, batch_size: int, input_dims: List[int], algo: int, ksize: List[int], stride: List[int], padding: List[int], dilation: List[int], out_padding: List[int], subm: bool, transposed: bool, stream_int: int = 0, num_out_act_bound: int = -1, num_input_act_bound: int = -1, cpu_hash_type: int = -1, csr: bool = False, subm_half: bool = False, cpu_batch_sharded: bool = False) -> int: 
         """
         Args:
             allocator: 
@@ -610,5 +781,9 @@ class SpconvOps:
             stream_int: 
             num_out_act_bound: 
             num_input_act_bound: 
+            cpu_hash_type: 
+            csr: 
+            subm_half: 
+            cpu_batch_sharded: 
         """
         ...
@@ -16,7 +16,7 @@ class ConvGemmOps:
         """
         1. this function need to take a out features
         that from subm first mm.
-        2. this function don't support CPU.
+        2. cpu uses fused gather-gemm-scatter kernel.
         Args:
             allocator: 
             ext_mm: 
@@ -141,7 +141,7 @@ class HashTable(pccm.Class, pccm.pybind.PybindClassMixin):
             code.raw(f"TV_ASSERT_RT_ERR(is_cpu, \"spconv not built with CUDA\");")
         return code 
 
-    @pccm.pybind.mark 
+    @pccm.pybind.mark(nogil=True)
     @_member_func
     def clear(self):
         """ in this function, if values is empty, it will be assigned to zero.
@@ -184,7 +184,7 @@ class HashTable(pccm.Class, pccm.pybind.PybindClassMixin):
         return code 
 
 
-    @pccm.pybind.mark 
+    @pccm.pybind.mark(nogil=True)
     @_member_func
     def insert(self):
         """ in this function, if values is empty, it will be assigned to zero.
@@ -253,12 +253,13 @@ class HashTable(pccm.Class, pccm.pybind.PybindClassMixin):
                         launcher(tv::hash::insert_split<table_t>, table, key_ptr, value_ptr, size_t(N));
                         """)
         else:
-            code.raw(f"""
-            TV_THROW_RT_ERR("spconv not compiled with cuda, don't support cuda");
-            """)
+            with code.else_():
+                code.raw(f"""
+                TV_THROW_RT_ERR("spconv not compiled with cuda, don't support cuda");
+                """)
         return code 
 
-    @pccm.pybind.mark 
+    @pccm.pybind.mark(nogil=True)
     @_member_func
     def query(self):
         """query keys, save to values, and save is_empty to is_empty
@@ -326,12 +327,13 @@ class HashTable(pccm.Class, pccm.pybind.PybindClassMixin):
                         launcher(tv::hash::query_split<table_t>, table, key_ptr, value_ptr, is_empty_ptr, size_t(N));
                         """)
         else:
-            code.raw(f"""
-            TV_THROW_RT_ERR("spconv not compiled with cuda, don't support cuda");
-            """)
+            with code.else_():
+                code.raw(f"""
+                TV_THROW_RT_ERR("spconv not compiled with cuda, don't support cuda");
+                """)
         return code 
 
-    @pccm.pybind.mark 
+    @pccm.pybind.mark(nogil=True)
     @_member_func
     def assign_arange_(self):
         """ this function assign "arange(NumItem)" to table values.
@@ -384,12 +386,13 @@ class HashTable(pccm.Class, pccm.pybind.PybindClassMixin):
                         launcher(tv::hash::assign_arange_split<table_t, Kunsigned>, table, count_ptr);
                         """)
         else:
-            code.raw(f"""
-            TV_THROW_RT_ERR("spconv not compiled with cuda, don't support cuda");
-            """)
+            with code.else_():
+                code.raw(f"""
+                TV_THROW_RT_ERR("spconv not compiled with cuda, don't support cuda");
+                """)
         return code 
 
-    @pccm.pybind.mark 
+    @pccm.pybind.mark(nogil=True)
     @_member_func
     def size_cpu(self):
         """ this function can only be used to get cpu hash table size.
@@ -409,7 +412,7 @@ class HashTable(pccm.Class, pccm.pybind.PybindClassMixin):
         return code.ret("int64_t")
 
 
-    @pccm.pybind.mark 
+    @pccm.pybind.mark(nogil=True)
     @_member_func
     def items(self):
         """get items.
@@ -477,12 +480,13 @@ class HashTable(pccm.Class, pccm.pybind.PybindClassMixin):
                         launcher(tv::hash::iterate_table_split<table_t, Kunsigned>, table, key_ptr, value_ptr, size_t(N), count_ptr);
                         """)
         else:
-            code.raw(f"""
-            TV_THROW_RT_ERR("spconv not compiled with cuda, don't support cuda");
-            """)
+            with code.else_():
+                code.raw(f"""
+                TV_THROW_RT_ERR("spconv not compiled with cuda, don't support cuda");
+                """)
         return code 
 
-    @pccm.pybind.mark 
+    @pccm.pybind.mark(nogil=True)
     @_member_func
     def insert_exist_keys(self):
         """insert v of given k if k exists. won't insert any new key.
@@ -547,9 +551,10 @@ class HashTable(pccm.Class, pccm.pybind.PybindClassMixin):
                         launcher(insert_exist_keys_kernel<table_t>, table, key_ptr, value_ptr, is_empty_ptr, size_t(N));
                         """)
         else:
-            code.raw(f"""
-            TV_THROW_RT_ERR("spconv not compiled with cuda, don't support cuda");
-            """)
+            with code.else_():
+                code.raw(f"""
+                TV_THROW_RT_ERR("spconv not compiled with cuda, don't support cuda");
+                """)
         return code 
 
     def cpu_map_storage_select(self, k_itemsize: str, v_itemsize: str, res_var: str, code: pccm.FunctionCode):
@@ -25,9 +25,10 @@ from ccimport import compat
 from .pointops import Point2Voxel, Point2VoxelCPU
 from .indices import SparseConvIndicesKernel, CudaCommonKernel, SparseConvIndicesCPU
 from .maxpool import IndiceMaxPool, IndiceMaxPoolCPU
-from .gather import GatherCPU
+from .gather import GatherCPU, GatherGemmScatterCPU
 from .alloc import ExternalAllocator, ThrustAllocator
 from spconv.constants import SPCONV_DIRECT_TABLE_HASH_SIZE_SCALE, AllocKeys
+from spconv.core import CPUHashType
 import re
 import os 
 from cumm.gemm.codeops import dispatch
@@ -585,24 +586,42 @@ class SpconvOps(pccm.Class):
         code.raw(f"""TV_THROW_RT_ERR("unknown ndim", ndim);""")
         return code.ret("int")
 
-    @pccm.pybind.mark
-    @pccm.static_function
-    def generate_conv_inds_cpu(self):
+    def generate_conv_inds_cpu_template(self, csr: bool):
         code = pccm.FunctionCode()
-        code.arg("indices", "tv::Tensor")
-        code.arg("indice_pairs, out_inds, indice_num_per_loc", "tv::Tensor")
+        if csr:
+            code.arg("allocator", "ExternalAllocator&")
+            code.arg("indices, indice_num_per_loc", "tv::Tensor")
+        else:
+            code.arg("indices", "tv::Tensor")
+            code.arg("indice_pairs, out_inds, indice_num_per_loc", "tv::Tensor")
         code.arg("batch_size", "int")
         code.arg("output_dims, input_dims", f"std::vector<int>")
         code.arg("ksize, stride, padding, dilation", f"std::vector<int>")
         code.arg("transposed", f"bool", "false")
+        code.arg("batch_sharded", f"bool", "false")
         code.raw(f"""
         int ndim = indices.dim(1) - 1;
         TV_ASSERT_RT_ERR(output_dims.size() == ndim && input_dims.size() == ndim &&
             ksize.size() == ndim && stride.size() == ndim && dilation.size() == ndim &&
             padding.size() == ndim, "your params size not equal to ndim", ndim);
         """)
-
+        if csr:
+            code.raw(f"""
+            auto alloc_func = [&](std::string name, std::vector<int64_t> shape){{
+                return allocator.empty(name, shape, indices.dtype(), -1);
+            }};
+            """)
+            pair_args = "alloc_func, indices, indice_num_per_loc"
+            func_name = "generate_conv_inds_csr"
+            batch_func_name = "generate_conv_inds_batch_csr"
+        else:
+            pair_args = "indices, indice_pairs, out_inds, indice_num_per_loc"
+            func_name = "generate_conv_inds"
+            batch_func_name = "generate_conv_inds_batch"
         for ndim in self.ndims:
+            func_expr = (f"(batch_sharded && batch_size > 1 ? "
+                         f"SpconvIndicesCPU{ndim}D::{batch_func_name} : "
+                         f"SpconvIndicesCPU{ndim}D::{func_name})")
             code.raw(f"""
             if (ndim == {ndim}){{
                 tv::array<int, {ndim}> output_dims_, input_dims_;
@@ -615,8 +634,7 @@ class SpconvOps(pccm.Class):
                     padding_[i] = padding[i];
                     dilation_[i] = dilation[i];
                 }}
-                return SpconvIndicesCPU{ndim}D::generate_conv_inds(indices,
-                    indice_pairs, out_inds, indice_num_per_loc,
+                return {func_expr}({pair_args},
                     batch_size, output_dims_, input_dims_, 
                     ksize_, stride_, padding_, dilation_, transposed);
             }}
@@ -625,22 +643,62 @@ class SpconvOps(pccm.Class):
 
         return code.ret("int")
 
-    @pccm.pybind.mark
+    @pccm.pybind.mark(nogil=True)
     @pccm.static_function
-    def generate_subm_conv_inds_cpu(self):
+    def generate_conv_inds_cpu(self):
+        """if batch_sharded, every sample is generated in parallel with
+        its own hash table, see generate_subm_conv_inds_cpu_csr.
+        """
+        return self.generate_conv_inds_cpu_template(False)
+
+    @pccm.pybind.mark(nogil=True)
+    @pccm.static_function
+    def generate_conv_inds_cpu_csr(self):
+        """pairs are allocated by allocator with exact size and stored
+        in csr format: [2, total], see generate_subm_conv_inds_cpu_csr.
+        """
+        return self.generate_conv_inds_cpu_template(True)
+
+    def generate_subm_conv_inds_cpu_template(self, csr: bool):
         code = pccm.FunctionCode()
-        code.arg("indices", "tv::Tensor")
-        code.arg("indice_pairs, out_inds, indice_num_per_loc", "tv::Tensor")
+        if csr:
+            code.arg("allocator", "ExternalAllocator&")
+            code.arg("indices, indice_num_per_loc", "tv::Tensor")
+        else:
+            code.arg("indices", "tv::Tensor")
+            code.arg("indice_pairs, out_inds, indice_num_per_loc", "tv::Tensor")
         code.arg("batch_size", "int")
         code.arg("input_dims", f"std::vector<int>")
         code.arg("ksize, dilation", f"std::vector<int>")
+        code.arg("hash_type", "int", f"{CPUHashType.Auto.value}")
+        if csr:
+            code.arg("half", "bool", "false")
+        code.arg("batch_sharded", f"bool", "false")
 
         code.raw(f"""
         int ndim = indices.dim(1) - 1;
         TV_ASSERT_RT_ERR(input_dims.size() == ndim &&
             ksize.size() == ndim && dilation.size() == ndim, "your params size not equal to ndim", ndim);
         """)
+        if csr:
+            code.raw(f"""
+            auto alloc_func = [&](std::string name, std::vector<int64_t> shape){{
+                return allocator.empty(name, shape, indices.dtype(), -1);
+            }};
+            """)
+            pair_args = "alloc_func, indices, indice_num_per_loc"
+            func_name = "generate_subm_conv_inds_csr"
+            batch_func_name = "generate_subm_conv_inds_batch_csr"
+            hash_args = "hash_type, half"
+        else:
+            pair_args = "indices, indice_pairs, out_inds, indice_num_per_loc"
+            func_name = "generate_subm_conv_inds"
+            batch_func_name = "generate_subm_conv_inds_batch"
+            hash_args = "hash_type"
         for ndim in self.ndims:
+            func_expr = (f"(batch_sharded && batch_size > 1 ? "
+                         f"SpconvIndicesCPU{ndim}D::{batch_func_name} : "
+                         f"SpconvIndicesCPU{ndim}D::{func_name})")
             code.raw(f"""
             if (ndim == {ndim}){{
                 tv::array<int, {ndim}> input_dims_;
@@ -650,15 +708,36 @@ class SpconvOps(pccm.Class):
                     ksize_[i] = ksize[i];
                     dilation_[i] = dilation[i];
                 }}
-                return SpconvIndicesCPU{ndim}D::generate_subm_conv_inds(indices,
-                    indice_pairs, out_inds, indice_num_per_loc,
+                return {func_expr}({pair_args},
                     batch_size, input_dims_, 
-                    ksize_, dilation_);
+                    ksize_, dilation_, {hash_args});
             }}
             """)
         code.raw(f"""TV_THROW_RT_ERR("unknown ndim", ndim);""")
         return code.ret("int")
 
+    @pccm.pybind.mark(nogil=True)
+    @pccm.static_function
+    def generate_subm_conv_inds_cpu(self):
+        """if batch_sharded, every sample is generated in parallel with
+        its own hash table, see generate_subm_conv_inds_cpu_csr.
+        """
+        return self.generate_subm_conv_inds_cpu_template(False)
+
+    @pccm.pybind.mark(nogil=True)
+    @pccm.static_function
+    def generate_subm_conv_inds_cpu_csr(self):
+        """generate subm pairs in csr format. pair is allocated by
+        allocator (AllocKeys.PairFwd) with shape [2, total], pairs of
+        offset k are stored in [offset[k], offset[k] + indice_num_per_loc[k]),
+        offset = exclusive cumsum of indice_num_per_loc. center (identity)
+        pairs are not stored. if half, only offsets before center are
+        stored, pairs of offset kv - 1 - k are pairs of k with in/out
+        swapped. if batch_sharded, every sample is generated in parallel
+        with its own hash table.
+        """
+        return self.generate_subm_conv_inds_cpu_template(True)
+
     @pccm.pybind.mark
     @_STATIC_FUNCTION
     def maxpool_forward(self):
@@ -876,7 +955,7 @@ class SpconvOps(pccm.Class):
         """)
         return code
 
-    @pccm.pybind.mark
+    @pccm.pybind.mark(nogil=True)
     @pccm.static_function
     def maxpool_forward_cpu(self):
         code = pccm.FunctionCode()
@@ -890,7 +969,7 @@ class SpconvOps(pccm.Class):
         """)
         return code
 
-    @pccm.pybind.mark
+    @pccm.pybind.mark(nogil=True)
     @pccm.static_function
     def maxpool_backward_cpu(self):
         code = pccm.FunctionCode()
@@ -906,7 +985,7 @@ class SpconvOps(pccm.Class):
         """)
         return code
 
-    @pccm.pybind.mark
+    @pccm.pybind.mark(nogil=True)
     @pccm.static_function
     def gather_cpu(self):
         code = pccm.FunctionCode()
@@ -919,7 +998,7 @@ class SpconvOps(pccm.Class):
         """)
         return code
 
-    @pccm.pybind.mark
+    @pccm.pybind.mark(nogil=True)
     @pccm.static_function
     def scatter_add_cpu(self):
         code = pccm.FunctionCode()
@@ -932,6 +1011,152 @@ class SpconvOps(pccm.Class):
         """)
         return code
 
+    @pccm.pybind.mark(nogil=True)
+    @pccm.static_function
+    def pack_filters_cpu(self):
+        code = pccm.FunctionCode()
+        code.arg("filters", "tv::Tensor")
+        code.arg("all_w_is_krsc, filter_hwio", "bool")
+        code.arg("transposed", "bool", "false")
+        code.add_dependency(GatherGemmScatterCPU)
+        code.raw(f"""
+        return GatherGemmScatterCPU::pack_filters(filters, all_w_is_krsc, filter_hwio, transposed);
+        """)
+        return code.ret("tv::Tensor")
+
+    @pccm.pybind.mark(nogil=True)
+    @pccm.static_function
+    def indice_conv_cpu(self):
+        code = pccm.FunctionCode()
+        code.arg("out, features, filters_packed", "tv::Tensor")
+        code.arg("indice_pairs, indice_pair_num", "tv::Tensor")
+        code.arg("inverse, subm, subm_half", "bool")
+        code.arg("tile_size", "int", "128")
+        code.arg("bias", "tv::Tensor", "tv::Tensor()",
+                 "cumm.tensorview.Tensor = Tensor()")
+        code.arg("output_add", "tv::Tensor", "tv::Tensor()",
+                 "cumm.tensorview.Tensor = Tensor()")
+        code.arg("act_type", "tv::gemm::Activation", "tv::gemm::Activation::kNone", 
+                 "cumm.tensorview.gemm.Activation = Activation.None_")
+        code.arg("act_alpha", "float", "0.0")
+        code.add_dependency(GatherGemmScatterCPU)
+        code.raw(f"""
+        return GatherGemmScatterCPU::indice_conv(out, features, filters_packed, 
+            indice_pairs, indice_pair_num, inverse, subm, subm_half, tile_size, bias, 
+            output_add, act_type, act_alpha);
+        """)
+        return code
+
+    @pccm.pybind.mark(nogil=True)
+    @pccm.static_function
+    def indice_conv_weight_grad_cpu(self):
+        code = pccm.FunctionCode()
+        code.arg("dfilters, features, out_bp", "tv::Tensor")
+        code.arg("indice_pairs, indice_pair_num", "tv::Tensor")
+        code.arg("all_w_is_krsc, filter_hwio, inverse, subm, subm_half", "bool")
+        code.arg("tile_size", "int", "128")
+        code.add_dependency(GatherGemmScatterCPU)
+        code.raw(f"""
+        return GatherGemmScatterCPU::indice_conv_weight_grad(dfilters, features, out_bp, 
+            indice_pairs, indice_pair_num, all_w_is_krsc, filter_hwio, 
+            inverse, subm, subm_half, tile_size);
+        """)
+        return code
+
+    @pccm.pybind.mark(nogil=True)
+    @pccm.static_function
+    def indice_conv_grouped_cpu(self):
+        code = pccm.FunctionCode()
+        code.arg("out, features, filters_packed", "tv::Tensor")
+        code.arg("indice_pairs, indice_pair_num", "tv::Tensor")
+        code.arg("inverse, subm, subm_half", "bool")
+        code.arg("tile_size", "int", "128")
+        code.arg("bias", "tv::Tensor", "tv::Tensor()",
+                 "cumm.tensorview.Tensor = Tensor()")
+        code.arg("output_add", "tv::Tensor", "tv::Tensor()",
+                 "cumm.tensorview.Tensor = Tensor()")
+        code.arg("act_type", "tv::gemm::Activation", "tv::gemm::Activation::kNone", 
+                 "cumm.tensorview.gemm.Activation = Activation.None_")
+        code.arg("act_alpha", "float", "0.0")
+        code.arg("workspace", "tv::Tensor", "tv::Tensor()",
+                 "cumm.tensorview.Tensor = Tensor()")
+        code.add_dependency(GatherGemmScatterCPU)
+        code.raw(f"""
+        return GatherGemmScatterCPU::indice_conv_grouped(out, features, filters_packed, 
+            indice_pairs, indice_pair_num, inverse, subm, subm_half, tile_size, bias, 
+            output_add, act_type, act_alpha, workspace);
+        """)
+        return code
+
+    @pccm.pybind.mark
+    @pccm.static_function
+    def grouped_workspace_size_cpu(self):
+        code = pccm.FunctionCode()
+        code.arg("indice_pairs, indice_pair_num", "tv::Tensor")
+        code.arg("num_out, out_channel", "int")
+        code.arg("dtype", "int")
+        code.arg("inverse, subm, subm_half", "bool")
+        code.add_dependency(GatherGemmScatterCPU)
+        code.raw(f"""
+        return GatherGemmScatterCPU::grouped_workspace_size(indice_pairs, indice_pair_num, 
+            num_out, out_channel, tv::DType(dtype), inverse, subm, subm_half);
+        """)
+        return code.ret("int64_t")
+
+    @pccm.pybind.mark(nogil=True)
+    @pccm.static_function
+    def neighbor_table_cpu(self):
+        code = pccm.FunctionCode()
+        code.arg("indice_pairs, indice_pair_num", "tv::Tensor")
+        code.arg("num_out", "int")
+        code.arg("inverse, subm, subm_half", "bool")
+        code.arg("out", "tv::Tensor", "tv::Tensor()",
+                 "cumm.tensorview.Tensor = Tensor()")
+        code.add_dependency(GatherGemmScatterCPU)
+        code.raw(f"""
+        return GatherGemmScatterCPU::neighbor_table(indice_pairs, indice_pair_num, 
+            num_out, inverse, subm, subm_half, out);
+        """)
+        return code.ret("tv::Tensor")
+
+    @pccm.pybind.mark(nogil=True)
+    @pccm.static_function
+    def indice_conv_output_stationary_cpu(self):
+        code = pccm.FunctionCode()
+        code.arg("out, features, filters_packed, table", "tv::Tensor")
+        code.arg("tile_size", "int", "128")
+        code.arg("bias", "tv::Tensor", "tv::Tensor()",
+                 "cumm.tensorview.Tensor = Tensor()")
+        code.arg("output_add", "tv::Tensor", "tv::Tensor()",
+                 "cumm.tensorview.Tensor = Tensor()")
+        code.arg("act_type", "tv::gemm::Activation", "tv::gemm::Activation::kNone", 
+                 "cumm.tensorview.gemm.Activation = Activation.None_")
+        code.arg("act_alpha", "float", "0.0")
+        code.add_dependency(GatherGemmScatterCPU)
+        code.raw(f"""
+        return GatherGemmScatterCPU::indice_conv_output_stationary(out, features, 
+            filters_packed, table, tile_size, bias, output_add, act_type, act_alpha);
+        """)
+        return code
+
+    @pccm.pybind.mark(nogil=True)
+    @pccm.static_function
+    def epilogue_cpu(self):
+        code = pccm.FunctionCode()
+        code.arg("out", "tv::Tensor")
+        code.arg("bias", "tv::Tensor", "tv::Tensor()",
+                 "cumm.tensorview.Tensor = Tensor()")
+        code.arg("output_add", "tv::Tensor", "tv::Tensor()",
+                 "cumm.tensorview.Tensor = Tensor()")
+        code.arg("act_type", "tv::gemm::Activation", "tv::gemm::Activation::kNone", 
+                 "cumm.tensorview.gemm.Activation = Activation.None_")
+        code.arg("act_alpha", "float", "0.0")
+        code.add_dependency(GatherGemmScatterCPU)
+        code.raw(f"""
+        return GatherGemmScatterCPU::epilogue(out, bias, output_add, act_type, act_alpha);
+        """)
+        return code
+
     def sort_1d_by_key_allocator_template(self, use_allocator: bool):
         code = pccm.FunctionCode()
         if CUMM_CPU_ONLY_BUILD:
@@ -1384,7 +1609,7 @@ class SpconvOps(pccm.Class):
             "std::tuple<std::vector<float>, std::vector<int>, std::vector<int>, std::vector<float>>"
         )
 
-    @pccm.pybind.mark
+    @pccm.pybind.mark(nogil=True)
     @pccm.static_function
     def point2voxel_cpu(self):
         code = pccm.FunctionCode()
@@ -2015,7 +2240,7 @@ Your Conv Params: )" << "\\n";
         """)
         return code.ret("std::tuple<tv::Tensor, int>")
 
-    @pccm.pybind.mark 
+    @pccm.pybind.mark(nogil=True)
     @pccm.static_function
     def get_indice_pairs(self):
         code = pccm.code()
@@ -2029,11 +2254,16 @@ Your Conv Params: )" << "\\n";
         code.arg("stream_int", f"std::uintptr_t", "0")
         code.arg("num_out_act_bound", f"int", "-1")
         code.arg("num_input_act_bound", f"int", "-1")
+        code.arg("cpu_hash_type", f"int", f"{CPUHashType.Auto.value}")
+        code.arg("csr", f"bool", "false")
+        code.arg("subm_half", f"bool", "false")
+        code.arg("cpu_batch_sharded", f"bool", "false")
 
         
         code.raw(f"""
         int kv = std::accumulate(ksize.begin(), ksize.end(), 1, std::multiplies<int>());
         auto conv_algo = static_cast<tv::gemm::SparseConvAlgo>(algo);
+        TV_ASSERT_RT_ERR(!csr || indices.is_cpu(), "csr kernel map only support cpu");
         TV_ASSERT_RT_ERR(conv_algo == tv::gemm::SparseConvAlgo::kNative, "only support kNative");
         if (num_out_act_bound > 0){{
             TV_ASSERT_RT_ERR(num_input_act_bound > 0 && indices.dim(0) <= num_input_act_bound, 
@@ -2068,9 +2298,11 @@ Your Conv Params: )" << "\\n";
             // we need stable pair stride for bounded output
             num_act_in_bounded = num_input_act_bound;
         }}
-        pair = allocator.full_int({pccm.literal(AllocKeys.PairFwd)}, 
-            {{2, kv, num_act_in_bounded}}, -1, indices.dtype(), indices.device(), stream_int);
-        
+        if (!csr){{
+            // csr pairs are allocated in generator with exact size.
+            pair = allocator.full_int({pccm.literal(AllocKeys.PairFwd)}, 
+                {{2, kv, num_act_in_bounded}}, -1, indices.dtype(), indices.device(), stream_int);
+        }}
         auto indice_num_per_loc = allocator.zeros({pccm.literal(AllocKeys.IndiceNumPerLoc)}, 
             {{kv}}, indices.dtype(), indices.device(), stream_int);
         tv::Tensor out_inds;
@@ -2079,9 +2311,14 @@ Your Conv Params: )" << "\\n";
         with code.if_("subm"):
             code.raw(f"""
             num_act_out = indices.dim(0);
-            if (indices.is_cpu()){{
+            if (csr){{
+                generate_subm_conv_inds_cpu_csr(allocator, indices, indice_num_per_loc,
+                    batch_size, input_dims, ksize, dilation, cpu_hash_type, subm_half,
+                    cpu_batch_sharded);
+            }}else if (indices.is_cpu()){{
                 generate_subm_conv_inds_cpu(indices, pair, out_inds, indice_num_per_loc,
-                    batch_size, input_dims, ksize, dilation);
+                    batch_size, input_dims, ksize, dilation, cpu_hash_type,
+                    cpu_batch_sharded);
             }}
             """)
             if not CUMM_CPU_ONLY_BUILD:
@@ -2116,13 +2353,18 @@ Your Conv Params: )" << "\\n";
                 """)
         with code.else_():
             code.raw(f"""
-            if (indices.is_cpu()){{
+            if (csr){{
+                TV_ASSERT_RT_ERR(num_out_act_bound <= 0, "cpu algo don't support out bound")
+                num_act_out = generate_conv_inds_cpu_csr(allocator, indices, indice_num_per_loc,
+                    batch_size, out_shape, input_dims, ksize, 
+                    stride, padding, dilation, transposed, cpu_batch_sharded);
+            }}else if (indices.is_cpu()){{
                 TV_ASSERT_RT_ERR(num_out_act_bound <= 0, "cpu algo don't support out bound")
                 out_inds = allocator.empty({pccm.literal(AllocKeys.OutIndices)}, 
                     {{kv * indices.dim(0), indices.dim(1)}}, indices.dtype(), -1);
                 num_act_out = generate_conv_inds_cpu(indices, pair, out_inds, indice_num_per_loc,
                     batch_size, out_shape, input_dims, ksize, 
-                    stride, padding, dilation, transposed);
+                    stride, padding, dilation, transposed, cpu_batch_sharded);
             }}
             """)
             if not CUMM_CPU_ONLY_BUILD:
@@ -8,7 +8,7 @@ from cumm.gemm.algospec.core import (_GEMM_MIN_ARCH_TO_ALGO, GemmAlgo,
 from cumm.gemm.main import GemmMainUnitTest
 from spconv.constants import NDIM_DONT_CARE, SPCONV_BWD_SPLITK, AllocKeys
 from spconv.core import AlgoHint, ConvAlgo
-from spconv.csrc.sparse.gather import GatherCPU
+from spconv.csrc.sparse.gather import GatherGemmScatterCPU
 
 from .alloc import ExternalAllocator
 from cumm.common import CompileInfo
@@ -1504,10 +1504,10 @@ class ConvGemmOps(pccm.ParameterizedClass):
     def indice_conv(self):
         """1. this function need to take a out features
         that from subm first mm.
-        2. this function don't support CPU.
+        2. cpu uses fused gather-gemm-scatter kernel.
         """
         code = pccm.code()
-        code.add_dependency(GatherCPU)
+        code.add_dependency(GatherGemmScatterCPU)
 
         code.arg("allocator", "ExternalAllocator&")
         code.arg("ext_mm", "ExternalSpconvMatmul&")
@@ -1605,30 +1605,12 @@ class ConvGemmOps(pccm.ParameterizedClass):
         auto pair_out = indice_pairs[int(!inverse)];
         if (features.is_cpu()){{
             TV_ASSERT_RT_ERR(filters.is_cpu() && indice_pairs.is_cpu(), "error");
-            auto inp_buffer = allocator.empty({pccm.literal(AllocKeys.InpBuffer)}, 
-                {{maxnhot, features.dim(1)}}, features.dtype(), -1);
-            auto out_buffer = allocator.empty({pccm.literal(AllocKeys.OutBuffer)}, 
-                {{maxnhot, out_features.dim(1)}}, out_features.dtype(), -1);
-            for (int i = 0; i < kv; ++i){{
-                int nhot = indice_pair_num_cpu_ptr[i];
-                if (subm && i == kv_center){{
-                    continue;
-                }}
-                if (subm && i > kv_center){{
-                    nhot = indice_pair_num_cpu_ptr[kv - i - 1];
-                }}
-                if (nhot <= 0){{
-                    continue;
-                }}
-                auto inp_indices = pair_in[i].slice_first_axis(0, nhot);
-                auto out_indices = pair_out[i].slice_first_axis(0, nhot);
-                GatherCPU::gather(inp_buffer, a, inp_indices);
-                ext_mm.indice_conv_cpu_gemm({pccm.literal(AllocKeys.InpBuffer)}, 
-                    {pccm.literal(AllocKeys.OutBuffer)},
-                    {pccm.literal(AllocKeys.Filters)}, all_w_is_krsc,
-                    is_KC_not_CK, nhot, i);
-                GatherCPU::scatter_add(c, out_buffer, out_indices);
-            }}
+            // fused tiled gather-gemm-scatter, no per-offset buffers.
+            auto filters_packed = GatherGemmScatterCPU::pack_filters(filters, 
+                all_w_is_krsc, filter_hwio, false);
+            // cpp ops only get dense pairs, they are never half.
+            GatherGemmScatterCPU::indice_conv(c, a, filters_packed, indice_pairs,
+                indice_pair_num_cpu, inverse, subm, false);
             return;
         }}
 
@@ -1750,7 +1732,7 @@ class ConvGemmOps(pccm.ParameterizedClass):
     @pccm.static_function
     def indice_conv_backward(self):
         code = pccm.code()
-        code.add_dependency(GatherCPU)
+        code.add_dependency(GatherGemmScatterCPU)
 
         code.arg("allocator", "ExternalAllocator&")
         code.arg("ext_mm", "ExternalSpconvMatmul&")
@@ -1830,32 +1812,14 @@ class ConvGemmOps(pccm.ParameterizedClass):
 
         if (features.is_cpu()){{
             TV_ASSERT_RT_ERR(filters.is_cpu() && indice_pairs.is_cpu(), "error");
-            auto inp_buffer = allocator.empty({pccm.literal(AllocKeys.InpBuffer)}, 
-                {{maxnhot, features.dim(1)}}, features.dtype(), -1);
-            auto out_buffer = allocator.empty({pccm.literal(AllocKeys.OutBuffer)}, 
-                {{maxnhot, out_bp.dim(1)}}, out_bp.dtype(), -1);
-            for (int i = 0; i < kv; ++i){{
-                int nhot = indice_pair_num_cpu_ptr[i];
-                if (subm && i == kv_center){{
-                    continue;
-                }}
-                if (subm && i > kv_center){{
-                    nhot = indice_pair_num_cpu_ptr[kv - i - 1];
-                }}
-                if (nhot <= 0){{
-                    continue;
-                }}
-                auto inp_indices = pair_in[i].slice_first_axis(0, nhot);
-                auto out_indices = pair_out[i].slice_first_axis(0, nhot);
-                GatherCPU::gather(inp_buffer, features, inp_indices);
-                GatherCPU::gather(out_buffer, out_bp, out_indices);
-                ext_mm.indice_conv_bwd_cpu_gemm({pccm.literal(AllocKeys.InpBuffer)}, 
-                    {pccm.literal(AllocKeys.OutBuffer)}, 
-                    {pccm.literal(AllocKeys.Filters)},
-                    {pccm.literal(AllocKeys.DFilters)}, all_w_is_krsc,
-                    is_KC_not_CK, nhot, i);
-                GatherCPU::scatter_add(din, inp_buffer, inp_indices);
-            }}
+            // dgrad is forward with in/out swapped and transposed filters.
+            auto filters_packed_t = GatherGemmScatterCPU::pack_filters(filters, 
+                all_w_is_krsc, filter_hwio, true);
+            GatherGemmScatterCPU::indice_conv(din, out_bp, filters_packed_t, 
+                indice_pairs, indice_pair_num_cpu, !inverse, subm, false);
+            GatherGemmScatterCPU::indice_conv_weight_grad(dfilters, features, out_bp,
+                indice_pairs, indice_pair_num_cpu, all_w_is_krsc, filter_hwio,
+                inverse, subm, false);
             return;
         }}
         """)
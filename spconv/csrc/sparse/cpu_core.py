@@ -14,7 +14,8 @@
 
 import pccm
 from ccimport import compat
-from cumm.common import TensorView
+from cumm import dtypes
+from cumm.common import TensorView, TslRobinMap
 
 class OMPLib(pccm.Class):
     def __init__(self):
@@ -27,3 +28,204 @@ class OMPLib(pccm.Class):
             self.build_meta.add_public_cflags("g++", "-fopenmp")
             self.build_meta.add_public_cflags("clang++", "-fopenmp")
             self.build_meta.add_ldflags("g++,clang++", "-fopenmp")
+
+
+class CPUHashTableBase(pccm.ParameterizedClass):
+    """all cpu hash tables used by indice generators have same interface:
+    insert(key, value) and lookup(key), lookup return -1 if key not exists.
+    keys must be non-negative int64.
+    """
+    def __init__(self, dtype_value: dtypes.DType):
+        super().__init__()
+        self.add_dependency(TensorView)
+        self.dtype_value = dtype_value
+
+
+class UnorderedMapTableCPU(CPUHashTableBase):
+    def __init__(self, dtype_value: dtypes.DType):
+        super().__init__(dtype_value)
+        self.add_include("unordered_map")
+        self.add_member("map_", f"std::unordered_map<int64_t, {dtype_value}>")
+
+    @pccm.constructor(header_only=True)
+    def ctor(self):
+        code = pccm.FunctionCode()
+        code.arg("num_items", "int64_t")
+        code.raw(f"""
+        map_.reserve(num_items);
+        """)
+        return code
+
+    @pccm.member_function(header_only=True)
+    def insert(self):
+        code = pccm.FunctionCode()
+        code.arg("key", "int64_t")
+        code.arg("value", f"{self.dtype_value}")
+        code.raw(f"""
+        map_.insert({{key, value}});
+        """)
+        return code
+
+    @pccm.member_function(header_only=True, const=True)
+    def lookup(self):
+        code = pccm.FunctionCode()
+        code.arg("key", "int64_t")
+        code.raw(f"""
+        auto iter = map_.find(key);
+        return iter == map_.end() ? -1 : iter->second;
+        """)
+        return code.ret(f"{self.dtype_value}")
+
+
+class RobinMapTableCPU(CPUHashTableBase):
+    def __init__(self, dtype_value: dtypes.DType):
+        super().__init__(dtype_value)
+        self.add_dependency(TslRobinMap)
+        self.add_member("map_", f"tsl::robin_map<int64_t, {dtype_value}>")
+
+    @pccm.constructor(header_only=True)
+    def ctor(self):
+        code = pccm.FunctionCode()
+        code.arg("num_items", "int64_t")
+        code.raw(f"""
+        map_.reserve(num_items);
+        """)
+        return code
+
+    @pccm.member_function(header_only=True)
+    def insert(self):
+        code = pccm.FunctionCode()
+        code.arg("key", "int64_t")
+        code.arg("value", f"{self.dtype_value}")
+        code.raw(f"""
+        map_.insert({{key, value}});
+        """)
+        return code
+
+    @pccm.member_function(header_only=True, const=True)
+    def lookup(self):
+        code = pccm.FunctionCode()
+        code.arg("key", "int64_t")
+        code.raw(f"""
+        auto iter = map_.find(key);
+        return iter == map_.end() ? -1 : iter->second;
+        """)
+        return code.ret(f"{self.dtype_value}")
+
+
+class LinearProbingTableCPU(CPUHashTableBase):
+    """flat open addressing table. capacity is reserved in ctor
+    (power of two, at least 2x num_items), so insert never rehash and
+    lookup only touch contiguous memory.
+    """
+    def __init__(self, dtype_value: dtypes.DType):
+        super().__init__(dtype_value)
+        self.add_member("keys_", "std::vector<int64_t>")
+        self.add_member("values_", f"std::vector<{dtype_value}>")
+        self.add_member("mask_", "int64_t")
+
+    @pccm.constructor(header_only=True)
+    def ctor(self):
+        code = pccm.FunctionCode()
+        code.arg("num_items", "int64_t")
+        code.raw(f"""
+        int64_t capacity = 16;
+        while (capacity < num_items * 2){{
+            capacity *= 2;
+        }}
+        keys_.assign(capacity, -1);
+        values_.resize(capacity);
+        mask_ = capacity - 1;
+        """)
+        return code
+
+    @pccm.static_function(header_only=True)
+    def hash(self):
+        code = pccm.FunctionCode()
+        code.arg("key", "int64_t")
+        # murmur3 fmix64
+        code.raw(f"""
+        uint64_t k = key;
+        k ^= k >> 33;
+        k *= 0xff51afd7ed558ccdull;
+        k ^= k >> 33;
+        k *= 0xc4ceb9fe1a85ec53ull;
+        k ^= k >> 33;
+        return k;
+        """)
+        return code.ret("uint64_t")
+
+    @pccm.member_function(header_only=True)
+    def insert(self):
+        code = pccm.FunctionCode()
+        code.arg("key", "int64_t")
+        code.arg("value", f"{self.dtype_value}")
+        code.raw(f"""
+        int64_t slot = hash(key) & mask_;
+        while (keys_[slot] != -1 && keys_[slot] != key){{
+            slot = (slot + 1) & mask_;
+        }}
+        if (keys_[slot] == -1){{
+            keys_[slot] = key;
+            values_[slot] = value;
+        }}
+        """)
+        return code
+
+    @pccm.member_function(header_only=True, const=True)
+    def lookup(self):
+        code = pccm.FunctionCode()
+        code.arg("key", "int64_t")
+        code.raw(f"""
+        int64_t slot = hash(key) & mask_;
+        while (true){{
+            auto k = keys_[slot];
+            if (k == key){{
+                return values_[slot];
+            }}
+            if (k == -1){{
+                return -1;
+            }}
+            slot = (slot + 1) & mask_;
+        }}
+        """)
+        return code.ret(f"{self.dtype_value}")
+
+
+class DirectTableCPU(CPUHashTableBase):
+    """dense table indexed by key directly, only used when
+    batch_size * prod(spatial_shape) is small.
+    """
+    def __init__(self, dtype_value: dtypes.DType):
+        super().__init__(dtype_value)
+        self.add_member("values_", f"std::vector<{dtype_value}>")
+
+    @pccm.constructor(header_only=True)
+    def ctor(self):
+        code = pccm.FunctionCode()
+        code.arg("volume", "int64_t")
+        code.raw(f"""
+        values_.assign(volume, -1);
+        """)
+        return code
+
+    @pccm.member_function(header_only=True)
+    def insert(self):
+        code = pccm.FunctionCode()
+        code.arg("key", "int64_t")
+        code.arg("value", f"{self.dtype_value}")
+        code.raw(f"""
+        if (values_[key] == -1){{
+            values_[key] = value;
+        }}
+        """)
+        return code
+
+    @pccm.member_function(header_only=True, const=True)
+    def lookup(self):
+        code = pccm.FunctionCode()
+        code.arg("key", "int64_t")
+        code.raw(f"""
+        return values_[key];
+        """)
+        return code.ret(f"{self.dtype_value}")
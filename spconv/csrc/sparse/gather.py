@@ -45,10 +45,20 @@ class GatherCPU(pccm.Class):
             T *buffer_data = out.data_ptr<T>();
             const T *features_data = in.data_ptr<const T>();
             tv::kernel_1d(out.device(), nhot, [&](int begin, int end, int step){{
-                for (int i = begin; i < end; i += step) {{
-                    std::memcpy(buffer_data + i * channel,
-                                features_data + indices_data[i] * channel,
-                                sizeof(T) * channel);
+                // consecutive indices (e.g. pairs sorted by input) are
+                // copied as one run.
+                for (int i = begin; i < end;) {{
+                    int index = indices_data[i];
+                    int run = 1;
+                    if (step == 1){{
+                        while (i + run < end && indices_data[i + run] == index + run){{
+                            ++run;
+                        }}
+                    }}
+                    std::memcpy(buffer_data + int64_t(i) * channel,
+                                features_data + int64_t(index) * channel,
+                                sizeof(T) * channel * run);
+                    i += run * step;
                 }}
             }});
         }});
@@ -70,15 +80,1074 @@ class GatherCPU(pccm.Class):
             auto indices_data = inds.data_ptr<const int>();
             const T *buffer_data = in.data_ptr<const T>();
             T *features_data = out.data_ptr<T>();
-            const T *buf = in.data_ptr<const T>();
-            T *out_ptr = out.data_ptr<T>();
             tv::kernel_1d(out.device(), nhot, [&](int begin, int end, int step){{
-                for (int i = begin; i < end; i += step) {{
-                    buf = buffer_data + i * channel;
-                    out_ptr = features_data + indices_data[i] * channel;
-                    for (int j = 0; j < channel; ++j) {{
+                // consecutive indices (e.g. pairs sorted by output) are
+                // added as one contiguous run.
+                for (int i = begin; i < end;) {{
+                    int index = indices_data[i];
+                    int run = 1;
+                    if (step == 1){{
+                        while (i + run < end && indices_data[i + run] == index + run){{
+                            ++run;
+                        }}
+                    }}
+                    const T *buf = buffer_data + int64_t(i) * channel;
+                    T *out_ptr = features_data + int64_t(index) * channel;
+                    int64_t run_size = int64_t(run) * channel;
+                    for (int64_t j = 0; j < run_size; ++j) {{
                         out_ptr[j] = out_ptr[j] + buf[j];
                     }}
+                    i += run * step;
+                }}
+            }});
+        }});
+        """)
+        return code
+
+
+class GatherGemmScatterCPU(pccm.Class):
+    """fused gather-gemm-scatter for native cpu sparse conv.
+    pairs of one kernel offset are split to tiles, each tile is gathered to
+    a small scratch buffer, multiplied with packed weight of this offset
+    and added to output rows directly. output rows of one offset are
+    unique, so tiles run in parallel without atomics.
+    fp16/bf16 tiles and filters are converted to fp32 on gather, so gemm
+    always accumulates in fp32 with simd kernels.
+    inference epilogue (bias, residual add and activation) is applied when
+    output rows are written for the last time.
+    """
+    def __init__(self):
+        super().__init__()
+        if CUMM_CPU_ONLY_BUILD:
+            self.add_dependency(OMPLib)
+        self.add_dependency(TensorView, GemmDTypes)
+        self.add_include("tensorview/parallel/all.h")
+        self.add_include("tensorview/gemm/core/constants.h")
+        self.add_include("vector", "tuple", "type_traits", "cstring", "memory", "cmath")
+        self.add_global_code("""
+#ifdef _OPENMP
+#include <omp.h>
+#endif
+#if defined(__GNUC__) && (defined(__x86_64__) || defined(__i386__))
+#define SPCONV_CPU_GEMM_SIMD 1
+#include <immintrin.h>
+#define SPCONV_CPU_GEMM_FORCE_INLINE __attribute__((always_inline)) inline
+#define SPCONV_CPU_GEMM_TARGET_AVX2 __attribute__((target("avx2,fma,f16c")))
+#define SPCONV_CPU_GEMM_TARGET_AVX512 __attribute__((target("avx512f")))
+#else
+#define SPCONV_CPU_GEMM_SIMD 0
+#define SPCONV_CPU_GEMM_FORCE_INLINE inline
+#define SPCONV_CPU_GEMM_TARGET_AVX2
+#define SPCONV_CPU_GEMM_TARGET_AVX512
+#endif
+""")
+
+    def _epilogue_args(self, code: pccm.FunctionCode):
+        code.arg("bias", "tv::Tensor", "tv::Tensor()",
+                 "cumm.tensorview.Tensor = Tensor()")
+        code.arg("output_add", "tv::Tensor", "tv::Tensor()",
+                 "cumm.tensorview.Tensor = Tensor()")
+        code.arg("act_type", "tv::gemm::Activation", "tv::gemm::Activation::kNone", 
+                 "cumm.tensorview.gemm.Activation = Activation.None_")
+        code.arg("act_alpha", "float", "0.0")
+
+    @pccm.static_function
+    def pair_slices(self):
+        """get (offset, in_inds, out_inds, nhot) of every non-empty kernel
+        offset from dense ([2, kv, N]) or csr ([2, total]) pairs.
+        if subm_half, csr subm pairs only store offsets before center and
+        pairs of offset kv - 1 - k are pairs of k with in/out swapped.
+        """
+        code = pccm.FunctionCode()
+        code.arg("indice_pairs, indice_pair_num", "tv::Tensor")
+        code.arg("inverse, subm, subm_half", "bool")
+        code.raw(f"""
+        std::vector<std::tuple<int, const int*, const int*, int>> res;
+        int kv = indice_pair_num.dim(0);
+        int kv_center = kv / 2;
+        auto pair_num_ptr = indice_pair_num.data_ptr<const int>();
+        bool is_csr = indice_pairs.ndim() == 2;
+        std::vector<int64_t> offsets(kv);
+        int64_t total = 0;
+        for (int i = 0; i < kv; ++i){{
+            offsets[i] = total;
+            total += pair_num_ptr[i];
+        }}
+        TV_ASSERT_RT_ERR(!subm_half || (subm && is_csr), "half pairs must be csr subm pairs");
+        if (is_csr){{
+            // center pairs of csr subm pairs aren't stored.
+            int64_t stored = subm_half ? offsets[kv_center] : total;
+            TV_ASSERT_RT_ERR(indice_pairs.dim(1) == stored, "csr pairs don't match indice_pair_num, subm_half:", subm_half);
+        }}
+        int64_t pair_stride = is_csr ? indice_pairs.dim(1) : indice_pairs.dim(1) * indice_pairs.dim(2);
+        auto pair_ptr = indice_pairs.data_ptr<const int>();
+        for (int i = 0; i < kv; ++i){{
+            int nhot = pair_num_ptr[i];
+            if (subm && i == kv_center){{
+                continue;
+            }}
+            if (subm && i > kv_center){{
+                nhot = pair_num_ptr[kv - i - 1];
+            }}
+            if (nhot <= 0){{
+                continue;
+            }}
+            int j = i;
+            bool swap = subm_half && i > kv_center;
+            if (swap){{
+                j = kv - 1 - i;
+            }}
+            int64_t start = is_csr ? offsets[j] : int64_t(j) * indice_pairs.dim(2);
+            const int* in_inds = pair_ptr + int(inverse) * pair_stride + start;
+            const int* out_inds = pair_ptr + int(!inverse) * pair_stride + start;
+            if (swap){{
+                std::swap(in_inds, out_inds);
+            }}
+            res.push_back({{i, in_inds, out_inds, nhot}});
+        }}
+        return res;
+        """)
+        return code.ret(
+            "std::vector<std::tuple<int, const int*, const int*, int>>")
+
+    @pccm.static_function
+    def pack_filters(self):
+        """pack filters (viewed as [kv, K, C], [kv, C, K] or krsc [K, kv, C])
+        to [kv, C, K] (or [kv, K, C] if transposed) so weight rows of one
+        offset are contiguous in gemm.
+        """
+        code = pccm.FunctionCode()
+        code.arg("filters", "tv::Tensor")
+        code.arg("all_w_is_krsc, filter_hwio, transposed", "bool")
+        code.raw(f"""
+        TV_ASSERT_RT_ERR(filters.ndim() == 3 && filters.is_contiguous(), "filters must be contiguous 3d view");
+        int kv, in_channel, out_channel;
+        if (all_w_is_krsc){{
+            out_channel = filters.dim(0);
+            kv = filters.dim(1);
+            in_channel = filters.dim(2);
+        }}else if (filter_hwio){{
+            kv = filters.dim(0);
+            in_channel = filters.dim(1);
+            out_channel = filters.dim(2);
+        }}else{{
+            kv = filters.dim(0);
+            out_channel = filters.dim(1);
+            in_channel = filters.dim(2);
+        }}
+        tv::Tensor res;
+        if (transposed){{
+            res = tv::empty({{kv, out_channel, in_channel}}, filters.dtype(), -1);
+        }}else{{
+            res = tv::empty({{kv, in_channel, out_channel}}, filters.dtype(), -1);
+        }}
+        tv::dispatch<float, double, tv::bfloat16_t, tv::half_t>(filters.dtype(), [&](auto I){{
+            using T = TV_DECLTYPE(I);
+            auto f_ptr = filters.data_ptr<const T>();
+            auto res_ptr = res.data_ptr<T>();
+            for (int i = 0; i < kv; ++i){{
+                for (int c = 0; c < in_channel; ++c){{
+                    for (int k = 0; k < out_channel; ++k){{
+                        int64_t src;
+                        if (all_w_is_krsc){{
+                            src = (int64_t(k) * kv + i) * in_channel + c;
+                        }}else if (filter_hwio){{
+                            src = (int64_t(i) * in_channel + c) * out_channel + k;
+                        }}else{{
+                            src = (int64_t(i) * out_channel + k) * in_channel + c;
+                        }}
+                        int64_t dst;
+                        if (transposed){{
+                            dst = (int64_t(i) * out_channel + k) * in_channel + c;
+                        }}else{{
+                            dst = (int64_t(i) * in_channel + c) * out_channel + k;
+                        }}
+                        res_ptr[dst] = f_ptr[src];
+                    }}
+                }}
+            }}
+        }});
+        return res;
+        """)
+        return code.ret("tv::Tensor")
+
+    @pccm.static_function
+    def cpu_num_threads(self):
+        code = pccm.FunctionCode()
+        code.raw(f"""
+        #ifdef _OPENMP
+        return omp_get_max_threads();
+        #else
+        return 1;
+        #endif
+        """)
+        return code.ret("int")
+
+    @pccm.static_function
+    def cpu_simd_level(self):
+        """0: generic, 1: avx2 + fma + f16c, 2: avx512f + level 1.
+        """
+        code = pccm.FunctionCode()
+        code.raw(f"""
+        #if SPCONV_CPU_GEMM_SIMD
+        // reduced precision rows are converted by f16c in level 1 and 2.
+        static const bool avx2 = __builtin_cpu_supports("avx2") && 
+            __builtin_cpu_supports("fma") && __builtin_cpu_supports("f16c");
+        static const int level = !avx2 ? 0 : (__builtin_cpu_supports("avx512f") ? 2 : 1);
+        return level;
+        #else
+        return 0;
+        #endif
+        """)
+        return code.ret("int")
+
+    @pccm.static_function(attrs=["SPCONV_CPU_GEMM_TARGET_AVX2"])
+    def half_to_float_avx2(self):
+        code = pccm.FunctionCode()
+        code.arg("dst", "float*")
+        code.arg("src", "const uint16_t*")
+        code.arg("n", "int")
+        code.raw(f"""
+        #if SPCONV_CPU_GEMM_SIMD
+        int i = 0;
+        for (; i + 8 <= n; i += 8){{
+            __m128i h = _mm_loadu_si128(reinterpret_cast<const __m128i*>(src + i));
+            _mm256_storeu_ps(dst + i, _mm256_cvtph_ps(h));
+        }}
+        for (; i < n; ++i){{
+            dst[i] = _cvtsh_ss(src[i]);
+        }}
+        #else
+        TV_THROW_RT_ERR("f16c isn't available");
+        #endif
+        """)
+        return code
+
+    @pccm.static_function(attrs=["SPCONV_CPU_GEMM_TARGET_AVX2"])
+    def half_add_float_avx2(self):
+        """dst = half(float(dst) + src)"""
+        code = pccm.FunctionCode()
+        code.arg("dst", "uint16_t*")
+        code.arg("src", "const float*")
+        code.arg("n", "int")
+        code.raw(f"""
+        #if SPCONV_CPU_GEMM_SIMD
+        int i = 0;
+        for (; i + 8 <= n; i += 8){{
+            __m128i h = _mm_loadu_si128(reinterpret_cast<const __m128i*>(dst + i));
+            __m256 v = _mm256_add_ps(_mm256_cvtph_ps(h), _mm256_loadu_ps(src + i));
+            _mm_storeu_si128(reinterpret_cast<__m128i*>(dst + i), 
+                _mm256_cvtps_ph(v, _MM_FROUND_TO_NEAREST_INT));
+        }}
+        for (; i < n; ++i){{
+            dst[i] = _cvtss_sh(_cvtsh_ss(dst[i]) + src[i], _MM_FROUND_TO_NEAREST_INT);
+        }}
+        #else
+        TV_THROW_RT_ERR("f16c isn't available");
+        #endif
+        """)
+        return code
+
+    @pccm.static_function(attrs=["SPCONV_CPU_GEMM_FORCE_INLINE"])
+    def convert_row(self):
+        """copy one row to gemm scratch, reduced precision rows are
+        converted to TAcc so gemm always runs in fp32 (or fp64).
+        """
+        code = pccm.FunctionCode()
+        code.targ("T")
+        code.targ("TAcc")
+        code.arg("dst", "TAcc*")
+        code.arg("src", "const T*")
+        code.arg("channel", "int")
+        code.raw(f"""
+        constexpr bool half_to_f32 = std::is_same<T, tv::half_t>::value && std::is_same<TAcc, float>::value;
+        if (std::is_same<T, TAcc>::value){{
+            std::memcpy(dst, src, sizeof(T) * channel);
+        }}else if (half_to_f32 && cpu_simd_level() > 0){{
+            half_to_float_avx2(reinterpret_cast<float*>(dst), 
+                reinterpret_cast<const uint16_t*>(src), channel);
+        }}else{{
+            for (int c = 0; c < channel; ++c){{
+                dst[c] = TAcc(src[c]);
+            }}
+        }}
+        """)
+        return code
+
+    @pccm.static_function(attrs=["SPCONV_CPU_GEMM_FORCE_INLINE"])
+    def add_row(self):
+        """dst[c] = T(TAcc(dst[c]) + src[c]), rounded once.
+        """
+        code = pccm.FunctionCode()
+        code.targ("T")
+        code.targ("TAcc")
+        code.arg("dst", "T*")
+        code.arg("src", "const TAcc*")
+        code.arg("channel", "int")
+        code.raw(f"""
+        constexpr bool half_to_f32 = std::is_same<T, tv::half_t>::value && std::is_same<TAcc, float>::value;
+        if (half_to_f32 && cpu_simd_level() > 0){{
+            half_add_float_avx2(reinterpret_cast<uint16_t*>(dst), 
+                reinterpret_cast<const float*>(src), channel);
+        }}else{{
+            for (int c = 0; c < channel; ++c){{
+                dst[c] = T(TAcc(dst[c]) + src[c]);
+            }}
+        }}
+        """)
+        return code
+
+    @pccm.static_function(attrs=["SPCONV_CPU_GEMM_FORCE_INLINE"])
+    def epilogue_row(self):
+        """dst[c] = T(act(TAcc(dst[c]) + src[c] + bias[c] + add[c])), rounded
+        once. src, bias and add may be nullptr.
+        """
+        code = pccm.FunctionCode()
+        code.targ("T")
+        code.targ("TAcc")
+        code.arg("dst", "T*")
+        code.arg("src", "const TAcc*")
+        code.arg("bias, add", "const T*")
+        code.arg("act_type", "tv::gemm::Activation")
+        code.arg("alpha", "TAcc")
+        code.arg("channel", "int")
+        code.raw(f"""
+        for (int c = 0; c < channel; ++c){{
+            TAcc v = TAcc(dst[c]);
+            if (src != nullptr){{
+                v += src[c];
+            }}
+            if (bias != nullptr){{
+                v += TAcc(bias[c]);
+            }}
+            if (add != nullptr){{
+                v += TAcc(add[c]);
+            }}
+            switch (act_type){{
+                case tv::gemm::Activation::kReLU:
+                    v = v >= TAcc(0) ? v : TAcc(0);
+                    break;
+                case tv::gemm::Activation::kLeakyReLU:
+                    v = v >= TAcc(0) ? v : v * alpha;
+                    break;
+                case tv::gemm::Activation::kSigmoid:
+                    v = TAcc(1) / (TAcc(1) + std::exp(-v));
+                    break;
+                default: ;
+            }}
+            dst[c] = T(v);
+        }}
+        """)
+        return code
+
+    @pccm.static_function
+    def check_epilogue(self):
+        """check bias and output_add of epilogue, return true if there
+        is anything to apply.
+        """
+        code = pccm.FunctionCode()
+        code.arg("out, bias, output_add", "tv::Tensor")
+        code.arg("act_type", "tv::gemm::Activation")
+        code.raw(f"""
+        if (!bias.empty()){{
+            TV_ASSERT_RT_ERR(bias.is_cpu() && bias.dtype() == out.dtype() && 
+                bias.size() == out.dim(1), "bias mismatch");
+        }}
+        if (!output_add.empty()){{
+            TV_ASSERT_RT_ERR(output_add.is_cpu() && output_add.dtype() == out.dtype() && 
+                output_add.shape() == out.shape() && output_add.is_contiguous(), "output_add mismatch");
+        }}
+        return !bias.empty() || !output_add.empty() || act_type != tv::gemm::Activation::kNone;
+        """)
+        return code.ret("bool")
+
+    @pccm.static_function
+    def epilogue(self):
+        """out = act(out + bias + output_add) in one pass, bias and
+        output_add may be empty.
+        """
+        code = pccm.FunctionCode()
+        code.arg("out, bias, output_add", "tv::Tensor")
+        code.arg("act_type", "tv::gemm::Activation")
+        code.arg("act_alpha", "float")
+        code.raw(f"""
+        TV_ASSERT_RT_ERR(out.is_cpu() && out.ndim() == 2, "only support 2d cpu tensor");
+        if (!check_epilogue(out, bias, output_add, act_type)){{
+            return;
+        }}
+        int num_out = out.dim(0);
+        int out_channel = out.dim(1);
+        tv::dispatch<float, double, tv::bfloat16_t, tv::half_t>(out.dtype(), [&](auto I){{
+            using T = TV_DECLTYPE(I);
+            using TAcc = std::conditional_t<std::is_same<T, double>::value, double, float>;
+            T* out_data = out.data_ptr<T>();
+            const T* bias_data = bias.empty() ? nullptr : bias.data_ptr<const T>();
+            const T* add_data = output_add.empty() ? nullptr : output_add.data_ptr<const T>();
+            tv::kernel_1d(-1, num_out, [&](int begin, int end, int step){{
+                for (int r = begin; r < end; r += step){{
+                    int64_t row = int64_t(r) * out_channel;
+                    epilogue_row<T, TAcc>(out_data + row, nullptr, bias_data, 
+                        add_data == nullptr ? nullptr : add_data + row, act_type, 
+                        TAcc(act_alpha), out_channel);
+                }}
+            }});
+        }});
+        """)
+        return code
+
+    @pccm.static_function
+    def convert_filters(self):
+        """packed filters in TAcc. reduced precision filters are converted
+        once to storage.
+        """
+        code = pccm.FunctionCode()
+        code.targ("T")
+        code.targ("TAcc")
+        code.arg("filters_packed", "tv::Tensor")
+        code.arg("storage", "std::vector<TAcc>&")
+        code.raw(f"""
+        const T* ptr = filters_packed.data_ptr<const T>();
+        if (std::is_same<T, TAcc>::value){{
+            return reinterpret_cast<const TAcc*>(ptr);
+        }}
+        storage.resize(filters_packed.size());
+        for (size_t i = 0; i < storage.size(); ++i){{
+            storage[i] = TAcc(ptr[i]);
+        }}
+        return storage.data();
+        """)
+        return code.ret("const TAcc*")
+
+    @pccm.static_function(attrs=["SPCONV_CPU_GEMM_FORCE_INLINE"])
+    def gemm_rows_impl(self):
+        """c_rows[m][c_col + n] += sum_k a[m * a_stride_m + k * a_stride_k] * b[k * ldb + n].
+        """
+        code = pccm.FunctionCode()
+        code.targ("T")
+        code.targ("TAcc")
+        code.targ("TOut")
+        code.arg("c_rows", "TOut* const*")
+        code.arg("c_col, M, N, K", "int")
+        code.arg("a", "const T*")
+        code.arg("a_stride_m, a_stride_k", "int64_t")
+        code.arg("b", "const T*")
+        code.arg("ldb", "int64_t")
+        code.raw(f"""
+        constexpr int MR = 4;
+        constexpr int NR = 16;
+        for (int m0 = 0; m0 < M; m0 += MR){{
+            int mr = std::min(MR, M - m0);
+            const T* a_blk = a + m0 * a_stride_m;
+            for (int n0 = 0; n0 < N; n0 += NR){{
+                int nr = std::min(NR, N - n0);
+                TAcc acc[MR][NR] = {{}};
+                const T* a_k = a_blk;
+                const T* b_row = b + n0;
+                for (int k = 0; k < K; ++k, a_k += a_stride_k, b_row += ldb){{
+                    TAcc bv[NR] = {{}};
+                    for (int j = 0; j < nr; ++j){{
+                        bv[j] = TAcc(b_row[j]);
+                    }}
+                    for (int i = 0; i < mr; ++i){{
+                        TAcc av = TAcc(a_k[i * a_stride_m]);
+                        #pragma omp simd
+                        for (int j = 0; j < NR; ++j){{
+                            acc[i][j] += av * bv[j];
+                        }}
+                    }}
+                }}
+                for (int i = 0; i < mr; ++i){{
+                    TOut* c_row = c_rows[m0 + i] + c_col + n0;
+                    for (int j = 0; j < nr; ++j){{
+                        c_row[j] = TOut(TAcc(c_row[j]) + acc[i][j]);
+                    }}
+                }}
+            }}
+        }}
+        """)
+        return code
+
+    @pccm.static_function(attrs=["SPCONV_CPU_GEMM_FORCE_INLINE"])
+    def gemm_rows_f32_vec(self):
+        """float version of gemm_rows_impl, MR x (2 * vector width) blocks
+        of c are kept in vector registers. must be inlined to a function
+        with target attribute.
+        """
+        code = pccm.FunctionCode()
+        code.targ("TVec")
+        code.nontype_targ("MR", "int")
+        code.arg("c_rows", "float* const*")
+        code.arg("M, N, K", "int")
+        code.arg("a", "const float*")
+        code.arg("a_stride_m, a_stride_k", "int64_t")
+        code.arg("b", "const float*")
+        code.arg("ldb", "int64_t")
+        code.raw(f"""
+        constexpr int VW = sizeof(TVec) / sizeof(float);
+        constexpr int NR = VW * 2;
+        int m_main = M / MR * MR;
+        int n_main = N / NR * NR;
+        for (int m0 = 0; m0 < m_main; m0 += MR){{
+            const float* a_blk = a + m0 * a_stride_m;
+            for (int n0 = 0; n0 < n_main; n0 += NR){{
+                TVec acc0[MR] = {{}};
+                TVec acc1[MR] = {{}};
+                const float* a_k = a_blk;
+                const float* b_row = b + n0;
+                for (int k = 0; k < K; ++k, a_k += a_stride_k, b_row += ldb){{
+                    TVec b0, b1;
+                    std::memcpy(&b0, b_row, sizeof(TVec));
+                    std::memcpy(&b1, b_row + VW, sizeof(TVec));
+                    for (int i = 0; i < MR; ++i){{
+                        float av = a_k[i * a_stride_m];
+                        acc0[i] += av * b0;
+                        acc1[i] += av * b1;
+                    }}
+                }}
+                for (int i = 0; i < MR; ++i){{
+                    float* c_row = c_rows[m0 + i] + n0;
+                    TVec c0, c1;
+                    std::memcpy(&c0, c_row, sizeof(TVec));
+                    std::memcpy(&c1, c_row + VW, sizeof(TVec));
+                    c0 += acc0[i];
+                    c1 += acc1[i];
+                    std::memcpy(c_row, &c0, sizeof(TVec));
+                    std::memcpy(c_row + VW, &c1, sizeof(TVec));
+                }}
+            }}
+        }}
+        if (n_main < N){{
+            gemm_rows_impl<float, float, float>(c_rows, n_main, m_main, N - n_main, K, a, 
+                a_stride_m, a_stride_k, b + n_main, ldb);
+        }}
+        if (m_main < M){{
+            gemm_rows_impl<float, float, float>(c_rows + m_main, 0, M - m_main, N, K, 
+                a + m_main * a_stride_m, a_stride_m, a_stride_k, b, ldb);
+        }}
+        """)
+        return code
+
+    @pccm.static_function(attrs=["SPCONV_CPU_GEMM_TARGET_AVX2"])
+    def gemm_rows_f32_avx2(self):
+        code = pccm.FunctionCode()
+        code.arg("c_rows", "float* const*")
+        code.arg("M, N, K", "int")
+        code.arg("a", "const float*")
+        code.arg("a_stride_m, a_stride_k", "int64_t")
+        code.arg("b", "const float*")
+        code.arg("ldb", "int64_t")
+        code.raw(f"""
+        #if SPCONV_CPU_GEMM_SIMD
+        typedef float v8sf __attribute__((vector_size(32)));
+        gemm_rows_f32_vec<v8sf, 4>(c_rows, M, N, K, a, a_stride_m, a_stride_k, b, ldb);
+        #else
+        TV_THROW_RT_ERR("avx2 gemm isn't available");
+        #endif
+        """)
+        return code
+
+    @pccm.static_function(attrs=["SPCONV_CPU_GEMM_TARGET_AVX512"])
+    def gemm_rows_f32_avx512(self):
+        code = pccm.FunctionCode()
+        code.arg("c_rows", "float* const*")
+        code.arg("M, N, K", "int")
+        code.arg("a", "const float*")
+        code.arg("a_stride_m, a_stride_k", "int64_t")
+        code.arg("b", "const float*")
+        code.arg("ldb", "int64_t")
+        code.raw(f"""
+        #if SPCONV_CPU_GEMM_SIMD
+        typedef float v16sf __attribute__((vector_size(64)));
+        gemm_rows_f32_vec<v16sf, 8>(c_rows, M, N, K, a, a_stride_m, a_stride_k, b, ldb);
+        #else
+        TV_THROW_RT_ERR("avx512 gemm isn't available");
+        #endif
+        """)
+        return code
+
+    @pccm.static_function
+    def gemm_rows(self):
+        """c_rows[m][n] += (a @ b)[m][n], a is [M, K] with given strides.
+        compiler only generates sse2 code without -march, so float data use
+        avx512/avx2 versions if cpu supports them.
+        """
+        code = pccm.FunctionCode()
+        code.targ("T")
+        code.targ("TAcc")
+        code.targ("TOut")
+        code.arg("c_rows", "TOut* const*")
+        code.arg("M, N, K", "int")
+        code.arg("a", "const T*")
+        code.arg("a_stride_m, a_stride_k", "int64_t")
+        code.arg("b", "const T*")
+        code.arg("ldb", "int64_t")
+        code.raw(f"""
+        #if SPCONV_CPU_GEMM_SIMD
+        int simd_level = cpu_simd_level();
+        bool use_avx512 = simd_level >= 2;
+        bool use_avx2 = simd_level >= 1;
+        constexpr bool is_f32 = std::is_same<T, float>::value && std::is_same<TOut, float>::value;
+        if (is_f32 && (use_avx512 || use_avx2)){{
+            return tv::if_constexpr<is_f32>([&](auto _){{
+                // avx512 kernel computes 32 columns at once.
+                if (use_avx512 && N % 32 == 0){{
+                    gemm_rows_f32_avx512(_(c_rows), M, N, K, _(a), a_stride_m, a_stride_k, _(b), ldb);
+                }}else if (use_avx2){{
+                    gemm_rows_f32_avx2(_(c_rows), M, N, K, _(a), a_stride_m, a_stride_k, _(b), ldb);
+                }}else{{
+                    gemm_rows_impl<T, TAcc, TOut>(c_rows, 0, M, N, K, a, a_stride_m, a_stride_k, b, ldb);
+                }}
+            }}, [](auto _){{}});
+        }}
+        #endif
+        gemm_rows_impl<T, TAcc, TOut>(c_rows, 0, M, N, K, a, a_stride_m, a_stride_k, b, ldb);
+        """)
+        return code
+
+    @pccm.static_function
+    def indice_conv(self):
+        """out[out_inds] += features[in_inds] @ filters[k] for every kernel
+        offset k. filters_packed is [kv, C, K] from pack_filters.
+        dgrad is same op with inverse flipped and transposed filters.
+        subm center isn't computed here. output rows are visited by many
+        offsets, so epilogue runs as one pass after all offsets.
+        """
+        code = pccm.FunctionCode()
+        code.arg("out, features, filters_packed", "tv::Tensor")
+        code.arg("indice_pairs, indice_pair_num", "tv::Tensor")
+        code.arg("inverse, subm, subm_half", "bool")
+        code.arg("tile_size", "int", "128")
+        self._epilogue_args(code)
+        code.raw(f"""
+        TV_ASSERT_RT_ERR(out.is_cpu() && features.is_cpu() && filters_packed.is_cpu(), "only support cpu");
+        TV_ASSERT_RT_ERR(out.dtype() == features.dtype() && filters_packed.dtype() == features.dtype(), "dtype mismatch");
+        int in_channel = features.dim(1);
+        int out_channel = out.dim(1);
+        TV_ASSERT_RT_ERR(filters_packed.dim(1) == in_channel && filters_packed.dim(2) == out_channel, "filter shape mismatch");
+        auto slices = pair_slices(indice_pairs, indice_pair_num, inverse, subm, subm_half);
+        int num_threads = cpu_num_threads();
+        tv::dispatch<float, double, tv::bfloat16_t, tv::half_t>(out.dtype(), [&](auto I){{
+            using T = TV_DECLTYPE(I);
+            using TAcc = std::conditional_t<std::is_same<T, double>::value, double, float>;
+            const T* features_data = features.data_ptr<const T>();
+            std::vector<TAcc> filters_storage;
+            const TAcc* filters_data = convert_filters<T, TAcc>(filters_packed, filters_storage);
+            T* out_data = out.data_ptr<T>();
+            // reduced precision results are added to output rows once per tile.
+            constexpr bool direct = std::is_same<T, TAcc>::value;
+            for (auto& slice : slices){{
+                int offset = std::get<0>(slice);
+                const int* in_inds = std::get<1>(slice);
+                const int* out_inds = std::get<2>(slice);
+                int nhot = std::get<3>(slice);
+                const TAcc* w = filters_data + int64_t(offset) * in_channel * out_channel;
+                // smaller tiles for small offsets, so every thread gets work.
+                int tile_rows = std::min(tile_size, std::max(32, tv::div_up(nhot, num_threads)));
+                int num_tiles = tv::div_up(nhot, tile_rows);
+                tv::kernel_1d(-1, num_tiles, [&](int begin, int end, int step){{
+                    std::vector<TAcc> a_tile(int64_t(tile_size) * in_channel);
+                    std::vector<T*> out_rows(tile_size);
+                    std::vector<TAcc> c_tile(direct ? 0 : int64_t(tile_size) * out_channel);
+                    std::vector<TAcc*> c_rows(direct ? 0 : tile_size);
+                    for (int m = 0; m < int(c_rows.size()); ++m){{
+                        c_rows[m] = c_tile.data() + int64_t(m) * out_channel;
+                    }}
+                    for (int tile = begin; tile < end; tile += step){{
+                        int row_start = tile * tile_rows;
+                        int rows = std::min(tile_rows, nhot - row_start);
+                        for (int m = 0; m < rows; ++m){{
+                            convert_row<T, TAcc>(a_tile.data() + int64_t(m) * in_channel,
+                                features_data + int64_t(in_inds[row_start + m]) * in_channel, in_channel);
+                            out_rows[m] = out_data + int64_t(out_inds[row_start + m]) * out_channel;
+                        }}
+                        // output rows of one offset are unique, add directly.
+                        if (direct){{
+                            gemm_rows<TAcc, TAcc, T>(out_rows.data(), rows, out_channel, in_channel,
+                                a_tile.data(), in_channel, 1, w, out_channel);
+                            continue;
+                        }}
+                        std::fill(c_tile.begin(), c_tile.begin() + int64_t(rows) * out_channel, TAcc(0));
+                        gemm_rows<TAcc, TAcc, TAcc>(c_rows.data(), rows, out_channel, in_channel,
+                            a_tile.data(), in_channel, 1, w, out_channel);
+                        for (int m = 0; m < rows; ++m){{
+                            add_row<T, TAcc>(out_rows[m], c_rows[m], out_channel);
+                        }}
+                    }}
+                }});
+            }}
+        }});
+        epilogue(out, bias, output_add, act_type, act_alpha);
+        """)
+        return code
+
+    @pccm.static_function
+    def indice_conv_grouped(self):
+        """same as indice_conv, but tiles of all kernel offsets run in one
+        parallel region: every pair gets its own row in a packed
+        [total, K] buffer (offset k owns segment k), then buffer rows are
+        reduced to output rows once, parallel over outputs. epilogue is
+        fused into this reduction. row table and buffer are carved from
+        workspace if it has grouped_workspace_size bytes, otherwise they
+        are allocated here.
+        """
+        code = pccm.FunctionCode()
+        code.arg("out, features, filters_packed", "tv::Tensor")
+        code.arg("indice_pairs, indice_pair_num", "tv::Tensor")
+        code.arg("inverse, subm, subm_half", "bool")
+        code.arg("tile_size", "int", "128")
+        self._epilogue_args(code)
+        code.arg("workspace", "tv::Tensor", "tv::Tensor()",
+                 "cumm.tensorview.Tensor = Tensor()")
+        code.raw(f"""
+        TV_ASSERT_RT_ERR(out.is_cpu() && features.is_cpu() && filters_packed.is_cpu(), "only support cpu");
+        TV_ASSERT_RT_ERR(out.dtype() == features.dtype() && filters_packed.dtype() == features.dtype(), "dtype mismatch");
+        int num_out = out.dim(0);
+        int in_channel = features.dim(1);
+        int out_channel = out.dim(1);
+        int kv = indice_pair_num.dim(0);
+        TV_ASSERT_RT_ERR(filters_packed.dim(1) == in_channel && filters_packed.dim(2) == out_channel, "filter shape mismatch");
+        auto slices = pair_slices(indice_pairs, indice_pair_num, inverse, subm, subm_half);
+        // (slice, first pair) of every tile, segment start of every slice.
+        std::vector<std::tuple<int, int>> tiles;
+        std::vector<int64_t> seg_starts(slices.size());
+        int64_t total = 0;
+        for (size_t s = 0; s < slices.size(); ++s){{
+            int nhot = std::get<3>(slices[s]);
+            seg_starts[s] = total;
+            total += nhot;
+            for (int row_start = 0; row_start < nhot; row_start += tile_size){{
+                tiles.push_back({{int(s), row_start}});
+            }}
+        }}
+        if (total == 0){{
+            epilogue(out, bias, output_add, act_type, act_alpha);
+            return;
+        }}
+        bool has_epilogue = check_epilogue(out, bias, output_add, act_type);
+        TV_ASSERT_RT_ERR(total <= std::numeric_limits<int>::max(), "too many pairs for grouped gemm", total);
+        int64_t table_size = int64_t(num_out) * kv;
+        bool use_workspace = !workspace.empty() && workspace.is_cpu() && 
+            int64_t(workspace.nbytes()) >= grouped_workspace_size(
+                indice_pairs, indice_pair_num, num_out, out_channel, out.dtype(), inverse, subm, subm_half);
+        // row of pair in packed buffer for every (output, offset)
+        std::unique_ptr<int[]> row_table_storage;
+        int* row_table = nullptr;
+        if (use_workspace){{
+            row_table = reinterpret_cast<int*>(workspace.data_ptr());
+        }}else{{
+            row_table_storage.reset(new int[table_size]);
+            row_table = row_table_storage.get();
+        }}
+        std::fill(row_table, row_table + table_size, -1);
+        tv::dispatch<float, double, tv::bfloat16_t, tv::half_t>(out.dtype(), [&](auto I){{
+            using T = TV_DECLTYPE(I);
+            using TAcc = std::conditional_t<std::is_same<T, double>::value, double, float>;
+            const T* features_data = features.data_ptr<const T>();
+            std::vector<TAcc> filters_storage;
+            const TAcc* filters_data = convert_filters<T, TAcc>(filters_packed, filters_storage);
+            T* out_data = out.data_ptr<T>();
+            const T* bias_data = bias.empty() ? nullptr : bias.data_ptr<const T>();
+            const T* add_data = output_add.empty() ? nullptr : output_add.data_ptr<const T>();
+            // not initialized, rows of a tile are cleared right before gemm.
+            std::unique_ptr<TAcc[]> buffer_storage;
+            TAcc* buffer_data = nullptr;
+            if (use_workspace){{
+                // buffer starts at 8 byte aligned end of row table.
+                buffer_data = reinterpret_cast<TAcc*>(
+                    reinterpret_cast<uint8_t*>(row_table) + tv::div_up(table_size * 4, int64_t(8)) * 8);
+            }}else{{
+                buffer_storage.reset(new TAcc[total * out_channel]);
+                buffer_data = buffer_storage.get();
+            }}
+            tv::kernel_1d(-1, tiles.size(), [&](int begin, int end, int step){{
+                std::vector<TAcc> a_tile(int64_t(tile_size) * in_channel);
+                std::vector<TAcc*> buf_rows(tile_size);
+                for (int t = begin; t < end; t += step){{
+                    int s = std::get<0>(tiles[t]);
+                    int row_start = std::get<1>(tiles[t]);
+                    int offset = std::get<0>(slices[s]);
+                    const int* in_inds = std::get<1>(slices[s]);
+                    const int* out_inds = std::get<2>(slices[s]);
+                    int rows = std::min(tile_size, std::get<3>(slices[s]) - row_start);
+                    for (int m = 0; m < rows; ++m){{
+                        int p = row_start + m;
+                        int64_t buf_row = seg_starts[s] + p;
+                        convert_row<T, TAcc>(a_tile.data() + int64_t(m) * in_channel,
+                            features_data + int64_t(in_inds[p]) * in_channel, in_channel);
+                        buf_rows[m] = buffer_data + buf_row * out_channel;
+                        row_table[int64_t(out_inds[p]) * kv + offset] = int(buf_row);
+                    }}
+                    std::fill(buf_rows[0], buf_rows[0] + int64_t(rows) * out_channel, TAcc(0));
+                    gemm_rows<TAcc, TAcc, TAcc>(buf_rows.data(), rows, out_channel, in_channel,
+                        a_tile.data(), in_channel, 1,
+                        filters_data + int64_t(offset) * in_channel * out_channel, out_channel);
+                }}
+            }});
+            tv::kernel_1d(-1, num_out, [&](int begin, int end, int step){{
+                std::vector<TAcc> acc(out_channel);
+                for (int r = begin; r < end; r += step){{
+                    std::fill(acc.begin(), acc.end(), TAcc(0));
+                    const int* rows_r = row_table + int64_t(r) * kv;
+                    for (int k = 0; k < kv; ++k){{
+                        if (rows_r[k] < 0){{
+                            continue;
+                        }}
+                        const TAcc* buf_row = buffer_data + int64_t(rows_r[k]) * out_channel;
+                        for (int n = 0; n < out_channel; ++n){{
+                            acc[n] += buf_row[n];
+                        }}
+                    }}
+                    int64_t row = int64_t(r) * out_channel;
+                    if (has_epilogue){{
+                        epilogue_row<T, TAcc>(out_data + row, acc.data(), bias_data, 
+                            add_data == nullptr ? nullptr : add_data + row, act_type, 
+                            TAcc(act_alpha), out_channel);
+                    }}else{{
+                        add_row<T, TAcc>(out_data + row, acc.data(), out_channel);
+                    }}
+                }}
+            }});
+        }});
+        """)
+        return code
+
+    @pccm.static_function
+    def grouped_workspace_size(self):
+        """bytes of workspace used by indice_conv_grouped: int32 row table
+        [num_out, kv] (padded to 8 bytes) followed by accumulator buffer
+        [total, K].
+        """
+        code = pccm.FunctionCode()
+        code.arg("indice_pairs, indice_pair_num", "tv::Tensor")
+        code.arg("num_out, out_channel", "int")
+        code.arg("dtype", "tv::DType")
+        code.arg("inverse, subm, subm_half", "bool")
+        code.raw(f"""
+        int kv = indice_pair_num.dim(0);
+        int64_t total = 0;
+        for (auto& slice : pair_slices(indice_pairs, indice_pair_num, inverse, subm, subm_half)){{
+            total += std::get<3>(slice);
+        }}
+        int64_t acc_size = dtype == tv::float64 ? 8 : 4;
+        return tv::div_up(int64_t(num_out) * kv * 4, int64_t(8)) * 8 + total * out_channel * acc_size;
+        """)
+        return code.ret("int64_t")
+
+    @pccm.static_function
+    def neighbor_table(self):
+        """table[r, k] is input row of output row r at kernel offset k, -1
+        if missing. subm center column is always -1. written to out if
+        it's a [num_out, kv] int32 tensor.
+        """
+        code = pccm.FunctionCode()
+        code.arg("indice_pairs, indice_pair_num", "tv::Tensor")
+        code.arg("num_out", "int")
+        code.arg("inverse, subm, subm_half", "bool")
+        code.arg("out", "tv::Tensor", "tv::Tensor()",
+                 "cumm.tensorview.Tensor = Tensor()")
+        code.raw(f"""
+        int kv = indice_pair_num.dim(0);
+        tv::Tensor res;
+        if (!out.empty()){{
+            TV_ASSERT_RT_ERR(out.is_cpu() && out.dtype() == tv::int32 && out.ndim() == 2 && 
+                out.dim(0) == num_out && out.dim(1) == kv, "table shape mismatch");
+            res = out;
+            res.fill_(-1);
+        }}else{{
+            res = tv::full({{num_out, kv}}, -1, tv::int32, -1);
+        }}
+        auto slices = pair_slices(indice_pairs, indice_pair_num, inverse, subm, subm_half);
+        int* res_ptr = res.data_ptr<int>();
+        // each offset owns one column.
+        tv::kernel_1d(-1, slices.size(), [&](int begin, int end, int step){{
+            for (int s = begin; s < end; s += step){{
+                int offset = std::get<0>(slices[s]);
+                const int* in_inds = std::get<1>(slices[s]);
+                const int* out_inds = std::get<2>(slices[s]);
+                int nhot = std::get<3>(slices[s]);
+                for (int j = 0; j < nhot; ++j){{
+                    res_ptr[int64_t(out_inds[j]) * kv + offset] = in_inds[j];
+                }}
+            }}
+        }});
+        return res;
+        """)
+        return code.ret("tv::Tensor")
+
+    @pccm.static_function
+    def indice_conv_output_stationary(self):
+        """out[r] += sum_k features[table[r, k]] @ filters[k]. output rows are
+        split to tiles, each tile accumulates all offsets in a local buffer
+        and writes out once with epilogue, so tiles never conflict.
+        """
+        code = pccm.FunctionCode()
+        code.arg("out, features, filters_packed, table", "tv::Tensor")
+        code.arg("tile_size", "int", "128")
+        self._epilogue_args(code)
+        code.raw(f"""
+        TV_ASSERT_RT_ERR(out.is_cpu() && features.is_cpu() && filters_packed.is_cpu(), "only support cpu");
+        TV_ASSERT_RT_ERR(out.dtype() == features.dtype() && filters_packed.dtype() == features.dtype(), "dtype mismatch");
+        TV_ASSERT_RT_ERR(table.dtype() == tv::int32 && table.dim(0) == out.dim(0), "table shape mismatch");
+        int num_out = out.dim(0);
+        int kv = table.dim(1);
+        int in_channel = features.dim(1);
+        int out_channel = out.dim(1);
+        TV_ASSERT_RT_ERR(filters_packed.dim(0) == kv && filters_packed.dim(1) == in_channel && 
+            filters_packed.dim(2) == out_channel, "filter shape mismatch");
+        const int* table_data = table.data_ptr<const int>();
+        bool has_epilogue = check_epilogue(out, bias, output_add, act_type);
+        tv::dispatch<float, double, tv::bfloat16_t, tv::half_t>(out.dtype(), [&](auto I){{
+            using T = TV_DECLTYPE(I);
+            using TAcc = std::conditional_t<std::is_same<T, double>::value, double, float>;
+            const T* features_data = features.data_ptr<const T>();
+            std::vector<TAcc> filters_storage;
+            const TAcc* filters_data = convert_filters<T, TAcc>(filters_packed, filters_storage);
+            T* out_data = out.data_ptr<T>();
+            const T* bias_data = bias.empty() ? nullptr : bias.data_ptr<const T>();
+            const T* add_data = output_add.empty() ? nullptr : output_add.data_ptr<const T>();
+            int num_tiles = tv::div_up(num_out, tile_size);
+            tv::kernel_1d(-1, num_tiles, [&](int begin, int end, int step){{
+                std::vector<TAcc> a_tile(int64_t(tile_size) * in_channel);
+                std::vector<TAcc> acc(int64_t(tile_size) * out_channel);
+                std::vector<TAcc*> acc_rows(tile_size);
+                for (int tile = begin; tile < end; tile += step){{
+                    int row_start = tile * tile_size;
+                    int rows = std::min(tile_size, num_out - row_start);
+                    std::fill(acc.begin(), acc.begin() + int64_t(rows) * out_channel, TAcc(0));
+                    for (int k = 0; k < kv; ++k){{
+                        int m = 0;
+                        for (int r = 0; r < rows; ++r){{
+                            int in_ind = table_data[int64_t(row_start + r) * kv + k];
+                            if (in_ind < 0){{
+                                continue;
+                            }}
+                            convert_row<T, TAcc>(a_tile.data() + int64_t(m) * in_channel,
+                                features_data + int64_t(in_ind) * in_channel, in_channel);
+                            acc_rows[m] = acc.data() + int64_t(r) * out_channel;
+                            ++m;
+                        }}
+                        if (m == 0){{
+                            continue;
+                        }}
+                        gemm_rows<TAcc, TAcc, TAcc>(acc_rows.data(), m, out_channel, in_channel,
+                            a_tile.data(), in_channel, 1, 
+                            filters_data + int64_t(k) * in_channel * out_channel, out_channel);
+                    }}
+                    for (int r = 0; r < rows; ++r){{
+                        int64_t row = int64_t(row_start + r) * out_channel;
+                        const TAcc* acc_row = acc.data() + int64_t(r) * out_channel;
+                        if (has_epilogue){{
+                            epilogue_row<T, TAcc>(out_data + row, acc_row, bias_data, 
+                                add_data == nullptr ? nullptr : add_data + row, act_type, 
+                                TAcc(act_alpha), out_channel);
+                        }}else{{
+                            add_row<T, TAcc>(out_data + row, acc_row, out_channel);
+                        }}
+                    }}
+                }}
+            }});
+        }});
+        """)
+        return code
+
+    @pccm.static_function
+    def indice_conv_weight_grad(self):
+        """dfilters[k] = features[in_inds].T @ out_bp[out_inds] for every
+        kernel offset k, written in layout of filters. pairs of every offset
+        are split to chunks (about 2 per thread in total), each chunk
+        computes a partial [C, K] in parallel, then partials of one offset
+        are summed in chunk order, so result doesn't depend on scheduling.
+        """
+        code = pccm.FunctionCode()
+        code.arg("dfilters, features, out_bp", "tv::Tensor")
+        code.arg("indice_pairs, indice_pair_num", "tv::Tensor")
+        code.arg("all_w_is_krsc, filter_hwio, inverse, subm, subm_half", "bool")
+        code.arg("tile_size", "int", "128")
+        code.raw(f"""
+        TV_ASSERT_RT_ERR(dfilters.is_cpu() && features.is_cpu() && out_bp.is_cpu(), "only support cpu");
+        TV_ASSERT_RT_ERR(dfilters.ndim() == 3 && dfilters.is_contiguous(), "dfilters must be contiguous 3d view");
+        int in_channel = features.dim(1);
+        int out_channel = out_bp.dim(1);
+        int kv = all_w_is_krsc ? dfilters.dim(1) : dfilters.dim(0);
+        auto slices = pair_slices(indice_pairs, indice_pair_num, inverse, subm, subm_half);
+        int64_t total = 0;
+        for (auto& slice : slices){{
+            total += std::get<3>(slice);
+        }}
+        int64_t chunk_rows = tv::div_up(total, int64_t(2) * cpu_num_threads());
+        chunk_rows = std::max(int64_t(1), tv::div_up(chunk_rows, int64_t(tile_size))) * tile_size;
+        // (slice, first pair, last pair) of every chunk, first chunk of every slice.
+        std::vector<std::tuple<int, int, int>> chunks;
+        std::vector<int> chunk_starts(slices.size() + 1);
+        for (size_t s = 0; s < slices.size(); ++s){{
+            int nhot = std::get<3>(slices[s]);
+            chunk_starts[s] = chunks.size();
+            for (int64_t row_start = 0; row_start < nhot; row_start += chunk_rows){{
+                chunks.push_back({{int(s), int(row_start), int(std::min(int64_t(nhot), row_start + chunk_rows))}});
+            }}
+        }}
+        chunk_starts[slices.size()] = chunks.size();
+        int64_t dw_size = int64_t(in_channel) * out_channel;
+        tv::dispatch<float, double, tv::bfloat16_t, tv::half_t>(dfilters.dtype(), [&](auto I){{
+            using T = TV_DECLTYPE(I);
+            using TAcc = std::conditional_t<std::is_same<T, double>::value, double, float>;
+            const T* features_data = features.data_ptr<const T>();
+            const T* out_bp_data = out_bp.data_ptr<const T>();
+            T* dfilters_data = dfilters.data_ptr<T>();
+            // not initialized, every chunk clears its own partial.
+            std::unique_ptr<TAcc[]> partials(new TAcc[std::max(int64_t(1), int64_t(chunks.size()) * dw_size)]);
+            tv::kernel_1d(-1, chunks.size(), [&](int begin, int end, int step){{
+                std::vector<TAcc> a_tile(int64_t(tile_size) * in_channel);
+                std::vector<TAcc> g_tile(int64_t(tile_size) * out_channel);
+                std::vector<TAcc*> dw_rows(in_channel);
+                for (int t = begin; t < end; t += step){{
+                    int s = std::get<0>(chunks[t]);
+                    int chunk_end = std::get<2>(chunks[t]);
+                    const int* in_inds = std::get<1>(slices[s]);
+                    const int* out_inds = std::get<2>(slices[s]);
+                    TAcc* dw = partials.get() + int64_t(t) * dw_size;
+                    std::fill(dw, dw + dw_size, TAcc(0));
+                    for (int c = 0; c < in_channel; ++c){{
+                        dw_rows[c] = dw + int64_t(c) * out_channel;
+                    }}
+                    for (int row_start = std::get<1>(chunks[t]); row_start < chunk_end; row_start += tile_size){{
+                        int rows = std::min(tile_size, chunk_end - row_start);
+                        for (int m = 0; m < rows; ++m){{
+                            convert_row<T, TAcc>(a_tile.data() + int64_t(m) * in_channel,
+                                features_data + int64_t(in_inds[row_start + m]) * in_channel, in_channel);
+                            convert_row<T, TAcc>(g_tile.data() + int64_t(m) * out_channel,
+                                out_bp_data + int64_t(out_inds[row_start + m]) * out_channel, out_channel);
+                        }}
+                        // dw[C, K] += a_tile.T @ g_tile
+                        gemm_rows<TAcc, TAcc, TAcc>(dw_rows.data(), in_channel, out_channel, rows,
+                            a_tile.data(), 1, in_channel, g_tile.data(), out_channel);
+                    }}
+                }}
+            }});
+            // each offset owns its filter slice.
+            tv::kernel_1d(-1, slices.size(), [&](int begin, int end, int step){{
+                for (int s = begin; s < end; s += step){{
+                    int offset = std::get<0>(slices[s]);
+                    TAcc* dw = partials.get() + int64_t(chunk_starts[s]) * dw_size;
+                    for (int t = chunk_starts[s] + 1; t < chunk_starts[s + 1]; ++t){{
+                        const TAcc* dw_t = partials.get() + int64_t(t) * dw_size;
+                        for (int64_t i = 0; i < dw_size; ++i){{
+                            dw[i] += dw_t[i];
+                        }}
+                    }}
+                    for (int c = 0; c < in_channel; ++c){{
+                        for (int k = 0; k < out_channel; ++k){{
+                            int64_t dst;
+                            if (all_w_is_krsc){{
+                                dst = (int64_t(k) * kv + offset) * in_channel + c;
+                            }}else if (filter_hwio){{
+                                dst = (int64_t(offset) * in_channel + c) * out_channel + k;
+                            }}else{{
+                                dst = (int64_t(offset) * out_channel + k) * in_channel + c;
+                            }}
+                            dfilters_data[dst] = T(dw[int64_t(c) * out_channel + k]);
+                        }}
+                    }}
                 }}
             }});
         }});
@@ -21,6 +21,11 @@ from cumm.common import TensorView, TensorViewHashKernel, TensorViewKernel, Thru
 from cumm.gemm import codeops
 from typing import List
 from cumm.conv.params import ConvProblem
+from cumm.constants import CUMM_CPU_ONLY_BUILD
+from spconv.core import CPUHashType
+from spconv.constants import AllocKeys
+from spconv.csrc.sparse.cpu_core import (OMPLib, UnorderedMapTableCPU, RobinMapTableCPU,
+                                        LinearProbingTableCPU, DirectTableCPU)
 import numpy as np
 
 
@@ -1623,7 +1628,10 @@ class SparseConvIndicesCPU(pccm.ParameterizedClass):
     def __init__(self, problem: ConvProblem, dtype_indices: dtypes.DType):
         super().__init__()
         self.add_dependency(TensorView)
-        self.add_include("unordered_map")
+        if CUMM_CPU_ONLY_BUILD:
+            self.add_dependency(OMPLib)
+        self.add_include("tensorview/parallel/all.h")
+        self.add_include("queue")
         self.loc_iter = ConvOutLocIter(problem)
         self.loc_iter_64 = ConvOutLocIter(problem, True)
         self.add_param_class("spinds", self.loc_iter, "ConvLocIter")
@@ -1633,17 +1641,61 @@ class SparseConvIndicesCPU(pccm.ParameterizedClass):
         self.ndim = problem.ndim
         self.dtype_indices = dtype_indices
         self.dtype_indices_uniq = dtype_indices
+        # number of points handled by one parallel task. fixed so that
+        # task partition doesn't depend on number of threads.
+        self.cpu_chunk_size = 4096
+        # keys sampled from every sorted chunk to split output keys to
+        # ranges which are sorted in parallel.
+        self.cpu_key_samples_per_chunk = 16
+        self.cpu_hash_type_to_table = {
+            CPUHashType.UnorderedMap.value: "UnorderedMapTable",
+            CPUHashType.RobinMap.value: "RobinMapTable",
+            CPUHashType.LinearProbing.value: "LinearProbingTable",
+            CPUHashType.DirectTable.value: "DirectTable",
+        }
+        self.cpu_hash_types = list(self.cpu_hash_type_to_table.keys())
+        # direct table is selected if grid volume <= max(sparsity * num_points, min_volume)
+        # and grid volume <= max_volume.
+        self.direct_table_max_sparsity = 32
+        self.direct_table_min_volume = 1 << 20
+        self.direct_table_max_volume = 1 << 25
+        self.add_param_class("cpuhash", UnorderedMapTableCPU(dtype_indices), "UnorderedMapTable")
+        self.add_param_class("cpuhash", RobinMapTableCPU(dtype_indices), "RobinMapTable")
+        self.add_param_class("cpuhash", LinearProbingTableCPU(dtype_indices), "LinearProbingTable")
+        self.add_param_class("cpuhash", DirectTableCPU(dtype_indices), "DirectTable")
 
         assert dtype_indices == dtypes.int32 or dtype_indices == dtypes.int64
 
     @pccm.static_function
-    def generate_subm_conv_inds(self):
+    def select_hash_type(self):
         code = pccm.FunctionCode()
-        code.arg("indices", "tv::Tensor")
-        code.arg("indice_pairs, out_inds, indice_num_per_loc", "tv::Tensor")
+        code.arg("grid_volume", "int64_t")
+        code.arg("num_points", "int64_t")
+        code.raw(f"""
+        // direct table needs a fill of whole grid, so only use it
+        // when grid is small or dense enough.
+        if (grid_volume <= std::max(num_points * {self.direct_table_max_sparsity}, int64_t({self.direct_table_min_volume})) && 
+                grid_volume <= int64_t({self.direct_table_max_volume})){{
+            return {CPUHashType.DirectTable.value};
+        }}
+        return {CPUHashType.LinearProbing.value};
+        """)
+        return code.ret("int")
+
+    def generate_subm_conv_inds_template(self, csr: bool):
+        code = pccm.FunctionCode()
+        if csr:
+            code.arg("alloc_func", "std::function<tv::Tensor(std::string, std::vector<int64_t>)>")
+            code.arg("indices, indice_num_per_loc", "tv::Tensor")
+        else:
+            code.arg("indices", "tv::Tensor")
+            code.arg("indice_pairs, out_inds, indice_num_per_loc", "tv::Tensor")
         code.arg("batch_size", "int")
         code.arg("input_dims", f"tv::array<int, {self.ndim}>")
         code.arg("ksize, dilation", f"tv::array<int, {self.ndim}>")
+        code.arg("hash_type", "int", f"{CPUHashType.Auto.value}")
+        if csr:
+            code.arg("half", "bool", "false")
         code.raw(f"""
         tv::array<int, {self.ndim}> stride, padding;
         for (int i = 0; i < {self.ndim}; ++i){{
@@ -1656,62 +1708,165 @@ class SparseConvIndicesCPU(pccm.ParameterizedClass):
             "kernel volume must smaller than max value of {self.dtype_indices}");
         ConvProblem problem(batch_size, 1, 1, input_dims, input_dims, ksize, padding, stride, dilation);
         bool use_int32 = problem.check_npq_not_overflow();
+        int indice_in_num = indices.dim(0);
+        int64_t grid_volume = batch_size;
+        for (int i = 0; i < {self.ndim}; ++i){{
+            grid_volume *= input_dims[i];
+        }}
+        if (hash_type == {CPUHashType.Auto.value}){{
+            hash_type = select_hash_type(grid_volume, indice_in_num);
+        }}
         """)
+        if csr:
+            alloc_pairs = f"""
+                // csr kernel map: pairs of all offsets are packed into [2, total],
+                // offset k starts at sum(indice_num_per_loc[:k]). count of mirrored
+                // offset equals to count of k, center is identity and not stored.
+                // if half, mirrored offsets aren't stored either, pairs of
+                // offset kv - 1 - k are pairs of k with in/out swapped.
+                std::vector<int64_t> pair_offsets(kv);
+                int64_t pair_total = 0;
+                for (int filter_offset = 0; filter_offset < kv; ++filter_offset){{
+                    {self.dtype_indices} count = 0;
+                    if (filter_offset < kv_half){{
+                        count = indice_num_per_loc_ptr[filter_offset];
+                    }}else if (filter_offset > kv_half){{
+                        count = indice_num_per_loc_ptr[kv - 1 - filter_offset];
+                    }}
+                    indice_num_per_loc_ptr[filter_offset] = count;
+                    pair_offsets[filter_offset] = pair_total;
+                    if (!half || filter_offset < kv_half){{
+                        pair_total += count;
+                    }}
+                }}
+                auto indice_pairs = alloc_func({pccm.literal(AllocKeys.PairFwd)}, {{2, pair_total}});
+                int64_t pair_in_out_stride = pair_total;
+            """
+        else:
+            alloc_pairs = f"""
+                int64_t indices_pair_size = indice_pairs.dim(2);
+                std::vector<int64_t> pair_offsets(kv);
+                for (int filter_offset = 0; filter_offset < kv; ++filter_offset){{
+                    pair_offsets[filter_offset] = filter_offset * indices_pair_size;
+                }}
+                int64_t pair_in_out_stride = indices_pair_size * kv;
+            """
         for x in codeops.dispatch_ints(code, [0, 1], "int(use_int32)"):
             loc_type = "ConvLocIter" if x == 1 else "ConvLocIter64"
-            code.raw(f"""
-            {loc_type} loc_iter(problem);
-            int indices_pair_size = indice_pairs.dim(2);
-            int indices_pair_size_mul_RS = indices_pair_size * kv;
-            auto indice_pairs_ptr = indice_pairs.data_ptr<{self.dtype_indices}>();
-            std::unordered_map<{self.dtype_indices}, {self.dtype_indices}> hash;
-            auto indices_ptr = indices.data_ptr<const {self.dtype_indices}>();
-            int indice_in_num = indices.dim(0);
-            for (int i = 0; i < indice_in_num; ++i){{
-                {self.dtype_indices} index = loc_iter.layout_npq(indices_ptr);
-                hash.insert({{index, i}});
-                indices_ptr += {self.ndim + 1};
-            }}
-            for (int filter_offset = 0; filter_offset < (kv / 2 + 1); ++filter_offset){{
-                int filter_offset_mul_indices_pair_size = filter_offset * indices_pair_size;
-                int filter_offset_mul_indices_pair_size_1 = (kv - 1 - filter_offset) * indices_pair_size;
-                if (filter_offset == kv / 2){{
-                    for (int i = 0; i < indice_in_num; ++i){{
-                        indice_pairs_ptr[filter_offset_mul_indices_pair_size + i] = i;
-                        indice_pairs_ptr[indices_pair_size_mul_RS + filter_offset_mul_indices_pair_size + i] = i;
-                    }}
-                }}else{{
-                    indices_ptr = indices.data_ptr<const {self.dtype_indices}>();
-                    auto indice_num_per_loc_ptr = indice_num_per_loc.data_ptr<{self.dtype_indices}>() + filter_offset;
-                    for (int i = 0; i < indice_in_num; ++i){{
-                        tv::array<int, {self.ndim + 1}> npq_offset;
-                        if (loc_iter.query_npq_no_stride(indices_ptr, npq_offset)){{
-                            auto index = loc_iter.layout_npq(npq_offset);
-                            auto iter = hash.find(index);
-                            if (iter != hash.end()){{
-                                auto old_num = indice_num_per_loc_ptr[0]++;
-                                indice_pairs_ptr[filter_offset_mul_indices_pair_size + old_num] = i;
-                                indice_pairs_ptr[indices_pair_size_mul_RS + filter_offset_mul_indices_pair_size + old_num] = iter->second;
-                                indice_pairs_ptr[filter_offset_mul_indices_pair_size_1 + old_num] = iter->second;
-                                indice_pairs_ptr[indices_pair_size_mul_RS + filter_offset_mul_indices_pair_size_1 + old_num] = i;
+            for hash_type in codeops.dispatch_ints(code, self.cpu_hash_types, "hash_type"):
+                table_type = self.cpu_hash_type_to_table[hash_type]
+                table_size = "grid_volume" if hash_type == CPUHashType.DirectTable.value else "indice_in_num"
+                code.raw(f"""
+                {loc_type} loc_iter(problem);
+                {table_type} hash({table_size});
+                auto indices_ptr = indices.data_ptr<const {self.dtype_indices}>();
+                for (int i = 0; i < indice_in_num; ++i){{
+                    int64_t index = loc_iter.layout_npq(indices_ptr);
+                    hash.insert(index, i);
+                    indices_ptr += {self.ndim + 1};
+                }}
+                // hash is read-only from here, so queries can run in parallel.
+                // each chunk keeps its own per-offset counts and pairs, then
+                // a prefix sum over chunks gives the write position of every
+                // chunk. pairs of one offset are still ordered by input index,
+                // so result is identical to serial version and independent
+                // of number of threads.
+                int kv_half = kv / 2;
+                int num_chunks = tv::div_up(indice_in_num, {self.cpu_chunk_size});
+                std::vector<int> chunk_counts(num_chunks * kv_half, 0);
+                std::vector<std::vector<{self.dtype_indices}>> chunk_pairs(num_chunks);
+                auto indices_ptr_base = indices.data_ptr<const {self.dtype_indices}>();
+                tv::kernel_1d_map_cpu(indices.device(), num_chunks, [&](size_t chunk){{
+                    int begin = chunk * {self.cpu_chunk_size};
+                    int end = std::min(begin + {self.cpu_chunk_size}, indice_in_num);
+                    {loc_type} loc_iter_chunk(problem);
+                    auto& pairs_chunk = chunk_pairs[chunk];
+                    for (int filter_offset = 0; filter_offset < kv_half; ++filter_offset){{
+                        loc_iter_chunk.set_filter_offset(filter_offset);
+                        auto indices_ptr_chunk = indices_ptr_base + begin * {self.ndim + 1};
+                        int count = 0;
+                        for (int i = begin; i < end; ++i){{
+                            tv::array<int, {self.ndim + 1}> npq_offset;
+                            if (loc_iter_chunk.query_npq_no_stride(indices_ptr_chunk, npq_offset)){{
+                                auto index = loc_iter_chunk.layout_npq(npq_offset);
+                                auto out_idx = hash.lookup(index);
+                                if (out_idx != -1){{
+                                    pairs_chunk.push_back(i);
+                                    pairs_chunk.push_back(out_idx);
+                                    ++count;
+                                }}
                             }}
+                            indices_ptr_chunk += {self.ndim + 1};
                         }}
-                        indices_ptr += {self.ndim + 1};
+                        chunk_counts[chunk * kv_half + filter_offset] = count;
                     }}
+                }});
+                std::vector<int> chunk_write_offsets(num_chunks * kv_half);
+                auto indice_num_per_loc_ptr = indice_num_per_loc.data_ptr<{self.dtype_indices}>();
+                for (int filter_offset = 0; filter_offset < kv_half; ++filter_offset){{
+                    int total = 0;
+                    for (int chunk = 0; chunk < num_chunks; ++chunk){{
+                        chunk_write_offsets[chunk * kv_half + filter_offset] = total;
+                        total += chunk_counts[chunk * kv_half + filter_offset];
+                    }}
+                    indice_num_per_loc_ptr[filter_offset] = total;
                 }}
-                ++loc_iter;
-            }}
-            """)
+                {alloc_pairs}
+                bool write_mirror = {"!half" if csr else "true"};
+                auto indice_pairs_ptr = indice_pairs.data_ptr<{self.dtype_indices}>();
+                tv::kernel_1d_map_cpu(indices.device(), num_chunks, [&](size_t chunk){{
+                    auto pairs_chunk_ptr = chunk_pairs[chunk].data();
+                    for (int filter_offset = 0; filter_offset < kv_half; ++filter_offset){{
+                        auto pair_ptr = indice_pairs_ptr + pair_offsets[filter_offset];
+                        auto pair_mirror_ptr = indice_pairs_ptr + pair_offsets[kv - 1 - filter_offset];
+                        int pos = chunk_write_offsets[chunk * kv_half + filter_offset];
+                        int count = chunk_counts[chunk * kv_half + filter_offset];
+                        for (int j = 0; j < count; ++j){{
+                            auto inp_idx = pairs_chunk_ptr[0];
+                            auto out_idx = pairs_chunk_ptr[1];
+                            pair_ptr[pos] = inp_idx;
+                            pair_ptr[pair_in_out_stride + pos] = out_idx;
+                            if (write_mirror){{
+                                pair_mirror_ptr[pos] = out_idx;
+                                pair_mirror_ptr[pair_in_out_stride + pos] = inp_idx;
+                            }}
+                            pairs_chunk_ptr += 2;
+                            ++pos;
+                        }}
+                    }}
+                }});
+                """)
+                if not csr:
+                    code.raw(f"""
+                    auto center_pair_ptr = indice_pairs_ptr + pair_offsets[kv_half];
+                    tv::kernel_1d_cpu(indices.device(), indice_in_num, [&](size_t begin, size_t end, size_t step){{
+                        for (size_t i = begin; i < end; i += step){{
+                            center_pair_ptr[i] = i;
+                            center_pair_ptr[pair_in_out_stride + i] = i;
+                        }}
+                    }});
+                    """)
         code.raw(f"""
         return indices.dim(0);
         """)
         return code.ret("int")
 
     @pccm.static_function
-    def generate_conv_inds(self):
+    def generate_subm_conv_inds(self):
+        return self.generate_subm_conv_inds_template(False)
+
+    @pccm.static_function
+    def generate_subm_conv_inds_csr(self):
+        return self.generate_subm_conv_inds_template(True)
+
+    def generate_conv_inds_template(self, csr: bool):
         code = pccm.FunctionCode()
-        code.arg("indices", "tv::Tensor")
-        code.arg("indice_pairs, out_inds, indice_num_per_loc", "tv::Tensor")
+        if csr:
+            code.arg("alloc_func", "std::function<tv::Tensor(std::string, std::vector<int64_t>)>")
+            code.arg("indices, indice_num_per_loc", "tv::Tensor")
+        else:
+            code.arg("indices", "tv::Tensor")
+            code.arg("indice_pairs, out_inds, indice_num_per_loc", "tv::Tensor")
         code.arg("batch_size", "int")
         code.arg("output_dims, input_dims", f"tv::array<int, {self.ndim}>")
         code.arg("ksize, stride, padding, dilation",
@@ -1724,55 +1879,505 @@ class SparseConvIndicesCPU(pccm.ParameterizedClass):
         int num_act = 0;
 
         """)
+        if csr:
+            alloc_out_inds = f"""
+            auto out_inds = alloc_func({pccm.literal(AllocKeys.OutIndices)}, {{num_act, {self.ndim + 1}}});
+            """
+            alloc_pairs = f"""
+            // csr kernel map: pairs of all offsets are packed into [2, total],
+            // offset k starts at sum(indice_num_per_loc[:k]).
+            std::vector<int64_t> pair_offsets(kv);
+            int64_t pair_total = 0;
+            for (int filter_offset = 0; filter_offset < kv; ++filter_offset){{
+                pair_offsets[filter_offset] = pair_total;
+                pair_total += indice_num_per_loc_ptr[filter_offset];
+            }}
+            auto indice_pairs = alloc_func({pccm.literal(AllocKeys.PairFwd)}, {{2, pair_total}});
+            int64_t pair_in_out_stride = pair_total;
+            """
+        else:
+            alloc_out_inds = ""
+            alloc_pairs = f"""
+            int64_t indices_pair_size = indice_pairs.dim(2);
+            std::vector<int64_t> pair_offsets(kv);
+            for (int filter_offset = 0; filter_offset < kv; ++filter_offset){{
+                pair_offsets[filter_offset] = filter_offset * indices_pair_size;
+            }}
+            int64_t pair_in_out_stride = indices_pair_size * kv;
+            """
         for x in codeops.dispatch_ints(code, [0, 1], "int(use_int32)"):
             loc_type = "ConvLocIter" if x == 1 else "ConvLocIter64"
             code.raw(f"""
-            {loc_type} loc_iter(problem);
-
-            int indices_pair_size = indice_pairs.dim(2);
-            int indices_pair_size_mul_RS = indices_pair_size * kv;
-            auto indice_pairs_ptr = indice_pairs.data_ptr<{self.dtype_indices}>();
-            std::unordered_map<{self.dtype_indices}, {self.dtype_indices}> hash;
-            auto indices_ptr = indices.data_ptr<const {self.dtype_indices}>();
-            auto out_inds_ptr = out_inds.data_ptr<{self.dtype_indices}>();
+            auto indices_ptr_base = indices.data_ptr<const {self.dtype_indices}>();
             TV_ASSERT_RT_ERR(input_dims.op<tv::arrayops::prod>() < std::numeric_limits<{self.dtype_indices}>::max(), 
                 "kernel volume must smaller than max value of {self.dtype_indices}");
             int indice_in_num = indices.dim(0);
-            {self.dtype_indices} hashval;
-            for (int filter_offset = 0; filter_offset < kv; ++filter_offset){{
-                int filter_offset_mul_indices_pair_size = filter_offset * indices_pair_size;
-                indices_ptr = indices.data_ptr<const {self.dtype_indices}>();
-                auto indice_num_per_loc_ptr = indice_num_per_loc.data_ptr<{self.dtype_indices}>() + filter_offset;
-                for (int i = 0; i < indice_in_num; ++i){{
-                    tv::array<int, {self.ndim + 1}> npq_offset;
-                    bool valid;
-                    if (transposed){{
-                        valid = loc_iter.query_nhw_out(indices_ptr, npq_offset);
-                    }}else{{
-                        valid = loc_iter.query_npq(indices_ptr, npq_offset);
-                    }}
-                    if (valid){{
-                        auto index = loc_iter.layout_npq(npq_offset);
-                        auto iter = hash.find(index);
-                        if (iter == hash.end()){{
-                            hashval = num_act++;
-                            hash.insert({{index, hashval}});
-                            for (int k = 0; k < {self.ndim + 1}; ++k){{
-                                out_inds_ptr[k] = npq_offset[k];
-                            }}
-                            out_inds_ptr += {self.ndim + 1};
+            // stage 1: each chunk collects (input index, output key) candidates
+            // of every filter offset.
+            int num_chunks = tv::div_up(indice_in_num, {self.cpu_chunk_size});
+            std::vector<int> chunk_counts(num_chunks * kv, 0);
+            std::vector<std::vector<int64_t>> chunk_keys(num_chunks);
+            std::vector<std::vector<{self.dtype_indices}>> chunk_inds(num_chunks);
+            std::vector<std::vector<int64_t>> chunk_uniq_keys(num_chunks);
+            tv::kernel_1d_map_cpu(indices.device(), num_chunks, [&](size_t chunk){{
+                int begin = chunk * {self.cpu_chunk_size};
+                int end = std::min(begin + {self.cpu_chunk_size}, indice_in_num);
+                {loc_type} loc_iter_chunk(problem);
+                auto& keys_chunk = chunk_keys[chunk];
+                auto& inds_chunk = chunk_inds[chunk];
+                for (int filter_offset = 0; filter_offset < kv; ++filter_offset){{
+                    loc_iter_chunk.set_filter_offset(filter_offset);
+                    auto indices_ptr_chunk = indices_ptr_base + begin * {self.ndim + 1};
+                    int count = 0;
+                    for (int i = begin; i < end; ++i){{
+                        tv::array<int, {self.ndim + 1}> npq_offset;
+                        bool valid;
+                        if (transposed){{
+                            valid = loc_iter_chunk.query_nhw_out(indices_ptr_chunk, npq_offset);
                         }}else{{
-                            hashval = iter->second;
+                            valid = loc_iter_chunk.query_npq(indices_ptr_chunk, npq_offset);
+                        }}
+                        if (valid){{
+                            keys_chunk.push_back(loc_iter_chunk.layout_npq(npq_offset));
+                            inds_chunk.push_back(i);
+                            ++count;
                         }}
-                        indice_pairs_ptr[filter_offset_mul_indices_pair_size + indice_num_per_loc_ptr[0]] = i;
-                        indice_pairs_ptr[indices_pair_size_mul_RS + filter_offset_mul_indices_pair_size + indice_num_per_loc_ptr[0]++] = hashval;
+                        indices_ptr_chunk += {self.ndim + 1};
                     }}
-                    indices_ptr += {self.ndim + 1};
+                    chunk_counts[chunk * kv + filter_offset] = count;
+                }}
+                // neighbor points produce same outputs, so remove duplicates
+                // inside chunk first to reduce the global sort.
+                auto& uniq_chunk = chunk_uniq_keys[chunk];
+                uniq_chunk = keys_chunk;
+                std::sort(uniq_chunk.begin(), uniq_chunk.end());
+                uniq_chunk.erase(std::unique(uniq_chunk.begin(), uniq_chunk.end()), uniq_chunk.end());
+            }});
+            // stage 2: sort and unique all output keys. output indices are
+            // assigned in key order, so out_inds is sorted by (batch, spatial)
+            // and doesn't depend on number of threads. sorted chunks are
+            // split to disjoint key ranges by splitters sampled from chunks,
+            // ranges are merged in parallel and concatenated.
+            std::vector<int64_t> samples;
+            for (auto& uniq_chunk : chunk_uniq_keys){{
+                size_t num_samples = std::min(uniq_chunk.size(), size_t({self.cpu_key_samples_per_chunk}));
+                for (size_t j = 0; j < num_samples; ++j){{
+                    samples.push_back(uniq_chunk[uniq_chunk.size() * j / num_samples]);
+                }}
+            }}
+            std::sort(samples.begin(), samples.end());
+            int num_ranges = samples.empty() ? 0 : num_chunks;
+            // range r contains keys in [splitters[r - 1], splitters[r]).
+            std::vector<int64_t> splitters(std::max(num_ranges - 1, 0));
+            for (int r = 0; r < int(splitters.size()); ++r){{
+                splitters[r] = samples[samples.size() * (r + 1) / num_ranges];
+            }}
+            std::vector<std::vector<int64_t>> range_keys(num_ranges);
+            tv::kernel_1d_map_cpu(indices.device(), num_ranges, [&](size_t r){{
+                auto& keys_r = range_keys[r];
+                for (auto& uniq_chunk : chunk_uniq_keys){{
+                    auto first = r == 0 ? uniq_chunk.begin() : std::lower_bound(
+                        uniq_chunk.begin(), uniq_chunk.end(), splitters[r - 1]);
+                    auto last = r + 1 == size_t(num_ranges) ? uniq_chunk.end() : std::lower_bound(
+                        uniq_chunk.begin(), uniq_chunk.end(), splitters[r]);
+                    keys_r.insert(keys_r.end(), first, last);
+                }}
+                std::sort(keys_r.begin(), keys_r.end());
+                keys_r.erase(std::unique(keys_r.begin(), keys_r.end()), keys_r.end());
+            }});
+            std::vector<std::vector<int64_t>>().swap(chunk_uniq_keys);
+            std::vector<int64_t> range_starts(num_ranges + 1, 0);
+            for (int r = 0; r < num_ranges; ++r){{
+                range_starts[r + 1] = range_starts[r] + range_keys[r].size();
+            }}
+            num_act = range_starts[num_ranges];
+            std::vector<int64_t> out_keys(num_act);
+            tv::kernel_1d_map_cpu(indices.device(), num_ranges, [&](size_t r){{
+                std::copy(range_keys[r].begin(), range_keys[r].end(), out_keys.begin() + range_starts[r]);
+                std::vector<int64_t>().swap(range_keys[r]);
+            }});
+            {alloc_out_inds}
+            auto out_inds_ptr = out_inds.data_ptr<{self.dtype_indices}>();
+            {loc_type} loc_iter(problem);
+            tv::kernel_1d_cpu(indices.device(), num_act, [&](size_t begin, size_t end, size_t step){{
+                for (size_t i = begin; i < end; i += step){{
+                    loc_iter.layout_npq.inverse(out_keys[i], out_inds_ptr + i * {self.ndim + 1});
+                }}
+            }});
+            // stage 3: prefix sum of chunk counts, then every chunk writes
+            // its pairs. pairs of one offset are ordered by input index.
+            std::vector<int> chunk_write_offsets(num_chunks * kv);
+            auto indice_num_per_loc_ptr = indice_num_per_loc.data_ptr<{self.dtype_indices}>();
+            for (int filter_offset = 0; filter_offset < kv; ++filter_offset){{
+                int total = 0;
+                for (int chunk = 0; chunk < num_chunks; ++chunk){{
+                    chunk_write_offsets[chunk * kv + filter_offset] = total;
+                    total += chunk_counts[chunk * kv + filter_offset];
+                }}
+                indice_num_per_loc_ptr[filter_offset] = total;
+            }}
+            {alloc_pairs}
+            auto indice_pairs_ptr = indice_pairs.data_ptr<{self.dtype_indices}>();
+            tv::kernel_1d_map_cpu(indices.device(), num_chunks, [&](size_t chunk){{
+                auto keys_chunk_ptr = chunk_keys[chunk].data();
+                auto inds_chunk_ptr = chunk_inds[chunk].data();
+                for (int filter_offset = 0; filter_offset < kv; ++filter_offset){{
+                    auto pair_ptr = indice_pairs_ptr + pair_offsets[filter_offset];
+                    int pos = chunk_write_offsets[chunk * kv + filter_offset];
+                    int count = chunk_counts[chunk * kv + filter_offset];
+                    for (int j = 0; j < count; ++j){{
+                        auto out_idx = std::lower_bound(out_keys.begin(), out_keys.end(), keys_chunk_ptr[j]) - out_keys.begin();
+                        pair_ptr[pos] = inds_chunk_ptr[j];
+                        pair_ptr[pair_in_out_stride + pos] = out_idx;
+                        ++pos;
+                    }}
+                    keys_chunk_ptr += count;
+                    inds_chunk_ptr += count;
+                }}
+            }});
+            """)
+        code.raw(f"""
+        return num_act;
+        """)
+        return code.ret("int")
+
+    @pccm.static_function
+    def generate_conv_inds(self):
+        return self.generate_conv_inds_template(False)
+
+    @pccm.static_function
+    def generate_conv_inds_csr(self):
+        return self.generate_conv_inds_template(True)
+
+    def generate_conv_inds_batch_csr_template(self, subm: bool):
+        code = pccm.FunctionCode()
+        code.arg("alloc_func", "std::function<tv::Tensor(std::string, std::vector<int64_t>)>")
+        code.arg("indices, indice_num_per_loc", "tv::Tensor")
+        code.arg("batch_size", "int")
+        if subm:
+            code.arg("input_dims", f"tv::array<int, {self.ndim}>")
+            code.arg("ksize, dilation", f"tv::array<int, {self.ndim}>")
+            code.arg("hash_type", "int", f"{CPUHashType.Auto.value}")
+            code.arg("half", "bool", "false")
+        else:
+            code.arg("output_dims, input_dims", f"tv::array<int, {self.ndim}>")
+            code.arg("ksize, stride, padding, dilation",
+                     f"tv::array<int, {self.ndim}>")
+            code.arg("transposed", f"bool", "false")
+        if subm:
+            run_batch = f"""
+            generate_subm_conv_inds_csr(alloc_batch, indices_batch, counts_batch[batch], 1,
+                input_dims, ksize, dilation, hash_type, half);
+            num_out_batch[batch] = num_batch;
+            """
+        else:
+            run_batch = f"""
+            num_out_batch[batch] = generate_conv_inds_csr(alloc_batch, indices_batch,
+                counts_batch[batch], 1, output_dims, input_dims, ksize, stride,
+                padding, dilation, transposed);
+            """
+        code.raw(f"""
+        // pairs never cross batches, so we group rows by batch index (counting
+        // sort), generate csr pairs of every sample with its own (small) hash
+        // table in parallel, then merge them with index fixups.
+        // nested omp regions are serial, so each sample runs in one thread.
+        int kv = ksize.op<tv::arrayops::prod>();
+        int kv_half = kv / 2;
+        int64_t num_indices = indices.dim(0);
+        auto indices_ptr = indices.data_ptr<const {self.dtype_indices}>();
+        std::vector<int64_t> batch_starts(batch_size + 1, 0);
+        for (int64_t i = 0; i < num_indices; ++i){{
+            auto batch = indices_ptr[i * {self.ndim + 1}];
+            TV_ASSERT_RT_ERR(batch >= 0 && batch < batch_size, "invalid batch index", batch);
+            ++batch_starts[batch + 1];
+        }}
+        for (int batch = 0; batch < batch_size; ++batch){{
+            batch_starts[batch + 1] += batch_starts[batch];
+        }}
+        std::vector<{self.dtype_indices}> perm(num_indices);
+        {{
+            std::vector<int64_t> batch_pos(batch_starts.begin(), batch_starts.end() - 1);
+            for (int64_t i = 0; i < num_indices; ++i){{
+                perm[batch_pos[indices_ptr[i * {self.ndim + 1}]]++] = i;
+            }}
+        }}
+        std::vector<tv::Tensor> pairs_batch(batch_size), out_inds_batch(batch_size), counts_batch(batch_size);
+        std::vector<int64_t> num_out_batch(batch_size, 0);
+        tv::kernel_1d_map_cpu(indices.device(), batch_size, [&](size_t batch){{
+            int64_t begin = batch_starts[batch];
+            int64_t num_batch = batch_starts[batch + 1] - begin;
+            counts_batch[batch] = tv::zeros({{kv}}, indices.dtype(), -1);
+            if (num_batch == 0){{
+                return;
+            }}
+            auto indices_batch = tv::empty({{num_batch, {self.ndim + 1}}}, indices.dtype(), -1);
+            auto indices_batch_ptr = indices_batch.data_ptr<{self.dtype_indices}>();
+            for (int64_t i = 0; i < num_batch; ++i){{
+                auto src = indices_ptr + perm[begin + i] * {self.ndim + 1};
+                indices_batch_ptr[i * {self.ndim + 1}] = 0;
+                for (int j = 1; j < {self.ndim + 1}; ++j){{
+                    indices_batch_ptr[i * {self.ndim + 1} + j] = src[j];
+                }}
+            }}
+            auto alloc_batch = [&](std::string name, std::vector<int64_t> shape){{
+                auto ten = tv::empty(shape, indices.dtype(), -1);
+                if (name == {pccm.literal(AllocKeys.PairFwd)}){{
+                    pairs_batch[batch] = ten;
+                }}else if (name == {pccm.literal(AllocKeys.OutIndices)}){{
+                    out_inds_batch[batch] = ten;
+                }}
+                return ten;
+            }};
+            {run_batch}
+        }});
+        // per-offset pair counts of all samples, offset k of result contains
+        // pairs of offset k of every sample.
+        auto indice_num_per_loc_ptr = indice_num_per_loc.data_ptr<{self.dtype_indices}>();
+        std::vector<int64_t> stored_counts(batch_size * kv);
+        std::vector<int64_t> pair_offsets(kv);
+        int64_t pair_total = 0;
+        for (int filter_offset = 0; filter_offset < kv; ++filter_offset){{
+            bool stored = {"!(half && filter_offset >= kv_half)" if subm else "true"};
+            int64_t count = 0;
+            pair_offsets[filter_offset] = pair_total;
+            for (int batch = 0; batch < batch_size; ++batch){{
+                auto count_batch = counts_batch[batch].data_ptr<{self.dtype_indices}>()[filter_offset];
+                count += count_batch;
+                stored_counts[batch * kv + filter_offset] = stored ? count_batch : 0;
+                if (stored){{
+                    pair_total += count_batch;
+                }}
+            }}
+            indice_num_per_loc_ptr[filter_offset] = count;
+        }}
+        std::vector<int64_t> out_starts(batch_size + 1, 0);
+        for (int batch = 0; batch < batch_size; ++batch){{
+            out_starts[batch + 1] = out_starts[batch] + num_out_batch[batch];
+        }}
+        auto indice_pairs = alloc_func({pccm.literal(AllocKeys.PairFwd)}, {{2, pair_total}});
+        auto indice_pairs_ptr = indice_pairs.data_ptr<{self.dtype_indices}>();
+        """)
+        if not subm:
+            code.raw(f"""
+            auto out_inds = alloc_func({pccm.literal(AllocKeys.OutIndices)}, {{out_starts[batch_size], {self.ndim + 1}}});
+            auto out_inds_ptr = out_inds.data_ptr<{self.dtype_indices}>();
+            """)
+        key_row = "(filter_offset > kv_half ? 1 : 0)" if subm else "0"
+        global_out = "perm[batch_starts[batch] + out_idx]" if subm else "out_starts[batch] + out_idx"
+        code.raw(f"""
+        // pairs of one offset are ordered by the input row that generates
+        // them in unsharded generators (out row for mirrored subm offsets).
+        // rows of every sample keep their relative order, so a merge of
+        // sample pairs by that row gives the unsharded result even if rows
+        // of different samples are interleaved.
+        std::vector<int64_t> src_offsets(batch_size * kv);
+        // write position of every (sample, offset) if samples are concatenated.
+        std::vector<int64_t> dst_offsets(batch_size * kv);
+        std::vector<const {self.dtype_indices}*> pair_batch_ptrs(batch_size, nullptr);
+        std::vector<int64_t> pair_batch_strides(batch_size, 0);
+        for (int batch = 0; batch < batch_size; ++batch){{
+            if (!pairs_batch[batch].empty()){{
+                pair_batch_ptrs[batch] = pairs_batch[batch].data_ptr<const {self.dtype_indices}>();
+                pair_batch_strides[batch] = pairs_batch[batch].dim(1);
+            }}
+            int64_t src_offset = 0;
+            for (int filter_offset = 0; filter_offset < kv; ++filter_offset){{
+                src_offsets[batch * kv + filter_offset] = src_offset;
+                src_offset += stored_counts[batch * kv + filter_offset];
+            }}
+        }}
+        for (int filter_offset = 0; filter_offset < kv; ++filter_offset){{
+            int64_t dst_offset = pair_offsets[filter_offset];
+            for (int batch = 0; batch < batch_size; ++batch){{
+                dst_offsets[batch * kv + filter_offset] = dst_offset;
+                dst_offset += stored_counts[batch * kv + filter_offset];
+            }}
+        }}
+        bool rows_grouped = true;
+        for (int64_t i = 0; i < num_indices; ++i){{
+            if (perm[i] != i){{
+                rows_grouped = false;
+                break;
+            }}
+        }}
+        if (rows_grouped){{
+            // rows are already grouped by batch (usual case), so samples are
+            // already in merge order: copy every segment with index fixup.
+            tv::kernel_1d_map_cpu(indices.device(), batch_size * kv, [&](size_t item){{
+                int batch = item / kv;
+                int64_t count = stored_counts[item];
+                if (count == 0){{
+                    return;
+                }}
+                auto src_ptr = pair_batch_ptrs[batch] + src_offsets[item];
+                auto src_stride = pair_batch_strides[batch];
+                auto dst_ptr = indice_pairs_ptr + dst_offsets[item];
+                {self.dtype_indices} inp_start = batch_starts[batch];
+                {self.dtype_indices} out_start = {"batch_starts[batch]" if subm else "out_starts[batch]"};
+                for (int64_t j = 0; j < count; ++j){{
+                    dst_ptr[j] = src_ptr[j] + inp_start;
+                    dst_ptr[pair_total + j] = src_ptr[src_stride + j] + out_start;
+                }}
+            }});
+        }}else{{
+            // k-way merge of samples by a min heap of (key, batch).
+            tv::kernel_1d_map_cpu(indices.device(), kv, [&](size_t filter_offset_){{
+                int filter_offset = filter_offset_;
+                int key_row = {key_row};
+                auto get_pair = [&](int batch, int64_t pos){{
+                    auto pair_batch_ptr = pair_batch_ptrs[batch];
+                    int64_t src = src_offsets[batch * kv + filter_offset] + pos;
+                    auto inp_idx = pair_batch_ptr[src];
+                    auto out_idx = pair_batch_ptr[pair_batch_strides[batch] + src];
+                    return std::make_pair(perm[batch_starts[batch] + inp_idx], 
+                        {self.dtype_indices}({global_out}));
+                }};
+                using heap_item_t = std::pair<{self.dtype_indices}, int>;
+                std::priority_queue<heap_item_t, std::vector<heap_item_t>, std::greater<heap_item_t>> heap;
+                std::vector<int64_t> cursors(batch_size, 0);
+                for (int batch = 0; batch < batch_size; ++batch){{
+                    if (stored_counts[batch * kv + filter_offset] > 0){{
+                        auto cur = get_pair(batch, 0);
+                        heap.emplace(key_row == 0 ? cur.first : cur.second, batch);
+                    }}
+                }}
+                auto pair_ptr = indice_pairs_ptr + pair_offsets[filter_offset];
+                int64_t j = 0;
+                while (!heap.empty()){{
+                    int batch = heap.top().second;
+                    heap.pop();
+                    auto cur = get_pair(batch, cursors[batch]);
+                    pair_ptr[j] = cur.first;
+                    pair_ptr[pair_total + j] = cur.second;
+                    ++j;
+                    if (++cursors[batch] < stored_counts[batch * kv + filter_offset]){{
+                        auto next = get_pair(batch, cursors[batch]);
+                        heap.emplace(key_row == 0 ? next.first : next.second, batch);
+                    }}
+                }}
+            }});
+        }}
+        """)
+        if not subm:
+            code.raw(f"""
+            tv::kernel_1d_map_cpu(indices.device(), batch_size, [&](size_t batch){{
+                if (num_out_batch[batch] == 0){{
+                    return;
+                }}
+                auto out_inds_batch_ptr = out_inds_batch[batch].data_ptr<const {self.dtype_indices}>();
+                auto out_inds_dst = out_inds_ptr + out_starts[batch] * {self.ndim + 1};
+                for (int64_t i = 0; i < num_out_batch[batch]; ++i){{
+                    out_inds_dst[i * {self.ndim + 1}] = batch;
+                    for (int j = 1; j < {self.ndim + 1}; ++j){{
+                        out_inds_dst[i * {self.ndim + 1} + j] = out_inds_batch_ptr[i * {self.ndim + 1} + j];
+                    }}
+                }}
+            }});
+            """)
+        code.raw(f"""
+        return out_starts[batch_size];
+        """)
+        return code.ret("int")
+
+    @pccm.static_function
+    def generate_subm_conv_inds_batch_csr(self):
+        return self.generate_conv_inds_batch_csr_template(True)
+
+    @pccm.static_function
+    def generate_conv_inds_batch_csr(self):
+        return self.generate_conv_inds_batch_csr_template(False)
+
+    def generate_conv_inds_batch_template(self, subm: bool):
+        code = pccm.FunctionCode()
+        code.arg("indices", "tv::Tensor")
+        code.arg("indice_pairs, out_inds, indice_num_per_loc", "tv::Tensor")
+        code.arg("batch_size", "int")
+        if subm:
+            code.arg("input_dims", f"tv::array<int, {self.ndim}>")
+            code.arg("ksize, dilation", f"tv::array<int, {self.ndim}>")
+            code.arg("hash_type", "int", f"{CPUHashType.Auto.value}")
+            run_csr = f"""
+            int num_act = generate_subm_conv_inds_batch_csr(alloc_csr, indices, indice_num_per_loc,
+                batch_size, input_dims, ksize, dilation, hash_type, false);
+            """
+        else:
+            code.arg("output_dims, input_dims", f"tv::array<int, {self.ndim}>")
+            code.arg("ksize, stride, padding, dilation",
+                     f"tv::array<int, {self.ndim}>")
+            code.arg("transposed", f"bool", "false")
+            run_csr = f"""
+            int num_act = generate_conv_inds_batch_csr(alloc_csr, indices, indice_num_per_loc,
+                batch_size, output_dims, input_dims, ksize, stride, padding, dilation, transposed);
+            """
+        code.raw(f"""
+        // batch sharded pairs are generated in csr format, then copied to
+        // dense [2, kv, N] layout of unsharded generator.
+        int kv = ksize.op<tv::arrayops::prod>();
+        tv::Tensor pairs_csr, out_inds_csr;
+        auto alloc_csr = [&](std::string name, std::vector<int64_t> shape){{
+            auto ten = tv::empty(shape, indices.dtype(), -1);
+            if (name == {pccm.literal(AllocKeys.PairFwd)}){{
+                pairs_csr = ten;
+            }}else if (name == {pccm.literal(AllocKeys.OutIndices)}){{
+                out_inds_csr = ten;
+            }}
+            return ten;
+        }};
+        {run_csr}
+        auto indice_num_per_loc_ptr = indice_num_per_loc.data_ptr<{self.dtype_indices}>();
+        std::vector<int64_t> pair_offsets(kv);
+        int64_t pair_total = 0;
+        for (int filter_offset = 0; filter_offset < kv; ++filter_offset){{
+            pair_offsets[filter_offset] = pair_total;
+            pair_total += indice_num_per_loc_ptr[filter_offset];
+        }}
+        int64_t indices_pair_size = indice_pairs.dim(2);
+        int64_t pair_in_out_stride = indices_pair_size * kv;
+        auto indice_pairs_ptr = indice_pairs.data_ptr<{self.dtype_indices}>();
+        if (pair_total > 0){{
+            auto pairs_csr_ptr = pairs_csr.data_ptr<const {self.dtype_indices}>();
+            tv::kernel_1d_map_cpu(indices.device(), kv, [&](size_t filter_offset){{
+                auto src_ptr = pairs_csr_ptr + pair_offsets[filter_offset];
+                auto dst_ptr = indice_pairs_ptr + filter_offset * indices_pair_size;
+                int64_t count = indice_num_per_loc_ptr[filter_offset];
+                std::copy(src_ptr, src_ptr + count, dst_ptr);
+                std::copy(src_ptr + pair_total, src_ptr + pair_total + count, dst_ptr + pair_in_out_stride);
+            }});
+        }}
+        """)
+        if subm:
+            code.raw(f"""
+            // unsharded subm generator only counts offsets before center.
+            int kv_half = kv / 2;
+            for (int filter_offset = kv_half; filter_offset < kv; ++filter_offset){{
+                indice_num_per_loc_ptr[filter_offset] = 0;
+            }}
+            auto center_pair_ptr = indice_pairs_ptr + kv_half * indices_pair_size;
+            int64_t indice_in_num = indices.dim(0);
+            tv::kernel_1d_cpu(indices.device(), indice_in_num, [&](size_t begin, size_t end, size_t step){{
+                for (size_t i = begin; i < end; i += step){{
+                    center_pair_ptr[i] = i;
+                    center_pair_ptr[pair_in_out_stride + i] = i;
                 }}
-                ++loc_iter;
+            }});
+            """)
+        else:
+            code.raw(f"""
+            if (num_act > 0){{
+                auto out_inds_csr_ptr = out_inds_csr.data_ptr<const {self.dtype_indices}>();
+                std::copy(out_inds_csr_ptr, out_inds_csr_ptr + int64_t(num_act) * {self.ndim + 1},
+                    out_inds.data_ptr<{self.dtype_indices}>());
             }}
             """)
         code.raw(f"""
         return num_act;
         """)
         return code.ret("int")
+
+    @pccm.static_function
+    def generate_subm_conv_inds_batch(self):
+        return self.generate_conv_inds_batch_template(True)
+
+    @pccm.static_function
+    def generate_conv_inds_batch(self):
+        return self.generate_conv_inds_batch_template(False)
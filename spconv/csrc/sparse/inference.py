@@ -15,6 +15,7 @@
 import pccm
 from cumm.common import TensorView, GemmDTypes, TensorViewKernel, TensorViewNVRTC, ThrustLib, GemmBasic
 from spconv.csrc.sparse.cpu_core import OMPLib
+from spconv.csrc.sparse.gather import GatherGemmScatterCPU
 from ..utils.launch import LaunchUtils
 from cumm.constants import CUMM_CPU_ONLY_BUILD
 
@@ -146,9 +147,11 @@ class InferenceOpsKernel(pccm.ParameterizedClass):
 
 
 class InferenceOps(pccm.Class):
+    """inference epilogues. cpu tensors use GatherGemmScatterCPU::epilogue.
+    """
     def __init__(self):
         super().__init__()
-        self.add_dependency(TensorView)
+        self.add_dependency(TensorView, GatherGemmScatterCPU)
         if not CUMM_CPU_ONLY_BUILD:
             self.add_dependency(LaunchUtils)
 
@@ -171,6 +174,11 @@ class InferenceOps(pccm.Class):
         code.arg("alpha", f"float", "0.0")
         code.arg("beta", f"float", "0.0")
         code.arg("stream", "std::uintptr_t", "0")
+        code.raw(f"""
+        if (out.is_cpu()){{
+            return GatherGemmScatterCPU::epilogue(out, bias, tv::Tensor(), act_type, alpha);
+        }}
+        """)
         if CUMM_CPU_ONLY_BUILD:
             code.raw(f"""
             TV_THROW_RT_ERR("this function don't support cpu only build.")
@@ -231,6 +239,12 @@ class InferenceOps(pccm.Class):
         code.arg("alpha", f"float")
         code.arg("beta", f"float")
         code.arg("stream", "std::uintptr_t", "0")
+        code.raw(f"""
+        if (out.is_cpu()){{
+            return GatherGemmScatterCPU::epilogue(out.view(-1, out.dim(-1)), tv::Tensor(), 
+                tv::Tensor(), act_type, alpha);
+        }}
+        """)
         if CUMM_CPU_ONLY_BUILD:
             code.raw(f"""
             TV_THROW_RT_ERR("this function don't support cpu only build.")
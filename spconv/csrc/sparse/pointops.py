@@ -723,17 +723,17 @@ class Point2VoxelCPU(pccm.ParameterizedClass, pccm.pybind.PybindClassMixin):
         """)
         return code.ret("std::array<T, N>")
 
-    @pccm.pybind.mark
+    @pccm.pybind.mark(nogil=True)
     @pccm.static_function
     def point_to_voxel_static(self):
         return self.point_to_voxel_static_template(False)
 
-    @pccm.pybind.mark
+    @pccm.pybind.mark(nogil=True)
     @pccm.static_function
     def point_to_voxel_empty_mean_static(self):
         return self.point_to_voxel_static_template(True)
 
-    @pccm.pybind.mark
+    @pccm.pybind.mark(nogil=True)
     @pccm.member_function
     def point_to_voxel(self):
         code = pccm.FunctionCode()
@@ -749,7 +749,7 @@ class Point2VoxelCPU(pccm.ParameterizedClass, pccm.pybind.PybindClassMixin):
         """)
         return code.ret("std::tuple<tv::Tensor, tv::Tensor, tv::Tensor>")
 
-    @pccm.pybind.mark
+    @pccm.pybind.mark(nogil=True)
     @pccm.member_function
     def point_to_voxel_empty_mean(self):
         code = pccm.FunctionCode()
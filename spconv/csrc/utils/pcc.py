@@ -27,7 +27,7 @@ class PointCloudCompress(pccm.Class):
             ("XYZI_8", 1),
         ])
 
-    @pccm.pybind.mark 
+    @pccm.pybind.mark(nogil=True)
     @pccm.static_function
     def encode_with_order(self):
         code = pccm.code()
@@ -169,7 +169,7 @@ class PointCloudCompress(pccm.Class):
         """)
         return code.ret("std::tuple<tv::Tensor, tv::Tensor>")
 
-    @pccm.pybind.mark 
+    @pccm.pybind.mark(nogil=True)
     @pccm.static_function
     def encode_xyzi(self):
         code = pccm.code()
@@ -185,7 +185,7 @@ class PointCloudCompress(pccm.Class):
         """)
         return code.ret("tv::Tensor")
 
-    @pccm.pybind.mark 
+    @pccm.pybind.mark(nogil=True)
     @pccm.static_function
     def encode_xyz(self):
         code = pccm.code()
@@ -199,7 +199,7 @@ class PointCloudCompress(pccm.Class):
         """)
         return code.ret("tv::Tensor")
 
-    @pccm.pybind.mark 
+    @pccm.pybind.mark(nogil=True)
     @pccm.static_function
     def decode(self):
         code = pccm.code()
@@ -4,7 +4,8 @@ from typing import Union
 
 import numpy as np
 import torch
-from spconv.pytorch.core import SparseConvTensor
+from spconv.pytorch.core import (CPUArenaAllocator, KernelMapCache,
+                                 SparseConvTensor)
 from spconv.pytorch import functional, ops
 from spconv.pytorch.conv import (SparseConv1d, SparseConv2d, SparseConv3d,
                                  SparseConv4d, SparseConvTranspose1d,
@@ -24,6 +25,8 @@ from spconv.pytorch.pool import (SparseMaxPool1d, SparseMaxPool2d,
                                  SparseAvgPool3d, SparseGlobalMaxPool,
                                  SparseGlobalAvgPool)
 from spconv.pytorch.tables import AddTable, ConcatTable, JoinTable
+from spconv.pytorch.planner import (KernelMapPlan, StaticMemoryPlan,
+                                    plan_kernel_maps, plan_static_memory)
 
 
 class ToDense(SparseModule):
@@ -15,7 +15,7 @@
 import math
 import time
 import sys
-from typing import List, Optional, Tuple, Union
+from typing import Callable, List, Optional, Tuple, Union
 
 import numpy as np
 import torch
@@ -25,12 +25,14 @@ from torch.nn.parameter import Parameter
 
 from spconv import pytorch as spconv
 from spconv import SPCONV_VERSION_NUMBERS
-from spconv.core import ConvAlgo
+from spconv import constants
+from spconv.core import ConvAlgo, CPUConvStrategy
 from spconv.debug_utils import spconv_save_debug_data
 from spconv.pytorch import functional as Fsp
 from spconv.pytorch import ops
+from spconv.pytorch.cpu_tuner import CPU_TUNER
 from spconv.cppconstants import CPU_ONLY_BUILD
-from spconv.pytorch.core import IndiceData, SparseConvTensor, ImplicitGemmIndiceData, expand_nd
+from spconv.pytorch.core import IndiceData, SparseConvTensor, ImplicitGemmIndiceData, StaticCPUArena, expand_nd
 from spconv.pytorch.modules import SparseModule
 from spconv.constants import SAVED_WEIGHT_LAYOUT, ALL_WEIGHT_IS_KRSC, SPCONV_DEBUG_WEIGHT
 from spconv.utils import nullcontext
@@ -58,6 +60,17 @@ def _apply_act(x: torch.Tensor, act_type: tv.gemm.Activation, act_alpha: float,
         raise NotImplementedError
 
 
+_DENSE_CONV_FUNCS = {1: F.conv1d, 2: F.conv2d, 3: F.conv3d}
+
+
+def _linear_spatial_index(indices: torch.Tensor,
+                          spatial_shape: List[int]) -> torch.Tensor:
+    res = indices[:, 1]
+    for i in range(1, len(spatial_shape)):
+        res = res * spatial_shape[i] + indices[:, i + 1]
+    return res
+
+
 class SparseConvolutionBase:
 
     def __init__(self,
@@ -121,12 +134,16 @@ class SparseConvolutionBase:
         # if kv > 32:
         #     assert algo == ConvAlgo.Native, "implicit gemm don't support kv >= 32 for now"
         if CPU_ONLY_BUILD:
-            assert algo == ConvAlgo.Native, "cpu only build only support native algorithm"
+            assert algo in (ConvAlgo.Native, ConvAlgo.MaskImplicitGemm,
+                            ConvAlgo.MaskSplitImplicitGemm,
+                            ConvAlgo.OutputStationary
+                            ), "cpu only build only support native, output stationary and mask implicit gemm algorithm"
         self.algo = algo
         self.fp32_accum = fp32_accum
         # self.algo = ConvAlgo.Native
 
-        if self.algo == ConvAlgo.Native and not ALL_WEIGHT_IS_KRSC:
+        if self.algo in (ConvAlgo.Native, ConvAlgo.OutputStationary
+                         ) and not ALL_WEIGHT_IS_KRSC:
             if FILTER_HWIO:
                 # RSCK
                 weight_shape = [*self.kernel_size, in_channels, out_channels]
@@ -142,9 +159,149 @@ class SparseConvolutionBase:
         self.act_beta = act_beta
         self.scale = 1.0
         self.zero_point = 0
+        # (weight key, [kv, C, K] weight) of cpu inference
+        self._packed_weight_cache = None
+        # run as dense conv if occupancy of input exceeds it, None disables.
+        self.dense_fallback_threshold: Optional[float] = None
         if self.conv1x1:
             assert act_type == tv.gemm.Activation.None_, "conv1x1 don't support fused act"
 
+    def _packed_weight_cpu(self, weight: torch.Tensor) -> torch.Tensor:
+        """per-offset contiguous weight for cpu inference. packed once and
+        reused until weight is modified (checked by its version counter)
+        or replaced.
+        """
+        key = (weight.data_ptr(), weight._version, weight.dtype,
+               tuple(weight.shape))
+        cache = getattr(self, "_packed_weight_cache", None)
+        if cache is None or cache[0] != key:
+            with torch.no_grad():
+                cache = (key, ops.pack_filters_cpu(weight))
+            self._packed_weight_cache = cache
+        return cache[1]
+
+    def enable_dense_fallback(self,
+                              enable: bool = True,
+                              threshold: Optional[float] = None):
+        """run this layer as dense torch conv when input occupancy
+        num_voxels / (batch_size * prod(spatial_shape)) is above threshold.
+        threshold defaults to 0.8 for subm and 0.2 for regular conv (about
+        where dense 3x3x3 conv with 32 channels gets faster on cpu, regular
+        conv pair generation is much more expensive). only 1d/2d/3d
+        regular and subm conv are supported, inverse/transposed conv and
+        regular conv with indice_key (used by inverse conv) always run sparse.
+        with SPCONV_CPU_AUTOTUNE, cpu inputs above threshold time dense and
+        sparse conv once per tuner key and run the faster one.
+        """
+        if not enable:
+            self.dense_fallback_threshold = None
+        elif threshold is None:
+            self.dense_fallback_threshold = 0.8 if self.subm else 0.2
+        else:
+            self.dense_fallback_threshold = threshold
+
+    def _use_dense_fallback(
+            self,
+            input: SparseConvTensor,
+            is_int8: bool,
+            run: Optional[Callable[[bool], SparseConvTensor]] = None) -> bool:
+        """run(dense) runs this layer for cpu autotune, no tuning if None."""
+        # models pickled by older versions don't have this attribute.
+        threshold = getattr(self, "dense_fallback_threshold", None)
+        if threshold is None or is_int8 or self.conv1x1:
+            return False
+        if self.inverse or self.transposed or self.ndim not in _DENSE_CONV_FUNCS:
+            return False
+        if not self.subm and self.indice_key is not None:
+            # inverse conv needs kernel map of this layer.
+            return False
+        if self.subm and any(k % 2 == 0 for k in self.kernel_size):
+            return False
+        num_sites = input.batch_size * int(np.prod(input.spatial_shape))
+        num_voxels = input.indices.shape[0]
+        if num_voxels <= threshold * num_sites:
+            return False
+        if (run is None or not constants.SPCONV_CPU_AUTOTUNE
+                or input.features.is_cuda):
+            return True
+        key = CPU_TUNER.get_dense_key(self.in_channels, self.out_channels,
+                                      self.kernel_size, self.stride,
+                                      num_voxels, num_sites,
+                                      input.features.dtype, self.subm)
+        strategy = CPU_TUNER.get_tuned_strategy(key)
+        if strategy is None:
+            def run_strategy(st: CPUConvStrategy):
+                with torch.no_grad():
+                    run(st == CPUConvStrategy.Dense)
+
+            strategy = CPU_TUNER.tune_and_cache(
+                key, run_strategy,
+                [CPUConvStrategy.Dense, CPUConvStrategy.Sparse])
+        return strategy == CPUConvStrategy.Dense
+
+    def _dense_conv_weight(self, weight: torch.Tensor) -> torch.Tensor:
+        """weight in torch conv layout [K, C, *ksize]."""
+        ndim = self.ndim
+        if self.algo in (ConvAlgo.Native, ConvAlgo.OutputStationary
+                         ) and not ALL_WEIGHT_IS_KRSC:
+            if FILTER_HWIO:
+                # RSCK
+                return weight.permute(ndim + 1, ndim, *range(ndim))
+            # RSKC
+            return weight.permute(ndim, ndim + 1, *range(ndim))
+        return weight.permute(0, ndim + 1, *range(1, ndim + 1))
+
+    def _dense_conv(self, input: SparseConvTensor, weight: torch.Tensor,
+                    bias: Optional[torch.Tensor]):
+        """scatter input to a dense grid, run torch conv and gather
+        features of active output sites. subm outputs are gathered at input
+        indices, regular conv outputs at sites whose receptive field
+        contains an input (same as native pairs, sorted by location).
+        """
+        conv_func = _DENSE_CONV_FUNCS[self.ndim]
+        features = input.features
+        indices = input.indices
+        indices_l = indices.long()
+        spatial_shape = input.spatial_shape
+        batch_size = input.batch_size
+        num_sites = int(np.prod(spatial_shape))
+        batch_inds = indices_l[:, 0]
+        lin_inds = _linear_spatial_index(indices_l, spatial_shape)
+        # scatter to channel-first grid directly instead of
+        # SparseConvTensor.dense (channel-last scatter_nd + permute copy).
+        grid = features.new_zeros([batch_size, self.in_channels, num_sites])
+        grid[batch_inds, :, lin_inds] = features
+        grid = grid.view(batch_size, self.in_channels, *spatial_shape)
+        if self.subm:
+            stride = [1] * self.ndim
+            padding = [
+                d * (k - 1) // 2 for k, d in zip(self.kernel_size, self.dilation)
+            ]
+        else:
+            stride = self.stride
+            padding = self.padding
+        out = conv_func(grid, self._dense_conv_weight(weight), bias, stride,
+                        padding, self.dilation)
+        out = out.reshape(batch_size, self.out_channels, -1)
+        if self.subm:
+            return indices, out[batch_inds, :, lin_inds]
+        # output sites = nonzero of occupancy convolved with a ones kernel.
+        mask = torch.zeros([batch_size, 1, num_sites],
+                           dtype=torch.float32,
+                           device=features.device)
+        mask[batch_inds, 0, lin_inds] = 1
+        mask = mask.view(batch_size, 1, *spatial_shape)
+        ones = torch.ones([1, 1, *self.kernel_size],
+                          dtype=torch.float32,
+                          device=features.device)
+        out_mask = conv_func(mask, ones, None, stride, padding, self.dilation)
+        out_inds = torch.nonzero(out_mask[:, 0] > 0)
+        out_lin_inds = _linear_spatial_index(out_inds,
+                                             list(out_mask.shape[2:]))
+        out_features = out[out_inds[:, 0], :, out_lin_inds]
+        # nonzero result may be column-major, kernels need contiguous rows.
+        return out_inds.to(indices.dtype).contiguous(), out_features
+
     def is_inverseable(self):
         return self.indice_key is not None and not self.subm
 
@@ -160,7 +317,11 @@ class SparseConvolutionBase:
                       sparse_unique_name: str = "",
                       act_type: tv.gemm.Activation = tv.gemm.Activation.None_,
                       act_alpha: float = 0,
-                      act_beta: float = 0):
+                      act_beta: float = 0,
+                      dense_fallback: Optional[bool] = None):
+        """dense_fallback forces dense or sparse conv (used by cpu autotune),
+        None selects it by _use_dense_fallback.
+        """
         # assert isinstance(input, SparseConvTensor)
         is_int8 = input.is_quantized and weight.is_quantized
         if is_int8:
@@ -175,6 +336,8 @@ class SparseConvolutionBase:
         batch_size = input.batch_size
         bias_for_training = bias if training else None
         bias_for_infer = bias if not training else None
+        # residual add of native inference is fused into conv epilogue.
+        add_input_fused = False
         output_add_scale = 0.0
         if is_int8:
             if add_input is not None:
@@ -239,6 +402,27 @@ class SparseConvolutionBase:
             # padding may change spatial shape of conv 1x1.
             out_tensor.spatial_shape = out_spatial_shape
             return out_tensor
+        if dense_fallback is None:
+            dense_fallback = self._use_dense_fallback(
+                input, is_int8, lambda dense: self._conv_forward(
+                    training, input, weight, bias, add_input, channel_scale,
+                    output_scale, name, sparse_unique_name, act_type,
+                    act_alpha, act_beta, dense_fallback=dense))
+        if dense_fallback:
+            outids, out_features = self._dense_conv(input, weight, bias)
+            if add_input is not None:
+                out_features = out_features + add_input.features
+            out_features = _apply_act(out_features, act_type, act_alpha,
+                                      act_beta)
+            if not self.subm and self.record_voxel_count:
+                if hasattr(self, _MAX_NUM_VOXELS_DURING_TRAINING):
+                    ops.maximum_value_int_(
+                        getattr(self, _MAX_NUM_VOXELS_DURING_TRAINING),
+                        outids.shape[0])
+            out_tensor = out_tensor.replace_feature(out_features)
+            out_tensor.indices = outids
+            out_tensor.spatial_shape = out_spatial_shape
+            return out_tensor
         indice_dict = input.indice_dict.copy()
         # only support contiguous tensor for now
         if not features.is_contiguous():
@@ -250,11 +434,16 @@ class SparseConvolutionBase:
                 msg = "due to limitation of pytorch, you must provide same algo to layers share same indice key."
                 assert algo == datas.algo, msg
                 # algo = datas.algo
+        cpu_arena = input.cpu_arena
+        if isinstance(cpu_arena, StaticCPUArena):
+            # planned memory is reused in next forward, so it can't be
+            # saved for backward.
+            cpu_arena = cpu_arena.layer(self) if not training else None
         profile_ctx = nullcontext()
         if input._timer is not None and sparse_unique_name:
             profile_ctx = input._timer.namespace(sparse_unique_name)
         with profile_ctx:
-            if algo == ConvAlgo.Native:
+            if algo in (ConvAlgo.Native, ConvAlgo.OutputStationary):
                 datas = input.find_indice_pair(self.indice_key)
                 if datas is not None:
                     assert isinstance(datas, IndiceData)
@@ -265,6 +454,7 @@ class SparseConvolutionBase:
                     outids = datas.indices
                     indice_pairs = datas.indice_pairs
                     indice_pair_num = datas.indice_pair_num
+                    subm_half = datas.subm_half
                     out_spatial_shape = datas.spatial_shape
                     self._check_inverse_reuse_valid(input, spatial_shape,
                                                     datas)
@@ -273,46 +463,65 @@ class SparseConvolutionBase:
                         outids = datas.out_indices
                         indice_pairs = datas.indice_pairs
                         indice_pair_num = datas.indice_pair_num
+                        subm_half = datas.subm_half
                         assert self.subm, "only support reuse subm indices"
                         self._check_subm_reuse_valid(input, spatial_shape,
                                                      datas)
                     else:
-                        if input.benchmark:
-                            torch.cuda.synchronize()
-                            t = time.time()
-                        try:
-                            outids, indice_pairs, indice_pair_num = ops.get_indice_pairs(
-                                indices, batch_size, spatial_shape, algo,
-                                self.kernel_size, self.stride, self.padding,
-                                self.dilation, self.output_padding, self.subm,
-                                self.transposed)
-                        except Exception as e:
-                            msg = "[Exception|native_pair]"
-                            msg += f"indices={indices.shape},bs={batch_size},ss={spatial_shape},"
-                            msg += f"algo={algo},ksize={self.kernel_size},stride={self.stride},"
-                            msg += f"padding={self.padding},dilation={self.dilation},subm={self.subm},"
-                            msg += f"transpose={self.transposed}"
-                            print(msg, file=sys.stderr)
-                            spconv_save_debug_data(indices)
-                            raise e
-                        if input.benchmark:
-                            torch.cuda.synchronize()
-                            interval = time.time() - t
-                            out_tensor.benchmark_record[name][
-                                "indice_gen_time"].append(interval)
-
-                        indice_data = IndiceData(outids,
-                                                 indices,
-                                                 indice_pairs,
-                                                 indice_pair_num,
-                                                 spatial_shape,
-                                                 out_spatial_shape,
-                                                 is_subm=self.subm,
-                                                 algo=algo,
-                                                 ksize=self.kernel_size,
-                                                 stride=self.stride,
-                                                 padding=self.padding,
-                                                 dilation=self.dilation)
+                        cache_key, indice_data = self._find_cached_kernel_map(
+                            input, algo)
+                        if indice_data is None and self.subm:
+                            indice_data = self._derive_subm_kernel_map(input)
+                            if indice_data is not None and cache_key is not None:
+                                input.kernel_map_cache.put(cache_key, indice_data)
+                        if indice_data is not None:
+                            outids = indice_data.out_indices
+                            indice_pairs = indice_data.indice_pairs
+                            indice_pair_num = indice_data.indice_pair_num
+                            subm_half = indice_data.subm_half
+                        else:
+                            if input.benchmark:
+                                torch.cuda.synchronize()
+                                t = time.time()
+                            try:
+                                # output stationary uses native pairs.
+                                outids, indice_pairs, indice_pair_num = ops.get_indice_pairs(
+                                    indices, batch_size, spatial_shape, ConvAlgo.Native,
+                                    self.kernel_size, self.stride, self.padding,
+                                    self.dilation, self.output_padding, self.subm,
+                                    self.transposed, arena=cpu_arena)
+                                subm_half = ops.cpu_subm_pairs_are_half(
+                                    indices, self.subm)
+                            except Exception as e:
+                                msg = "[Exception|native_pair]"
+                                msg += f"indices={indices.shape},bs={batch_size},ss={spatial_shape},"
+                                msg += f"algo={algo},ksize={self.kernel_size},stride={self.stride},"
+                                msg += f"padding={self.padding},dilation={self.dilation},subm={self.subm},"
+                                msg += f"transpose={self.transposed}"
+                                print(msg, file=sys.stderr)
+                                spconv_save_debug_data(indices)
+                                raise e
+                            if input.benchmark:
+                                torch.cuda.synchronize()
+                                interval = time.time() - t
+                                out_tensor.benchmark_record[name][
+                                    "indice_gen_time"].append(interval)
+
+                            indice_data = IndiceData(outids,
+                                                     indices,
+                                                     indice_pairs,
+                                                     indice_pair_num,
+                                                     spatial_shape,
+                                                     out_spatial_shape,
+                                                     is_subm=self.subm,
+                                                     algo=algo,
+                                                     ksize=self.kernel_size,
+                                                     stride=self.stride,
+                                                     padding=self.padding,
+                                                     dilation=self.dilation,
+                                                     subm_half=subm_half)
+                            if cache_key is not None:
+                                input.kernel_map_cache.put(cache_key, indice_data)
                         if self.indice_key is not None:
                             msg = f"your indice key {self.indice_key} already exists in this sparse tensor."
                             assert self.indice_key not in indice_dict, msg
@@ -323,24 +532,34 @@ class SparseConvolutionBase:
                 indice_pairs_calc = indice_pairs
                 if indice_pairs.device != features.device:
                     indice_pairs_calc = indice_pairs.to(features.device)
+                add_for_infer = None
+                if add_input is not None and not training:
+                    add_for_infer = add_input.features
+                    add_input_fused = True
+                weight_packed = None
+                if not training and not features.is_cuda:
+                    weight_packed = self._packed_weight_cpu(weight)
                 if self.subm:
                     out_features = Fsp.indice_subm_conv(
                         features, weight, indice_pairs_calc, indice_pair_num,
                         outids.shape[0], algo, input._timer, bias_for_infer,
-                        act_alpha, act_beta, act_type)
+                        act_alpha, act_beta, act_type, add_for_infer,
+                        weight_packed, cpu_arena, subm_half)
                 else:
                     if self.inverse:
                         out_features = Fsp.indice_inverse_conv(
                             features, weight, indice_pairs_calc,
                             indice_pair_num, outids.shape[0], algo,
                             input._timer, bias_for_infer, act_alpha, act_beta,
-                            act_type)
+                            act_type, add_for_infer, weight_packed,
+                            cpu_arena, subm_half)
                     else:
                         out_features = Fsp.indice_conv(
                             features, weight, indice_pairs_calc,
                             indice_pair_num, outids.shape[0], algo,
-                            input._timer, bias_for_infer, act_type, act_beta,
-                            act_type)
+                            input._timer, bias_for_infer, act_alpha, act_beta,
+                            act_type, add_for_infer, weight_packed,
+                            cpu_arena, subm_half)
             else:
                 datas = input.find_indice_pair(self.indice_key)
                 if datas is not None:
@@ -375,70 +594,86 @@ class SparseConvolutionBase:
                         self._check_subm_reuse_valid(input, spatial_shape,
                                                      datas)
                     else:
-                        if input.benchmark:
-                            torch.cuda.synchronize()
-                            t = time.time()
-                        with input._timer.namespace("gen_pairs"):
-                            # we need to gen bwd indices for regular conv
-                            # because it may be inversed.
-                            try:
-                                res = ops.get_indice_pairs_implicit_gemm(
+                        is_train = (not self.subm) or training
+                        cache_key, indice_data = self._find_cached_kernel_map(
+                            input, algo, is_train)
+                        if indice_data is not None:
+                            outids = indice_data.out_indices
+                            pair_fwd = indice_data.pair_fwd
+                            pair_bwd = indice_data.pair_bwd
+                            pair_mask_fwd_splits = indice_data.pair_mask_fwd_splits
+                            pair_mask_bwd_splits = indice_data.pair_mask_bwd_splits
+                            mask_argsort_fwd_splits = indice_data.mask_argsort_fwd_splits
+                            mask_argsort_bwd_splits = indice_data.mask_argsort_bwd_splits
+                            masks = indice_data.masks
+                        else:
+                            if input.benchmark:
+                                torch.cuda.synchronize()
+                                t = time.time()
+                            with input._timer.namespace("gen_pairs"):
+                                # we need to gen bwd indices for regular conv
+                                # because it may be inversed.
+                                try:
+                                    res = ops.get_indice_pairs_implicit_gemm(
+                                        indices,
+                                        batch_size,
+                                        spatial_shape,
+                                        algo,
+                                        ksize=self.kernel_size,
+                                        stride=self.stride,
+                                        padding=self.padding,
+                                        dilation=self.dilation,
+                                        out_padding=self.output_padding,
+                                        subm=self.subm,
+                                        transpose=self.transposed,
+                                        is_train=is_train,
+                                        alloc=input.thrust_allocator,
+                                        timer=input._timer)
+                                except Exception as e:
+                                    msg = "[Exception|implicit_gemm_pair]"
+                                    msg += f"indices={indices.shape},bs={batch_size},ss={spatial_shape},"
+                                    msg += f"algo={algo},ksize={self.kernel_size},stride={self.stride},"
+                                    msg += f"padding={self.padding},dilation={self.dilation},subm={self.subm},"
+                                    msg += f"transpose={self.transposed}"
+                                    print(msg, file=sys.stderr)
+                                    spconv_save_debug_data(indices)
+                                    raise e
+                            if input.benchmark:
+                                torch.cuda.synchronize()
+                                interval = time.time() - t
+                                out_tensor.benchmark_record[name][
+                                    "indice_gen_time"].append(interval)
+                            outids = res[0]
+                            num_inds_per_loc = res[1]
+                            pair_fwd = res[2]
+                            pair_bwd = res[3]
+                            pair_mask_fwd_splits = res[4]
+                            pair_mask_bwd_splits = res[5]
+                            mask_argsort_fwd_splits = res[6]
+                            mask_argsort_bwd_splits = res[7]
+                            masks = res[8]
+                            if self.indice_key is not None or cache_key is not None:
+                                indice_data = ImplicitGemmIndiceData(
+                                    outids,
                                     indices,
-                                    batch_size,
-                                    spatial_shape,
-                                    algo,
+                                    pair_fwd,
+                                    pair_bwd,
+                                    pair_mask_fwd_splits=pair_mask_fwd_splits,
+                                    pair_mask_bwd_splits=pair_mask_bwd_splits,
+                                    mask_argsort_fwd_splits=mask_argsort_fwd_splits,
+                                    mask_argsort_bwd_splits=mask_argsort_bwd_splits,
+                                    masks=masks,
+                                    is_subm=self.subm,
+                                    spatial_shape=spatial_shape,
+                                    out_spatial_shape=out_spatial_shape,
+                                    algo=algo,
                                     ksize=self.kernel_size,
                                     stride=self.stride,
                                     padding=self.padding,
-                                    dilation=self.dilation,
-                                    out_padding=self.output_padding,
-                                    subm=self.subm,
-                                    transpose=self.transposed,
-                                    is_train=(not self.subm) or training,
-                                    alloc=input.thrust_allocator,
-                                    timer=input._timer)
-                            except Exception as e:
-                                msg = "[Exception|implicit_gemm_pair]"
-                                msg += f"indices={indices.shape},bs={batch_size},ss={spatial_shape},"
-                                msg += f"algo={algo},ksize={self.kernel_size},stride={self.stride},"
-                                msg += f"padding={self.padding},dilation={self.dilation},subm={self.subm},"
-                                msg += f"transpose={self.transposed}"
-                                print(msg, file=sys.stderr)
-                                spconv_save_debug_data(indices)
-                                raise e
-                        if input.benchmark:
-                            torch.cuda.synchronize()
-                            interval = time.time() - t
-                            out_tensor.benchmark_record[name][
-                                "indice_gen_time"].append(interval)
-                        outids = res[0]
-                        num_inds_per_loc = res[1]
-                        pair_fwd = res[2]
-                        pair_bwd = res[3]
-                        pair_mask_fwd_splits = res[4]
-                        pair_mask_bwd_splits = res[5]
-                        mask_argsort_fwd_splits = res[6]
-                        mask_argsort_bwd_splits = res[7]
-                        masks = res[8]
+                                    dilation=self.dilation)
+                            if cache_key is not None:
+                                input.kernel_map_cache.put(cache_key, indice_data)
                         if self.indice_key is not None:
-                            indice_data = ImplicitGemmIndiceData(
-                                outids,
-                                indices,
-                                pair_fwd,
-                                pair_bwd,
-                                pair_mask_fwd_splits=pair_mask_fwd_splits,
-                                pair_mask_bwd_splits=pair_mask_bwd_splits,
-                                mask_argsort_fwd_splits=mask_argsort_fwd_splits,
-                                mask_argsort_bwd_splits=mask_argsort_bwd_splits,
-                                masks=masks,
-                                is_subm=self.subm,
-                                spatial_shape=spatial_shape,
-                                out_spatial_shape=out_spatial_shape,
-                                algo=algo,
-                                ksize=self.kernel_size,
-                                stride=self.stride,
-                                padding=self.padding,
-                                dilation=self.dilation)
                             msg = f"your indice key {self.indice_key} already exists in this sparse tensor."
                             assert self.indice_key not in indice_dict, msg
                             indice_dict[self.indice_key] = indice_data
@@ -508,7 +743,7 @@ class SparseConvolutionBase:
         out_tensor.indices = outids
         out_tensor.indice_dict = indice_dict
         out_tensor.spatial_shape = out_spatial_shape
-        if add_input is not None and not is_int8:
+        if add_input is not None and not is_int8 and not add_input_fused:
             # in int8, we apply add + act in kernel.
             out_tensor = out_tensor.replace_feature(
                 _apply_act(out_tensor.features + add_input.features,
@@ -516,6 +751,32 @@ class SparseConvolutionBase:
 
         return out_tensor
 
+    def _find_cached_kernel_map(self, inp: SparseConvTensor, algo: ConvAlgo,
+                                is_train: bool = True):
+        cache = inp.kernel_map_cache
+        if cache is None:
+            return None, None
+        key = cache.get_key(inp.indices, inp.batch_size, inp.spatial_shape,
+                            algo, self.kernel_size, self.stride, self.padding,
+                            self.dilation, self.output_padding, self.subm,
+                            self.transposed, is_train)
+        return key, cache.get(key)
+
+    def _derive_subm_kernel_map(
+            self, inp: SparseConvTensor) -> Optional[IndiceData]:
+        # a native subm map of a larger kernel on same indices contains
+        # all pairs of this layer.
+        for datas in inp.indice_dict.values():
+            same_indices = (datas.indices is inp.indices
+                            or datas.out_indices is inp.indices)
+            if (isinstance(datas, IndiceData) and same_indices
+                    and datas.algo == self.algo
+                    and datas.spatial_shape == inp.spatial_shape
+                    and datas.can_derive_subm(self.kernel_size,
+                                              self.dilation)):
+                return datas.derive_subm(self.kernel_size, self.dilation)
+        return None
+
     def _check_subm_reuse_valid(self, inp: SparseConvTensor,
                                 spatial_shape: List[int],
                                 datas: Union[ImplicitGemmIndiceData,
@@ -663,7 +924,8 @@ class SparseConvolution(SparseConvolutionBase, SparseModule):
             state_dict[key] = state_dict[key].permute(ndim + 1, *range(ndim),
                                                       ndim).contiguous()
 
-        if ALL_WEIGHT_IS_KRSC or self.algo != ConvAlgo.Native:
+        if ALL_WEIGHT_IS_KRSC or self.algo not in (ConvAlgo.Native,
+                                                   ConvAlgo.OutputStationary):
             # in spconv 2.2, we only support KRSC layout.
             if SAVED_WEIGHT_LAYOUT == "RSKC":
                 state_dict[key] = state_dict[key].permute(
@@ -673,7 +935,7 @@ class SparseConvolution(SparseConvolutionBase, SparseModule):
                     ndim + 1, *range(ndim), ndim).contiguous()
 
         else:
-            if self.algo == ConvAlgo.Native:
+            if self.algo in (ConvAlgo.Native, ConvAlgo.OutputStationary):
                 # to RSCK
                 if SAVED_WEIGHT_LAYOUT == "RSKC":
                     state_dict[key] = state_dict[key].permute(
@@ -12,12 +12,18 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, Future, wait
 from typing import Any, List, Optional, Tuple, TypeVar, Union, Dict
 
 import numpy as np
 import torch
 from spconv.core import ConvAlgo
 from spconv.pytorch.constants import PYTORCH_VERSION
+from spconv.pytorch.utils import space_filling_curve_argsort
 from spconv.tools import CUDAKernelTimer
 from spconv.constants import SPCONV_FX_TRACE_MODE
 
@@ -61,10 +67,15 @@ class IndiceData(object):
     def __init__(self, out_indices, indices, indice_pairs, indice_pair_num,
                  spatial_shape, out_spatial_shape, is_subm: bool, algo: ConvAlgo,
                  ksize: List[int], stride: List[int], dilation: List[int], padding: List[int],
-                 voxel_num: Optional[Any] = None):
+                 voxel_num: Optional[Any] = None, subm_half: bool = False):
         self.out_indices = out_indices
         self.indices = indices
+        # [2, kv, N] or csr pairs [2, total] (cpu only),
+        # see ops.get_indice_pairs.
         self.indice_pairs = indice_pairs
+        # csr subm pairs only store offsets before center,
+        # see ops.cpu_subm_pairs_are_half.
+        self.subm_half = subm_half
         self.indice_pair_num = indice_pair_num
         self.spatial_shape = spatial_shape
         self.out_spatial_shape = out_spatial_shape
@@ -77,6 +88,42 @@ class IndiceData(object):
         # voxel_num is only used in tensorrt conversion.
         self.voxel_num = voxel_num
 
+    def can_derive_subm(self, ksize: List[int], dilation: List[int]) -> bool:
+        from spconv.pytorch import ops
+        if not self.is_subm or self.algo not in (ConvAlgo.Native,
+                                                 ConvAlgo.OutputStationary):
+            return False
+        return ops.subm_kernel_offset_map(ksize, dilation, self.ksize,
+                                          self.dilation) is not None
+
+    def derive_subm(self, ksize: List[int],
+                    dilation: List[int]) -> "IndiceData":
+        """get subm kernel map of a smaller kernel (or larger dilation
+        that is a multiple of self.dilation) on same indices by filtering
+        kernel offsets of this map, without hashing indices again.
+        """
+        from spconv.pytorch import ops
+        assert self.is_subm and self.algo in (
+            ConvAlgo.Native,
+            ConvAlgo.OutputStationary), "only native subm map can be derived"
+        indice_pairs, indice_pair_num = ops.derive_subm_indice_pairs(
+            self.indice_pairs, self.indice_pair_num, self.ksize,
+            self.dilation, ksize, dilation, self.subm_half)
+        padding = [(k // 2) * d for k, d in zip(ksize, dilation)]
+        return IndiceData(self.out_indices,
+                          self.indices,
+                          indice_pairs,
+                          indice_pair_num,
+                          self.spatial_shape,
+                          self.out_spatial_shape,
+                          is_subm=True,
+                          algo=self.algo,
+                          ksize=list(ksize),
+                          stride=self.stride,
+                          dilation=list(dilation),
+                          padding=padding,
+                          subm_half=self.subm_half)
+
 
 class ImplicitGemmIndiceData(object):
     def __init__(self, out_indices: torch.Tensor, indices: torch.Tensor,
@@ -112,6 +159,377 @@ class ImplicitGemmIndiceData(object):
         self.out_voxel_num = out_voxel_num
 
 
+def _indice_data_nbytes(data: Union[IndiceData, ImplicitGemmIndiceData]) -> int:
+    nbytes = 0
+    for v in vars(data).values():
+        vs = v if isinstance(v, (list, tuple)) else [v]
+        for t in vs:
+            if isinstance(t, torch.Tensor):
+                nbytes += t.numel() * t.element_size()
+    return nbytes
+
+
+class KernelMapCache:
+    """content-addressed LRU cache of kernel maps. kernel maps are keyed by
+    a hash of indices content and all conv params, so repeated forwards
+    (test-time augmentation, multiple heads) with identical coordinates skip
+    pair generation. assign it to SparseConvTensor.kernel_map_cache to
+    enable it, it's shared by all tensors derived from that tensor.
+
+    cached maps are reused as-is, so don't modify pairs inplace.
+    hashing cuda indices needs a device to host copy. digest of an indices
+    tensor is computed once and reused by all layers sharing that tensor
+    until it's modified inplace.
+    the cache is thread safe. maps may be produced by background jobs
+    registered by add_pending (see KernelMapPlan.generate), get waits for
+    them before reporting a miss.
+    """
+    def __init__(self, max_bytes: int = 1 << 30):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[tuple, Tuple[Any, int]]" = OrderedDict()
+        self._pending: List[Future] = []
+        # id(indices) -> (weakref of indices, _version, data_ptr, digest)
+        self._digests: Dict[int, Tuple[weakref.ref, int, int, str]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def hash_indices_content(indices: torch.Tensor) -> str:
+        data = indices.detach().contiguous().cpu().numpy()
+        return hashlib.blake2b(data.tobytes(), digest_size=16).hexdigest()
+
+    def hash_indices(self, indices: torch.Tensor) -> str:
+        """memoized hash_indices_content. entry of a tensor is dropped
+        when it's freed and recomputed after inplace modification.
+        """
+        # single dict operations are atomic, no lock here: the callback
+        # may run while any lock is held when a tensor is freed.
+        digests = self._digests
+        ident = id(indices)
+        entry = digests.get(ident)
+        if (entry is not None and entry[0]() is indices
+                and entry[1] == indices._version
+                and entry[2] == indices.data_ptr()):
+            return entry[3]
+        digest = self.hash_indices_content(indices)
+
+        def _remove(ref: weakref.ref):
+            cur = digests.get(ident)
+            if cur is not None and cur[0] is ref:
+                digests.pop(ident, None)
+
+        digests[ident] = (weakref.ref(indices, _remove), indices._version,
+                          indices.data_ptr(), digest)
+        return digest
+
+    def get_key(self, indices: torch.Tensor, batch_size: int,
+                spatial_shape: List[int], algo: ConvAlgo, ksize: List[int],
+                stride: List[int], padding: List[int], dilation: List[int],
+                out_padding: List[int], subm: bool, transposed: bool,
+                is_train: bool = True) -> tuple:
+        return (self.hash_indices(indices), tuple(indices.shape),
+                str(indices.device), batch_size, tuple(spatial_shape),
+                algo.value, tuple(ksize), tuple(stride), tuple(padding),
+                tuple(dilation), tuple(out_padding), subm, transposed,
+                is_train)
+
+    def add_pending(self, future: Future):
+        """register a background job that puts maps to this cache."""
+        with self._lock:
+            self._pending.append(future)
+
+    def _wait_pending(self) -> bool:
+        """wait until one pending job finishes, return False if no job
+        is pending. exceptions of background jobs are raised here.
+        """
+        with self._lock:
+            done = [f for f in self._pending if f.done()]
+            self._pending = [f for f in self._pending if not f.done()]
+            pending = self._pending.copy()
+        for f in done:
+            f.result()
+        if not pending:
+            return False
+        wait(pending, return_when=FIRST_COMPLETED)
+        return True
+
+    def get(self,
+            key: tuple,
+            wait_pending: bool = True
+            ) -> Optional[Union[IndiceData, ImplicitGemmIndiceData]]:
+        while True:
+            with self._lock:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return self._entries[key][0]
+            if not wait_pending or not self._wait_pending():
+                break
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: tuple, data: Union[IndiceData, ImplicitGemmIndiceData]):
+        nbytes = _indice_data_nbytes(data)
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key)[1]
+            if nbytes > self.max_bytes:
+                return
+            self._entries[key] = (data, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, (_, nbytes_evict) = self._entries.popitem(last=False)
+                self.nbytes -= nbytes_evict
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+
+class CPUArenaAllocator:
+    """caching allocator of cpu temporary memory (workspaces, hash tables,
+    gather/scatter buffers). sizes are rounded up to size classes (4 per
+    power of two) and freed blocks are kept in free lists keyed by
+    (dtype, block nbytes), so after first frame all temporary memory of
+    a network comes from free lists. assign it to
+    SparseConvTensor.cpu_arena to enable it, it's shared by all tensors
+    derived from that tensor.
+
+    layer outputs are regular torch tensors, arena only serves memory
+    freed before the op that requested it returns.
+    the arena is thread safe.
+    """
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        # bytes of all blocks owned by arena, in use or free
+        self.nbytes_reserved = 0
+        # block bytes in use, and requested bytes of blocks in use
+        self.nbytes_in_use = 0
+        self.nbytes_requested = 0
+        self.peak_nbytes_in_use = 0
+        self.peak_nbytes_requested = 0
+        self._free_blocks: Dict[Tuple[torch.dtype, int],
+                                List[torch.Tensor]] = {}
+        # data_ptr -> (block, requested nbytes)
+        self._in_use: Dict[int, Tuple[torch.Tensor, int]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def size_class(nbytes: int) -> int:
+        if nbytes <= 256:
+            return 256
+        step = 1 << ((nbytes - 1).bit_length() - 3)
+        return (nbytes + step - 1) // step * step
+
+    def empty(self, shape: Union[List[int], Tuple[int, ...]],
+              dtype: torch.dtype) -> torch.Tensor:
+        numel = int(np.prod(shape))
+        itemsize = _dtype_itemsize(dtype)
+        nbytes = numel * itemsize
+        key = (dtype, self.size_class(nbytes))
+        with self._lock:
+            blocks = self._free_blocks.get(key)
+            block = blocks.pop() if blocks else None
+            if block is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+                self.nbytes_reserved += key[1]
+        if block is None:
+            block = torch.empty([key[1] // itemsize], dtype=dtype)
+        with self._lock:
+            self._in_use[block.data_ptr()] = (block, nbytes)
+            self.nbytes_in_use += key[1]
+            self.nbytes_requested += nbytes
+            self.peak_nbytes_in_use = max(self.peak_nbytes_in_use,
+                                          self.nbytes_in_use)
+            self.peak_nbytes_requested = max(self.peak_nbytes_requested,
+                                             self.nbytes_requested)
+        return block[:numel].view(shape)
+
+    def zeros(self, shape: Union[List[int], Tuple[int, ...]],
+              dtype: torch.dtype) -> torch.Tensor:
+        return self.empty(shape, dtype).zero_()
+
+    def alloc(self, name: str, shape: Union[List[int], Tuple[int, ...]],
+              dtype: torch.dtype,
+              is_temp_memory: bool) -> Optional[torch.Tensor]:
+        """allocation hook of TorchAllocator and cpu ops, return None if
+        memory should be allocated by torch. named non-temp memory
+        (outputs, kernel maps) outlives ops, so it isn't served here.
+        """
+        if not is_temp_memory:
+            return None
+        return self.empty(shape, dtype)
+
+    def free(self, ten: torch.Tensor) -> bool:
+        """return memory of a tensor created by this arena, return False
+        if ten isn't owned by this arena.
+        """
+        with self._lock:
+            item = self._in_use.pop(ten.data_ptr(), None)
+            if item is None:
+                return False
+            block, nbytes = item
+            block_nbytes = block.numel() * block.element_size()
+            self.nbytes_in_use -= block_nbytes
+            self.nbytes_requested -= nbytes
+            key = (block.dtype, block_nbytes)
+            self._free_blocks.setdefault(key, []).append(block)
+        return True
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    @property
+    def fragmentation(self) -> float:
+        """fraction of reserved memory never requested at once, caused by
+        size class rounding and by free blocks of unused size classes.
+        """
+        if self.nbytes_reserved == 0:
+            return 0.0
+        return 1.0 - self.peak_nbytes_requested / self.nbytes_reserved
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hit_rate,
+                "nbytes_reserved": self.nbytes_reserved,
+                "nbytes_in_use": self.nbytes_in_use,
+                "peak_nbytes_in_use": self.peak_nbytes_in_use,
+                "peak_nbytes_requested": self.peak_nbytes_requested,
+                "fragmentation": self.fragmentation,
+            }
+
+    def clear(self):
+        """release free blocks and reset stats. blocks in use stay valid."""
+        with self._lock:
+            self._free_blocks.clear()
+            self.nbytes_reserved = self.nbytes_in_use
+            self.peak_nbytes_in_use = self.nbytes_in_use
+            self.peak_nbytes_requested = self.nbytes_requested
+            self.hits = 0
+            self.misses = 0
+
+
+STATIC_ARENA_ALIGN = 64
+# name of temporary memory slot of a layer in StaticCPUArena
+STATIC_ARENA_WORKSPACE = "Workspace"
+
+
+def _align_up(nbytes: int, align: int = STATIC_ARENA_ALIGN) -> int:
+    return (nbytes + align - 1) // align * align
+
+
+class StaticLayerArena:
+    """memory of one layer in a StaticCPUArena. named memory (output
+    features, indices and kernel maps, see AllocKeys) is a view of a fixed
+    slot, temporary memory is taken from a stack in layer workspace slot.
+    a request larger than its slot raises ValueError. named memory without
+    a slot is left to torch and counted in num_unplanned.
+    """
+    def __init__(self, buffer: torch.Tensor, slots: Dict[str, Tuple[int,
+                                                                    int]],
+                 name: str):
+        self.name = name
+        # name -> (offset, nbytes) in buffer
+        self.slots = slots
+        self._buffer = buffer
+        # (data_ptr, end) of temporary memory in use, end is relative to
+        # workspace slot.
+        self._stack: List[Tuple[int, int]] = []
+        self.num_unplanned = 0
+
+    def _view(self, offset: int, nbytes: int, shape: Union[List[int],
+                                                           Tuple[int, ...]],
+              dtype: torch.dtype, what: str) -> torch.Tensor:
+        req_nbytes = int(np.prod(shape)) * _dtype_itemsize(dtype)
+        if req_nbytes > nbytes:
+            raise ValueError(
+                f"{what} of layer {self.name} needs {req_nbytes} bytes but "
+                f"only {nbytes} are planned, voxel count exceeds planned "
+                "maximum. plan again with larger voxel counts.")
+        return self._buffer[offset:offset + req_nbytes].view(dtype).view(
+            shape)
+
+    def alloc(self, name: str, shape: Union[List[int], Tuple[int, ...]],
+              dtype: torch.dtype,
+              is_temp_memory: bool) -> Optional[torch.Tensor]:
+        if name in self.slots:
+            offset, nbytes = self.slots[name]
+            return self._view(offset, nbytes, shape, dtype, name)
+        if is_temp_memory:
+            return self.empty(shape, dtype)
+        self.num_unplanned += 1
+        return None
+
+    def empty(self, shape: Union[List[int], Tuple[int, ...]],
+              dtype: torch.dtype) -> torch.Tensor:
+        offset, nbytes = self.slots[STATIC_ARENA_WORKSPACE]
+        start = _align_up(self._stack[-1][1]) if self._stack else 0
+        ten = self._view(offset + start, max(nbytes - start, 0), shape, dtype,
+                         STATIC_ARENA_WORKSPACE)
+        # every block takes at least one byte, so data_ptr is unique.
+        end = start + max(ten.numel() * ten.element_size(), 1)
+        self._stack.append((ten.data_ptr(), end))
+        return ten
+
+    def zeros(self, shape: Union[List[int], Tuple[int, ...]],
+              dtype: torch.dtype) -> torch.Tensor:
+        return self.empty(shape, dtype).zero_()
+
+    def free(self, ten: torch.Tensor) -> bool:
+        ptr = ten.data_ptr()
+        for i, (ptr_cur, _) in enumerate(self._stack):
+            if ptr_cur == ptr:
+                del self._stack[i]
+                return True
+        return False
+
+
+class StaticCPUArena:
+    """one preallocated cpu buffer shared by all planned layers of a
+    network, layers get their memory by layer(module). created by
+    spconv.pytorch.plan_static_memory, serves one forward at a time.
+    """
+    def __init__(self, nbytes: int,
+                 layer_slots: Dict[Any, Tuple[str, Dict[str, Tuple[int,
+                                                                   int]]]]):
+        self.nbytes = nbytes
+        self.buffer = torch.empty([nbytes], dtype=torch.uint8)
+        self._layers = {
+            mod: StaticLayerArena(self.buffer, slots, name)
+            for mod, (name, slots) in layer_slots.items()
+        }
+
+    def layer(self, module: Any) -> Optional[StaticLayerArena]:
+        """arena of a planned layer, None if module isn't planned."""
+        return self._layers.get(module)
+
+
+_DTYPE_ITEMSIZE: Dict[torch.dtype, int] = {}
+
+
+def _dtype_itemsize(dtype: torch.dtype) -> int:
+    if dtype not in _DTYPE_ITEMSIZE:
+        _DTYPE_ITEMSIZE[dtype] = torch.empty([0], dtype=dtype).element_size()
+    return _DTYPE_ITEMSIZE[dtype]
+
+
 def scatter_nd(indices, updates, shape):
     """pytorch edition of tensorflow scatter_nd.
     this function don't contain except handle code. so use this carefully
@@ -141,7 +559,10 @@ class SparseConvTensor(metaclass=SpConvTensorMeta):
                  benchmark: bool = False,
                  permanent_thrust_allocator: bool = False,
                  enable_timer: bool = False,
-                 force_algo: Optional[ConvAlgo] = None):
+                 force_algo: Optional[ConvAlgo] = None,
+                 kernel_map_cache: Optional[KernelMapCache] = None,
+                 cpu_arena: Optional[Union[CPUArenaAllocator,
+                                           StaticCPUArena]] = None):
         """
         Args:
             features: [num_points, num_features] feature tensor
@@ -154,6 +575,11 @@ class SparseConvTensor(metaclass=SpConvTensorMeta):
                 SparseConvTensor.
             enable_timer: if exists, all spconv internal ops run time will be record in _timer.
             force_algo: force conv/pool layers use this algo, should only used for debug.
+            kernel_map_cache: if exists, conv/pool layers reuse kernel maps of
+                identical indices from it, see KernelMapCache.
+            cpu_arena: if exists, cpu conv layers take temporary memory
+                from it, see CPUArenaAllocator. a StaticCPUArena also serves
+                outputs and kernel maps of planned layers.
         """
         ndim = indices.shape[1] - 1
         if not SPCONV_FX_TRACE_MODE:
@@ -182,6 +608,8 @@ class SparseConvTensor(metaclass=SpConvTensorMeta):
         self._timer = CUDAKernelTimer(enable_timer)
         self.force_algo = force_algo
         self.int8_scale: Optional[np.ndarray] = None
+        self.kernel_map_cache = kernel_map_cache
+        self.cpu_arena = cpu_arena
 
     def __repr__(self):
         return f"SparseConvTensor[shape={self._features.shape}]"
@@ -209,6 +637,8 @@ class SparseConvTensor(metaclass=SpConvTensorMeta):
         new_spt._timer = self._timer
         new_spt.force_algo = self.force_algo
         new_spt.int8_scale = self.int8_scale
+        new_spt.kernel_map_cache = self.kernel_map_cache
+        new_spt.cpu_arena = self.cpu_arena
 
         return new_spt
     
@@ -220,6 +650,25 @@ class SparseConvTensor(metaclass=SpConvTensorMeta):
         new_spt.indice_dict.clear()
         return new_spt
 
+    def reorder(self, curve: str = "morton"):
+        """sort voxels along a space-filling curve ("morton" or "hilbert"),
+        so neighbor voxels are close in memory, which improves cache usage of
+        gather/scatter in cpu indice conv. pairs of subm conv follow input
+        order, so they are generated in curve order too.
+        Returns:
+            reordered tensor and permutation perm:
+            reordered.features == self.features[perm]. subm output features
+            can be mapped back to original order by out.features[perm_inv]
+            where perm_inv[perm] = arange(N).
+        """
+        perm = space_filling_curve_argsort(self.indices, self.spatial_shape,
+                                           curve)
+        new_spt = self.replace_feature(self.features[perm])
+        new_spt.indices = self.indices[perm]
+        # reuse data belongs to original order.
+        new_spt.indice_dict = {}
+        return new_spt, perm
+
     def minus(self):
         return self.replace_feature(-self.features)
 
@@ -316,6 +765,8 @@ class SparseConvTensor(metaclass=SpConvTensorMeta):
         tensor._timer = self._timer
         tensor.force_algo = self.force_algo
         tensor.int8_scale = self.int8_scale
+        tensor.kernel_map_cache = self.kernel_map_cache
+        tensor.cpu_arena = self.cpu_arena
         return tensor
 
 def expand_nd(ndim: int, val: Union[int, List[int], Tuple[int, ...], np.ndarray]) -> List[int]:
@@ -14,7 +14,7 @@
 
 from cumm import tensorview as tv
 import torch
-from typing import Dict, Optional, List, Union
+from typing import Any, Dict, Optional, List, Union
 from spconv.constants import AllocKeys
 from spconv.cppconstants import COMPILED_CUDA_ARCHS
 import sys
@@ -23,7 +23,6 @@ from spconv.core_cc.csrc.sparse.convops import ExternalSpconvMatmul
 from spconv.core_cc.cumm.common import CompileInfo
 import warnings
 
-import numpy as np
 
 _TORCH_DTYPE_TO_TV = {
     torch.float32: tv.float32,
@@ -95,6 +94,33 @@ def torch_tensors_to_tv(*tens: torch.Tensor):
     return (torch_tensor_to_tv(t) for t in tens)
 
 
+_CPU_MM_SUPPORTED: Dict[torch.dtype, bool] = {}
+
+
+def torch_mm(a: torch.Tensor,
+             b: torch.Tensor,
+             out: Optional[torch.Tensor] = None):
+    """torch.mm, cpu fp16/bf16 mm of pytorch accumulates in fp32. old
+    pytorch don't support cpu half mm, compute it in fp32 then.
+    """
+    dtype = a.dtype
+    if a.is_cuda or dtype not in (torch.float16, torch.bfloat16):
+        return torch.mm(a, b, out=out)
+    if dtype not in _CPU_MM_SUPPORTED:
+        try:
+            x = torch.zeros([1, 1], dtype=dtype)
+            torch.mm(x, x)
+            _CPU_MM_SUPPORTED[dtype] = True
+        except RuntimeError:
+            _CPU_MM_SUPPORTED[dtype] = False
+    if _CPU_MM_SUPPORTED[dtype]:
+        return torch.mm(a, b, out=out)
+    res = torch.mm(a.float(), b.float()).to(dtype)
+    if out is None:
+        return res
+    return out.copy_(res)
+
+
 def get_current_stream():
     return torch.cuda.current_stream().cuda_stream
 
@@ -111,16 +137,30 @@ def get_arch():
 
 class TorchAllocator(ExternalAllocator):
 
-    def __init__(self, gpudevice: torch.device, is_quantized: bool = False) -> None:
+    def __init__(self, gpudevice: torch.device, is_quantized: bool = False,
+                 arena: Optional[Any] = None) -> None:
+        """
+        Args:
+            arena: spconv.pytorch.core.CPUArenaAllocator (or a layer of
+                StaticCPUArena), cpu memory is taken from its alloc if it
+                returns a tensor and returned to it when freed.
+        """
         super().__init__()
         self.gpudevice = gpudevice
         self.cpudevice = torch.device("cpu")
         self.allocated: Dict[Union[str, int], torch.Tensor] = {}
         self.is_quantized = is_quantized
+        self.arena = arena
         self._tv_dtype_to_torch = _TV_DTYPE_TO_TORCH
         if is_quantized:
             self._tv_dtype_to_torch = _TV_DTYPE_TO_TORCHQ
 
+    def _arena_alloc(self, name: str, shape: List[int], th_dtype: torch.dtype,
+                     device: int,
+                     is_temp_memory: bool) -> Optional[torch.Tensor]:
+        if self.arena is None or device != -1 or self.is_quantized:
+            return None
+        return self.arena.alloc(name, shape, th_dtype, is_temp_memory)
 
     def zeros(self, name: str, shape: List[int], dtype: int,
               device: int, stream: int = 0, is_temp_memory: bool = False, scale: float = 1.0) -> tv.Tensor:
@@ -135,7 +175,10 @@ class TorchAllocator(ExternalAllocator):
         if self.is_quantized:
             ten = torch._empty_affine_quantized(shape, scale=scale, zero_point=0, dtype=th_dtype, device=dev)
         else:
-            ten = torch.empty(shape, dtype=th_dtype, device=dev).zero_()
+            ten = self._arena_alloc(name, shape, th_dtype, device, is_temp_memory)
+            if ten is None:
+                ten = torch.empty(shape, dtype=th_dtype, device=dev)
+            ten.zero_()
         ten_tv = torch_tensor_to_tv(ten, dtype_bkp)
         if self.is_quantized:
             # no _zeros_affine_quantized available, so we need to zero_ here.
@@ -158,7 +201,9 @@ class TorchAllocator(ExternalAllocator):
         if self.is_quantized:
             ten = torch._empty_affine_quantized(shape, scale=scale, zero_point=0, dtype=th_dtype, device=dev)
         else:
-            ten = torch.empty(shape, dtype=th_dtype, device=dev)
+            ten = self._arena_alloc(name, shape, th_dtype, device, is_temp_memory)
+            if ten is None:
+                ten = torch.empty(shape, dtype=th_dtype, device=dev)
         ten_tv = torch_tensor_to_tv(ten, dtype_bkp)
         self.allocated[ten_tv.byte_pointer()] = ten
         if name and not is_temp_memory:
@@ -177,7 +222,11 @@ class TorchAllocator(ExternalAllocator):
             dev = self.gpudevice
         if self.is_quantized:
             assert th_dtype not in _TH_QTYPES
-        ten = torch.full(shape, value, dtype=th_dtype, device=dev)
+        ten = self._arena_alloc(name, shape, th_dtype, device, is_temp_memory)
+        if ten is None:
+            ten = torch.full(shape, value, dtype=th_dtype, device=dev)
+        else:
+            ten.fill_(value)
         ten_tv = torch_tensor_to_tv(ten, dtype_bkp)
         self.allocated[ten_tv.byte_pointer()] = ten
         if name and not is_temp_memory:
@@ -196,7 +245,11 @@ class TorchAllocator(ExternalAllocator):
             dev = self.gpudevice
         if self.is_quantized:
             assert th_dtype not in _TH_QTYPES
-        ten = torch.full(shape, value, dtype=th_dtype, device=dev)
+        ten = self._arena_alloc(name, shape, th_dtype, device, is_temp_memory)
+        if ten is None:
+            ten = torch.full(shape, value, dtype=th_dtype, device=dev)
+        else:
+            ten.fill_(value)
         ten_tv = torch_tensor_to_tv(ten, dtype_bkp)
         self.allocated[ten_tv.byte_pointer()] = ten
         if name and not is_temp_memory:
@@ -210,7 +263,9 @@ class TorchAllocator(ExternalAllocator):
         if ten.storage_bytesize() != ten.bytesize():
             raise ValueError("you can't free a sliced tensor.")
         if ten.byte_pointer() in self.allocated:
-            self.allocated.pop(ten.byte_pointer())
+            ten_th = self.allocated.pop(ten.byte_pointer())
+            if self.arena is not None:
+                self.arena.free(ten_th)
             return
         raise ValueError("can't find your tensor in cache.")
 
@@ -219,7 +274,9 @@ class TorchAllocator(ExternalAllocator):
         if ten.storage_bytesize() != ten.bytesize():
             return
         if ten.byte_pointer() in self.allocated:
-            self.allocated.pop(ten.byte_pointer())
+            ten_th = self.allocated.pop(ten.byte_pointer())
+            if self.arena is not None:
+                self.arena.free(ten_th)
             return
 
 
@@ -237,25 +294,12 @@ class TorchSpconvMatmul(ExternalSpconvMatmul):
         if not all_weight_is_krsc:
             filters = filters.reshape(-1, *filters.shape[-2:])
             if not is_kc_not_ck:
-                out_features = torch.mm(features, filters[kv_center])
+                out_features = torch_mm(features, filters[kv_center])
             else:
-                out_features = torch.mm(features, filters[kv_center].T)
+                out_features = torch_mm(features, filters[kv_center].T)
         else:
             filters = filters.reshape(out_channel, -1, filters.shape[-1])
-            if features.is_cuda or (features.dtype != torch.float16):
-                out_features = torch.mm(features, filters[:, kv_center].T)
-            else:
-                # pytorch 1.12 don't support cpu half mm, f**k pytorch
-                # we need cpu fp16 mm for test only.
-                out_features = torch.empty((features.shape[0], out_channel),
-                                           dtype=features.dtype,
-                                           device=features.device)
-                features_np = torch_tensor_to_tv(features).numpy_view()
-                filters_np = torch_tensor_to_tv(filters).numpy_view()
-                out_features_np = torch_tensor_to_tv(out_features).numpy_view()
-                np.matmul(features_np,
-                          filters_np[:, kv_center].T,
-                          out=out_features_np)
+            out_features = torch_mm(features, filters[:, kv_center].T)
         self.alloc.allocated[AllocKeys.OutFeatures] = out_features
         # print(filters.shape, features.shape, all_weight_is_krsc, out_features.shape, out_features.is_contiguous())
 
@@ -274,18 +318,7 @@ class TorchSpconvMatmul(ExternalSpconvMatmul):
         out_buffer = self.alloc.allocated[out_buffer_n]
         filters_i = filters.select(kv_dim, index)
         filters_cur = filters_i if not is_kc_not_ck else filters_i.T
-        if inp_buffer.dtype == torch.float16:
-            inp_buffer_np = torch_tensor_to_tv(inp_buffer).numpy_view()
-            filters_np = torch_tensor_to_tv(filters).numpy_view()
-            filters_i_np = filters_np[
-                index] if not all_weight_is_krsc else filters_np[:, index]
-            filters_cur_np = filters_i_np if not is_kc_not_ck else filters_i_np.T
-            out_buffer_np = torch_tensor_to_tv(out_buffer).numpy_view()
-            np.matmul(inp_buffer_np[:nhot],
-                      filters_cur_np,
-                      out=out_buffer_np[:nhot])
-        else:
-            torch.mm(inp_buffer[:nhot], filters_cur, out=out_buffer[:nhot])
+        torch_mm(inp_buffer[:nhot], filters_cur, out=out_buffer[:nhot])
 
     def indice_conv_bwd_init_gemm(self, features_n: str, filters_n: str,
                                   out_bp_n: str, dfilters_n: str,
@@ -305,16 +338,16 @@ class TorchSpconvMatmul(ExternalSpconvMatmul):
 
         if not all_weight_is_krsc:
             if not is_kc_not_ck:
-                torch.mm(features.T, out_bp, out=dfilters[kv_center])
-                din = torch.mm(out_bp, filters[kv_center].T)
+                torch_mm(features.T, out_bp, out=dfilters[kv_center])
+                din = torch_mm(out_bp, filters[kv_center].T)
             else:
-                torch.mm(out_bp.T, features, out=dfilters[kv_center])
-                din = torch.mm(out_bp, filters[kv_center])
+                torch_mm(out_bp.T, features, out=dfilters[kv_center])
+                din = torch_mm(out_bp, filters[kv_center])
         else:
             # KN @ NC
-            torch.mm(out_bp.T, features, out=dfilters[:, kv_center])
+            torch_mm(out_bp.T, features, out=dfilters[:, kv_center])
             # NK @ KC
-            din = torch.mm(out_bp, filters[:, kv_center])
+            din = torch_mm(out_bp, filters[:, kv_center])
         self.alloc.allocated[AllocKeys.DIn] = din
         return torch_tensor_to_tv(din)
 
@@ -340,12 +373,12 @@ class TorchSpconvMatmul(ExternalSpconvMatmul):
         filters_KC = filters_i if is_kc_not_ck else filters_i.T
         if is_kc_not_ck:
             # KN @ NC
-            torch.mm(out_buffer[:nhot].T, inp_buffer[:nhot], out=dfilters_i)
+            torch_mm(out_buffer[:nhot].T, inp_buffer[:nhot], out=dfilters_i)
         else:
             # CN @ NK
-            torch.mm(inp_buffer[:nhot].T, out_buffer[:nhot], out=dfilters_i)
+            torch_mm(inp_buffer[:nhot].T, out_buffer[:nhot], out=dfilters_i)
         # NK @ KC
-        torch.mm(out_buffer[:nhot], filters_KC, out=inp_buffer[:nhot])
+        torch_mm(out_buffer[:nhot], filters_KC, out=inp_buffer[:nhot])
 
 if __name__ == "__main__":
     a = torch.rand(2, 2)
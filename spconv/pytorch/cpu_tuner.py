@@ -0,0 +1,156 @@
+# Copyright 2021 Yan Yan
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""cpu native conv autotuner.
+
+layers are keyed by a signature (channels, kv, bucket of pair count and
+pairs per output, dtype, subm, threads). first layer of a signature times
+every native conv kernel and keeps the fastest one in memory and in a json
+file (SPCONV_CPU_TUNE_CACHE_PATH), so tuning runs once per host. layers with
+dense fallback enabled also time dense against sparse conv, keyed by input
+occupancy.
+"""
+
+import json
+import os
+import time
+from pathlib import Path
+from threading import Lock
+from typing import Callable, Dict, List, Optional
+
+import torch
+
+from spconv import constants
+from spconv.core import CPUConvStrategy
+
+_CACHE_VERSION = 1
+
+# kernels of native conv, Dense and Sparse are only timed per layer.
+_NATIVE_STRATEGIES = [
+    CPUConvStrategy.Unfused, CPUConvStrategy.Fused, CPUConvStrategy.Grouped,
+    CPUConvStrategy.OutputStationary
+]
+
+
+class CPUConvTuner:
+    def __init__(self, cache_path: str = "", repeats: int = 2):
+        self.cache_path = cache_path
+        self.repeats = repeats
+        self.lock = Lock()
+        self._results: Optional[Dict[str, CPUConvStrategy]] = None
+
+    @staticmethod
+    def get_key(in_channel: int, out_channel: int, kv: int,
+                indice_pair_num_cpu: List[int], num_out: int,
+                dtype: torch.dtype, subm: bool) -> str:
+        total = sum(indice_pair_num_cpu)
+        # log2 buckets, so frames of a stream with similar density share key.
+        total_bucket = int(total).bit_length()
+        density_bucket = int(total // max(num_out, 1)).bit_length()
+        dtype_str = str(dtype).split(".")[-1]
+        return (f"{in_channel},{out_channel},{kv},{total_bucket},"
+                f"{density_bucket},{dtype_str},{int(subm)},"
+                f"{torch.get_num_threads()}")
+
+    @staticmethod
+    def get_dense_key(in_channel: int, out_channel: int, ksize: List[int],
+                      stride: List[int], num_voxels: int, num_sites: int,
+                      dtype: torch.dtype, subm: bool) -> str:
+        """key of dense fallback choice, known before pairs are generated."""
+        voxel_bucket = int(num_voxels).bit_length()
+        # log2 of inverse occupancy
+        occupancy_bucket = int(num_sites // max(num_voxels, 1)).bit_length()
+        dtype_str = str(dtype).split(".")[-1]
+        ksize_str = "x".join(map(str, ksize))
+        stride_str = "x".join(map(str, stride))
+        return (f"dense,{in_channel},{out_channel},{ksize_str},{stride_str},"
+                f"{voxel_bucket},{occupancy_bucket},{dtype_str},{int(subm)},"
+                f"{torch.get_num_threads()}")
+
+    def _read_file(self) -> Dict[str, CPUConvStrategy]:
+        res: Dict[str, CPUConvStrategy] = {}
+        if not self.cache_path or not Path(self.cache_path).exists():
+            return res
+        try:
+            with open(self.cache_path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return res
+        if data.get("version") != _CACHE_VERSION:
+            return res
+        for k, v in data.get("results", {}).items():
+            if v in CPUConvStrategy.__members__:
+                res[k] = CPUConvStrategy[v]
+        return res
+
+    def _write_file(self):
+        if not self.cache_path:
+            return
+        assert self._results is not None
+        # merge results of other processes written since load.
+        results = self._read_file()
+        results.update(self._results)
+        data = {
+            "version": _CACHE_VERSION,
+            "results": {k: v.name for k, v in results.items()}
+        }
+        path = Path(self.cache_path)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp_path, "w") as f:
+                json.dump(data, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, path)
+        except OSError:
+            # read-only home etc., results are still cached in memory.
+            pass
+
+    def get_tuned_strategy(self, key: str) -> Optional[CPUConvStrategy]:
+        with self.lock:
+            if self._results is None:
+                self._results = self._read_file()
+            return self._results.get(key)
+
+    def tune_and_cache(
+        self,
+        key: str,
+        run: Callable[[CPUConvStrategy], None],
+        strategies: Optional[List[CPUConvStrategy]] = None
+    ) -> CPUConvStrategy:
+        """time run(strategy) for all strategies (kernels of native conv by
+        default), cache and return the fastest one.
+        """
+        if strategies is None:
+            strategies = _NATIVE_STRATEGIES
+        times: Dict[CPUConvStrategy, float] = {}
+        for strategy in strategies:
+            for _ in range(self.repeats):
+                t = time.perf_counter()
+                run(strategy)
+                interval = time.perf_counter() - t
+                times[strategy] = min(times.get(strategy, interval), interval)
+        best = min(strategies, key=lambda s: times[s])
+        with self.lock:
+            if self._results is None:
+                self._results = self._read_file()
+            self._results[key] = best
+            self._write_file()
+        return best
+
+    def clear(self):
+        """clear results in memory, file isn't changed."""
+        with self.lock:
+            self._results = {}
+
+
+CPU_TUNER = CPUConvTuner(constants.SPCONV_CPU_TUNE_CACHE_PATH)
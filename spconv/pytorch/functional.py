@@ -19,7 +19,7 @@ import torch
 from torch import nn
 from torch.autograd import Function
 from typing import Optional, TypeVar
-from spconv.pytorch.core import SparseConvTensor
+from spconv.pytorch.core import CPUArenaAllocator, SparseConvTensor
 from spconv.tools import CUDAKernelTimer
 from spconv.pytorch import ops, SparseConvTensor
 from spconv.pytorch.constants import PYTORCH_VERSION
@@ -66,10 +66,15 @@ class SparseConvFunction(Function):
                 bias: Optional[torch.Tensor] = None,
                 act_alpha: float = 0.0,
                 act_beta: float = 0.0,
-                act_type: tv.gemm.Activation = tv.gemm.Activation.None_):
+                act_type: tv.gemm.Activation = tv.gemm.Activation.None_,
+                output_add: Optional[torch.Tensor] = None,
+                filters_packed: Optional[torch.Tensor] = None,
+                arena: Optional[CPUArenaAllocator] = None,
+                subm_half: bool = False):
         ctx.save_for_backward(indice_pairs, indice_pair_num, features, filters)
         ctx.algo = algo
         ctx.timer = timer
+        ctx.subm_half = subm_half
         try:
             return ops.indice_conv(features,
                                    filters,
@@ -82,7 +87,11 @@ class SparseConvFunction(Function):
                                    bias=bias,
                                    act_alpha=act_alpha,
                                    act_beta=act_beta,
-                                   act_type=act_type)
+                                   act_type=act_type,
+                                   output_add=output_add,
+                                   filters_packed=filters_packed,
+                                   arena=arena,
+                                   subm_half=subm_half)
         except Exception as e:
             msg = "[Exception|indice_conv]"
             msg += f"feat={features.shape},w={filters.shape},pair={indice_pairs.shape},"
@@ -105,7 +114,8 @@ class SparseConvFunction(Function):
                                                             indice_pair_num,
                                                             False,
                                                             algo=ctx.algo,
-                                                            timer=timer)
+                                                            timer=timer,
+                                                            subm_half=ctx.subm_half)
         except Exception as e:
             msg = "[Exception|indice_conv_backward]"
             msg += f"feat={features.shape},w={filters.shape},pair={indice_pairs.shape},"
@@ -114,7 +124,7 @@ class SparseConvFunction(Function):
             spconv_save_debug_data((indice_pairs, indice_pair_num))
             raise e
 
-        return input_bp, filters_bp, None, None, None, None, None, None, None, None, None
+        return input_bp, filters_bp, None, None, None, None, None, None, None, None, None, None, None, None, None
 
 
 class SparseInverseConvFunction(Function):
@@ -131,10 +141,15 @@ class SparseInverseConvFunction(Function):
                 bias: Optional[torch.Tensor] = None,
                 act_alpha: float = 0.0,
                 act_beta: float = 0.0,
-                act_type: tv.gemm.Activation = tv.gemm.Activation.None_):
+                act_type: tv.gemm.Activation = tv.gemm.Activation.None_,
+                output_add: Optional[torch.Tensor] = None,
+                filters_packed: Optional[torch.Tensor] = None,
+                arena: Optional[CPUArenaAllocator] = None,
+                subm_half: bool = False):
         ctx.save_for_backward(indice_pairs, indice_pair_num, features, filters)
         ctx.algo = algo
         ctx.timer = timer
+        ctx.subm_half = subm_half
         try:
             return ops.indice_conv(features,
                                    filters,
@@ -148,7 +163,11 @@ class SparseInverseConvFunction(Function):
                                    bias=bias,
                                    act_alpha=act_alpha,
                                    act_beta=act_beta,
-                                   act_type=act_type)
+                                   act_type=act_type,
+                                   output_add=output_add,
+                                   filters_packed=filters_packed,
+                                   arena=arena,
+                                   subm_half=subm_half)
         except Exception as e:
             msg = "[Exception|indice_conv|inverse]"
             msg += f"feat={features.shape},w={filters.shape},pair={indice_pairs.shape},"
@@ -172,7 +191,8 @@ class SparseInverseConvFunction(Function):
                                                             True,
                                                             False,
                                                             algo=ctx.algo,
-                                                            timer=timer)
+                                                            timer=timer,
+                                                            subm_half=ctx.subm_half)
         except Exception as e:
             msg = "[Exception|indice_conv_backward|inverse]"
             msg += f"feat={features.shape},w={filters.shape},pair={indice_pairs.shape},"
@@ -181,7 +201,7 @@ class SparseInverseConvFunction(Function):
             spconv_save_debug_data((indice_pairs, indice_pair_num))
             raise e
 
-        return input_bp, filters_bp, None, None, None, None, None, None, None, None, None
+        return input_bp, filters_bp, None, None, None, None, None, None, None, None, None, None, None, None, None
 
 
 class SparseImplicitGemmFunction(Function):
@@ -300,10 +320,15 @@ class SubMConvFunction(Function):
                 bias: Optional[torch.Tensor] = None,
                 act_alpha: float = 0.0,
                 act_beta: float = 0.0,
-                act_type: tv.gemm.Activation = tv.gemm.Activation.None_):
+                act_type: tv.gemm.Activation = tv.gemm.Activation.None_,
+                output_add: Optional[torch.Tensor] = None,
+                filters_packed: Optional[torch.Tensor] = None,
+                arena: Optional[CPUArenaAllocator] = None,
+                subm_half: bool = False):
         ctx.save_for_backward(indice_pairs, indice_pair_num, features, filters)
         ctx.algo = algo
         ctx.timer = timer
+        ctx.subm_half = subm_half
         try:
             return ops.indice_conv(features,
                                    filters,
@@ -317,7 +342,11 @@ class SubMConvFunction(Function):
                                    bias=bias,
                                    act_alpha=act_alpha,
                                    act_beta=act_beta,
-                                   act_type=act_type)
+                                   act_type=act_type,
+                                   output_add=output_add,
+                                   filters_packed=filters_packed,
+                                   arena=arena,
+                                   subm_half=subm_half)
         except Exception as e:
             msg = "[Exception|indice_conv|subm]"
             msg += f"feat={features.shape},w={filters.shape},pair={indice_pairs.shape},"
@@ -341,7 +370,8 @@ class SubMConvFunction(Function):
                                                             False,
                                                             True,
                                                             algo=ctx.algo,
-                                                            timer=timer)
+                                                            timer=timer,
+                                                            subm_half=ctx.subm_half)
         except Exception as e:
             msg = "[Exception|indice_conv_backward|subm]"
             msg += f"feat={features.shape},w={filters.shape},pair={indice_pairs.shape},"
@@ -350,7 +380,7 @@ class SubMConvFunction(Function):
             spconv_save_debug_data((indice_pairs, indice_pair_num))
             raise e
 
-        return input_bp, filters_bp, None, None, None, None, None, None, None, None, None
+        return input_bp, filters_bp, None, None, None, None, None, None, None, None, None, None, None, None, None
 
 
 class SparseMaxPoolFunction(Function):
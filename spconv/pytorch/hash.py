@@ -34,6 +34,8 @@ class HashTable:
     see spconv/pytorch/functional/sparse_add_hash_based, a real example
     that show how to use hash table to implement 
     sparse add (same shape, different indices)
+    methods release the GIL, so a table must not be used by
+    multiple threads at the same time.
     """
     def __init__(self, device: torch.device, key_dtype: torch.dtype, 
                 value_dtype: torch.dtype, 
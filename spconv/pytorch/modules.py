@@ -15,7 +15,8 @@
 import sys
 import time
 from collections import OrderedDict
-from typing import Union
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Optional, Union
 
 import torch
 from torch import nn
@@ -33,6 +34,17 @@ def is_sparse_conv(module):
     return isinstance(module, SparseConvolution)
 
 
+_KERNEL_MAP_EXECUTOR: Optional[ThreadPoolExecutor] = None
+
+
+def _get_kernel_map_executor() -> ThreadPoolExecutor:
+    global _KERNEL_MAP_EXECUTOR
+    if _KERNEL_MAP_EXECUTOR is None:
+        _KERNEL_MAP_EXECUTOR = ThreadPoolExecutor(
+            1, thread_name_prefix="spconv_kernel_map")
+    return _KERNEL_MAP_EXECUTOR
+
+
 def _mean_update(vals, m_vals, t):
     outputs = []
     if not isinstance(vals, list):
@@ -102,6 +114,9 @@ class SparseSequential(SparseModule):
                 raise ValueError("name exists.")
             self.add_module(name, module)
         # self._sparity_dict = {}
+        self._kernel_map_pipeline = False
+        self._kernel_map_executor: Optional[Executor] = None
+        self._kernel_map_plan = None
 
     def __getitem__(self, idx):
         if not (-len(self) <= idx < len(self)):
@@ -127,7 +142,44 @@ class SparseSequential(SparseModule):
                 raise KeyError("name exists")
         self.add_module(name, module)
 
+    def enable_kernel_map_pipeline(self,
+                                   enable: bool = True,
+                                   executor: Optional[Executor] = None):
+        """generate kernel maps of all layers on a background thread
+        (executor, a shared single thread executor by default) ahead of
+        compute for cpu inputs, see spconv.pytorch.plan_kernel_maps.
+        the plan is built in first forward, call this again after
+        modifying layers.
+        """
+        self._kernel_map_pipeline = enable
+        self._kernel_map_executor = executor
+        self._kernel_map_plan = None
+
+    def enable_dense_fallback(self,
+                              enable: bool = True,
+                              threshold: Optional[float] = None):
+        """enable dense fallback of all conv layers, see
+        SparseConvolution.enable_dense_fallback.
+        """
+        for module in self.modules():
+            if is_sparse_conv(module):
+                module.enable_dense_fallback(enable, threshold)
+
+    def _start_kernel_map_pipeline(self, input):
+        from spconv.pytorch.planner import plan_kernel_maps
+        if self._kernel_map_plan is None:
+            self._kernel_map_plan = plan_kernel_maps(self)
+        executor = self._kernel_map_executor
+        if executor is None:
+            executor = _get_kernel_map_executor()
+        return self._kernel_map_plan.generate(input, executor)
+
     def forward(self, input):
+        # models pickled by older versions don't have pipeline attributes.
+        if (getattr(self, "_kernel_map_pipeline", False)
+                and isinstance(input, spconv.SparseConvTensor)
+                and not input.indices.is_cuda):
+            input = self._start_kernel_map_pipeline(input)
         for k, module in self._modules.items():
             if is_spconv_module(module):  # use SpConvTensor as input
                 if isinstance(input, list):
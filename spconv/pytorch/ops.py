@@ -20,10 +20,11 @@ from cumm.gemm.algospec.core import ShuffleStrideType
 import torch
 import numpy as np
 import spconv
-from spconv.core import AlgoHint, ConvAlgo
+from spconv.core import AlgoHint, ConvAlgo, CPUHashType, CPUConvStrategy
 from typing import Dict, List, Optional, Union
-from spconv.pytorch.core import ThrustSortAllocator
-from spconv.pytorch.cppcore import _TORCH_DTYPE_TO_TV, TorchAllocator, torch_tensor_to_tv, get_current_stream, get_arch, TorchSpconvMatmul
+from spconv.pytorch.core import CPUArenaAllocator, ThrustSortAllocator
+from spconv.pytorch.cpu_tuner import CPU_TUNER
+from spconv.pytorch.cppcore import _TORCH_DTYPE_TO_TV, TorchAllocator, torch_tensor_to_tv, get_current_stream, get_arch, TorchSpconvMatmul, torch_mm
 from spconv.core_cc.csrc.sparse.all import SpconvOps
 from spconv.core_cc.csrc.sparse.alloc import ExternalAllocator
 from spconv.constants import SPCONV_CPP_INDICE_PAIRS, SPCONV_CPP_INDICE_PAIRS_IGEMM, SPCONV_CPP_GEMM, SPCONV_DIRECT_TABLE_HASH_SIZE_SCALE, SPCONV_ALLOW_TF32, SPCONV_DO_SORT
@@ -42,7 +43,7 @@ else:
     GEMM_CPP = None
     CONV_CPP = None
 import time
-from spconv.constants import FILTER_HWIO, ALL_WEIGHT_IS_KRSC, AllocKeys, SPCONV_USE_DIRECT_TABLE
+from spconv.constants import FILTER_HWIO, ALL_WEIGHT_IS_KRSC, AllocKeys, SPCONV_USE_DIRECT_TABLE, SPCONV_CPU_HASH_TYPE
 from cumm.gemm import codeops
 from spconv.tools import CUDAKernelTimer
 from spconv import constants
@@ -129,6 +130,109 @@ class _HashData:
                 self.hashdata_v_tv = hashdata_tv[1]
 
 
+def sort_indice_pairs(indice_pairs: torch.Tensor,
+                      indice_pair_num: torch.Tensor,
+                      subm_half: bool,
+                      key: str = "out") -> torch.Tensor:
+    """sort pairs of every kernel offset by output (key="out") or input
+    (key="in") index of native cpu pairs (dense or csr). consecutive
+    indices are gathered/scattered as one run in cpu indice conv, so sort
+    by output turns scatter-add to streaming writes.
+    """
+    assert key in ("in", "out"), "key must be in or out"
+    row = 1 if key == "out" else 0
+    if indice_pairs.ndim == 3:
+        # dense pairs, invalid pairs (-1) must stay after valid pairs.
+        sort_key = indice_pairs[row].long()
+        sort_key = torch.where(sort_key < 0, INT32_MAX, sort_key)
+        _, perm = torch.sort(sort_key, dim=1, stable=True)
+        return torch.gather(indice_pairs, 2,
+                            perm.unsqueeze(0).expand_as(indice_pairs))
+    pair_num = indice_pair_num.long()
+    kv = pair_num.shape[0]
+    if subm_half:
+        pair_num = pair_num.clone()
+        pair_num[kv // 2:] = 0
+    segment = torch.repeat_interleave(torch.arange(kv, dtype=torch.int64),
+                                      pair_num)
+    sort_key = segment * (INT32_MAX + 1) + indice_pairs[row].long()
+    _, perm = torch.sort(sort_key, stable=True)
+    return indice_pairs[:, perm]
+
+
+def subm_kernel_offset_map(ksize: List[int], dilation: List[int],
+                           ksize_src: List[int],
+                           dilation_src: List[int]) -> Optional[List[int]]:
+    """index of every kernel offset of subm conv (ksize, dilation) in kernel
+    offsets of subm conv (ksize_src, dilation_src). None if some offset
+    isn't covered by source kernel, e.g. dilation isn't a multiple of
+    source dilation.
+    """
+    res = [0]
+    for k, d, k_src, d_src in zip(ksize, dilation, ksize_src, dilation_src):
+        if k % 2 == 0 or k_src % 2 == 0 or d % d_src != 0:
+            return None
+        r, r_src = k // 2, k_src // 2
+        scale = d // d_src
+        if r * scale > r_src:
+            return None
+        dim_map = [o * scale + r_src for o in range(-r, r + 1)]
+        res = [a * k_src + b for a in res for b in dim_map]
+    return res
+
+
+def derive_subm_indice_pairs(indice_pairs: torch.Tensor,
+                             indice_pair_num: torch.Tensor,
+                             ksize_src: List[int], dilation_src: List[int],
+                             ksize: List[int], dilation: List[int],
+                             subm_half: bool = False):
+    """filter subm pairs of (ksize, dilation) out of subm pairs of a larger
+    kernel (ksize_src, dilation_src) generated from same indices, instead
+    of generating them from scratch. supports dense, csr and half csr
+    (subm_half) pairs, derived pairs keep format of source pairs.
+    """
+    offset_map = subm_kernel_offset_map(ksize, dilation, ksize_src,
+                                        dilation_src)
+    if offset_map is None:
+        raise ValueError(
+            f"subm pairs of ksize={ksize}, dilation={dilation} can't be derived "
+            f"from ksize={ksize_src}, dilation={dilation_src}")
+    offset_map_th = torch.tensor(offset_map,
+                                 dtype=torch.int64,
+                                 device=indice_pairs.device)
+    pair_num = indice_pair_num[offset_map_th.to(indice_pair_num.device)]
+    if indice_pairs.ndim == 3:
+        return indice_pairs[:, offset_map_th], pair_num
+    counts = indice_pair_num.tolist()
+    pair_offsets = _cpu_pair_offsets(indice_pairs, counts)
+    kv = len(offset_map)
+    # mirrored offsets of source are mirrored offsets of derived pairs too.
+    num_stored = kv // 2 if subm_half else kv
+    segments = []
+    for k in range(num_stored):
+        k_src = offset_map[k]
+        start = pair_offsets[k_src]
+        segments.append(indice_pairs[:, start:start + counts[k_src]])
+    if not segments:
+        return indice_pairs[:, :0].clone(), pair_num
+    return torch.cat(segments, dim=1), pair_num
+
+
+def cpu_subm_pairs_are_half(indices: torch.Tensor,
+                            subm: bool,
+                            csr: Optional[bool] = None,
+                            subm_half: Optional[bool] = None) -> bool:
+    """whether get_indice_pairs with same arguments returns half subm pairs.
+    consumers of pairs must get this flag with the pairs, pair shape isn't
+    enough to tell half pairs from full pairs.
+    """
+    if csr is None:
+        csr = constants.SPCONV_CPU_CSR_KERNEL_MAP
+    if subm_half is None:
+        subm_half = constants.SPCONV_CPU_SUBM_HALF_KERNEL_MAP
+    return bool(subm_half and csr and subm and not indices.is_cuda)
+
+
 def get_indice_pairs(indices: torch.Tensor,
                      batch_size: int,
                      spatial_shape: List[int],
@@ -140,15 +244,39 @@ def get_indice_pairs(indices: torch.Tensor,
                      out_padding: List[int],
                      subm: bool = False,
                      transpose: bool = False,
-                     num_out_act_bound: int = -1):
+                     num_out_act_bound: int = -1,
+                     cpu_hash_type: CPUHashType = CPUHashType(SPCONV_CPU_HASH_TYPE),
+                     csr: Optional[bool] = None,
+                     subm_half: Optional[bool] = None,
+                     batch_sharded: Optional[bool] = None,
+                     arena: Optional[CPUArenaAllocator] = None):
+    """if csr (default: constants.SPCONV_CPU_CSR_KERNEL_MAP), cpu pairs are
+    returned in csr format [2, total]: pairs of kernel offset k are stored in
+    [offset[k], offset[k] + indice_num_per_loc[k]), offset is exclusive
+    cumsum of indice_num_per_loc. center pairs of subm conv aren't stored.
+    if subm_half (default: constants.SPCONV_CPU_SUBM_HALF_KERNEL_MAP), only
+    offsets before center are stored for csr subm pairs, pairs of offset
+    kv - 1 - k are pairs of k with in/out swapped, see
+    cpu_subm_pairs_are_half.
+    if batch_sharded (default: constants.SPCONV_CPU_BATCH_SHARDED), cpu pairs
+    of every sample are generated in parallel with its own hash table.
+    csr is ignored for cuda indices.
+    cpu pairs and output indices are allocated by arena.alloc if exists.
+    """
     # torch.cuda.synchronize()
     # t = time.time()
     # stream = get_current_stream()
 
     # CONV.stream_synchronize(stream)
     # t = time.time()
-    if SPCONV_CPP_INDICE_PAIRS:
-        alloc = TorchAllocator(indices.device)
+    if csr is None:
+        csr = constants.SPCONV_CPU_CSR_KERNEL_MAP
+    subm_half = cpu_subm_pairs_are_half(indices, subm, csr, subm_half)
+    csr = csr and not indices.is_cuda
+    if batch_sharded is None:
+        batch_sharded = constants.SPCONV_CPU_BATCH_SHARDED
+    if SPCONV_CPP_INDICE_PAIRS or csr:
+        alloc = TorchAllocator(indices.device, arena=arena)
         stream = 0
         if indices.is_cuda:
             stream = get_current_stream()
@@ -159,13 +287,19 @@ def get_indice_pairs(indices: torch.Tensor,
                                                  algo.value, ksize, stride,
                                                  padding, dilation,
                                                  out_padding, subm, transpose,
-                                                 stream)
+                                                 stream, cpu_hash_type=cpu_hash_type.value,
+                                                 csr=csr,
+                                                 subm_half=subm_half,
+                                                 cpu_batch_sharded=batch_sharded)
         if subm:
             out_inds = indices
         else:
             out_inds = alloc.allocated[AllocKeys.OutIndices]
         pair = alloc.allocated[AllocKeys.PairFwd]
         indice_num_per_loc = alloc.allocated[AllocKeys.IndiceNumPerLoc]
+        if not indices.is_cuda and constants.SPCONV_CPU_PAIR_SORT_KEY:
+            pair = sort_indice_pairs(pair, indice_num_per_loc, subm_half,
+                                     constants.SPCONV_CPU_PAIR_SORT_KEY)
         # print(subm, out_inds.shape, pair.shape, indice_num_per_loc.shape, num_act_out)
         return out_inds[:num_act_out], pair, indice_num_per_loc
     ndim = indices.shape[1] - 1
@@ -230,7 +364,9 @@ def get_indice_pairs(indices: torch.Tensor,
                                                   batch_size=batch_size,
                                                   input_dims=spatial_shape,
                                                   ksize=ksize,
-                                                  dilation=dilation)
+                                                  dilation=dilation,
+                                                  hash_type=cpu_hash_type.value,
+                                                  batch_sharded=batch_sharded)
         # CONV.stream_synchronize(stream)
         # print("SUBM", time.time() - t)
 
@@ -319,13 +455,165 @@ def get_indice_pairs(indices: torch.Tensor,
                 stride=stride,
                 padding=padding,
                 dilation=dilation,
-                transposed=transpose)
+                transposed=transpose,
+                batch_sharded=batch_sharded)
             out_inds = out_inds[:num_act_out]
         # CONV.stream_synchronize(stream)
         # print("REGU", time.time() - t)
     return out_inds, pair, indice_num_per_loc
 
 
+def _cpu_implicit_gemm_masks(algo: ConvAlgo, kv: int):
+    if algo == ConvAlgo.MaskSplitImplicitGemm:
+        assert div_up(kv, 32) == 1, "Not Implemented"
+        kv_div_2 = kv // 2
+        remain = kv - kv_div_2
+        mask_np_1 = np.array([1], dtype=np.uint64)
+        first = ((mask_np_1 << (remain)) - 1)
+        second = ((mask_np_1 << (kv_div_2)) - 1) << remain
+        return [first.astype(np.uint32), second.astype(np.uint32)]
+    return [np.array([0xffffffff], dtype=np.uint32)]
+
+
+def _cpu_pair_mask(pair: torch.Tensor):
+    """pair: [kv, N] -> uint32 bit masks stored in int32 tensor [N, mask_int_count].
+    bit k of a row is set if pair[k, row] is valid.
+    """
+    kv = pair.shape[0]
+    mask_int_count = div_up(kv, 32)
+    valid = (pair >= 0).to(torch.int64)
+    mask = torch.empty((pair.shape[1], mask_int_count), dtype=torch.int64)
+    for c in range(mask_int_count):
+        valid_c = valid[c * 32:(c + 1) * 32]
+        shifts = torch.arange(valid_c.shape[0], dtype=torch.int64)
+        mask[:, c] = (valid_c << shifts[:, None]).sum(0)
+    # reinterpret uint32 as int32
+    mask = torch.where(mask >= (1 << 31), mask - (1 << 32), mask)
+    return mask.to(torch.int32)
+
+
+def _cpu_mask_argsort(mask: torch.Tensor, mask_filter: Optional[int],
+                      do_sort: bool):
+    """stable argsort of rows by (uint32) mask words, first word is most
+    significant. mask_filter is applied to first word if provided.
+    """
+    if not do_sort:
+        return torch.arange(mask.shape[0], dtype=torch.int32)
+    mask_u = mask.to(torch.int64) & 0xffffffff
+    if mask_filter is not None:
+        mask_u[:, 0] &= mask_filter
+    argsort = torch.arange(mask.shape[0], dtype=torch.int64)
+    for c in range(mask.shape[1] - 1, -1, -1):
+        order = torch.sort(mask_u[argsort, c], stable=True)[1]
+        argsort = argsort[order]
+    return argsort.to(torch.int32)
+
+
+def _get_indice_pairs_implicit_gemm_cpu(indices: torch.Tensor,
+                                        batch_size: int,
+                                        spatial_shape: List[int],
+                                        algo: ConvAlgo,
+                                        ksize: List[int],
+                                        stride: List[int],
+                                        padding: List[int],
+                                        dilation: List[int],
+                                        out_padding: List[int],
+                                        subm: bool,
+                                        transpose: bool,
+                                        is_train: bool,
+                                        num_out_act_bound: int,
+                                        do_sort: bool):
+    """cpu version of get_indice_pairs_implicit_gemm. we generate native
+    pairs by cpu indice generator, then convert them to implicit gemm format,
+    so the result can be consumed by implicit gemm kernels on any device.
+    """
+    assert algo == ConvAlgo.MaskImplicitGemm or algo == ConvAlgo.MaskSplitImplicitGemm, (
+        "cpu implicit gemm pairs require MaskImplicitGemm or MaskSplitImplicitGemm")
+    out_inds, pair_native, pair_num = get_indice_pairs(
+        indices, batch_size, spatial_shape, ConvAlgo.Native, ksize, stride,
+        padding, dilation, out_padding, subm, transpose)
+    kv: int = functools.reduce(lambda x, y: x * y, ksize, 1)
+    num_in = indices.shape[0]
+    if not subm and num_out_act_bound > 0 and out_inds.shape[0] > num_out_act_bound:
+        out_inds = out_inds[:num_out_act_bound]
+    num_out = out_inds.shape[0]
+    masks = _cpu_implicit_gemm_masks(algo, kv)
+    mask_split_count = len(masks)
+    is_mask_split = mask_split_count > 1
+
+    if pair_native.ndim == 2:
+        # csr pairs, center pairs of subm aren't stored.
+        pair_num_stored = pair_num.long()
+        subm_half = cpu_subm_pairs_are_half(indices, subm)
+        if subm_half:
+            pair_num_stored = pair_num_stored.clone()
+            pair_num_stored[kv // 2:] = 0
+        k_idx = torch.repeat_interleave(
+            torch.arange(kv, dtype=torch.int64), pair_num_stored)
+        inp = pair_native[0].long()
+        out = pair_native[1].long()
+        if subm_half:
+            k_idx = torch.cat([k_idx, kv - 1 - k_idx])
+            inp, out = torch.cat([inp, out]), torch.cat([out, inp])
+        if subm:
+            center_inds = torch.arange(num_in, dtype=torch.int64)
+            k_idx = torch.cat([k_idx, torch.full_like(center_inds, kv // 2)])
+            inp = torch.cat([inp, center_inds])
+            out = torch.cat([out, center_inds])
+        valid = out < num_out
+        k_idx, inp, out = k_idx[valid], inp[valid], out[valid]
+    else:
+        valid = (pair_native[0] >= 0) & (pair_native[1] >= 0) & (
+            pair_native[1] < num_out)
+        k_idx, pos = valid.nonzero(as_tuple=True)
+        inp = pair_native[0][k_idx, pos].long()
+        out = pair_native[1][k_idx, pos].long()
+    if subm:
+        pair = torch.full((2 if is_train else 1, kv, num_in),
+                          -1,
+                          dtype=indices.dtype)
+        pair_fwd = pair[0]
+    else:
+        pair_fwd = torch.full((kv, num_out), -1, dtype=indices.dtype)
+    pair_fwd[k_idx, out] = inp.to(indices.dtype)
+    indice_num_per_loc = (pair_fwd >= 0).sum(1).to(indices.dtype)
+    pair_bwd = torch.Tensor()
+    if is_train:
+        pair_bwd = pair[1] if subm else torch.full(
+            (kv, num_in), -1, dtype=indices.dtype)
+        pair_bwd[k_idx, inp] = out.to(indices.dtype)
+
+    pair_mask_fwd = _cpu_pair_mask(pair_fwd)
+    center = kv // 2
+    pair_mask_fwd_splits: List[torch.Tensor] = []
+    mask_argsort_fwd_splits: List[torch.Tensor] = []
+    for j in range(mask_split_count):
+        mask_j = pair_mask_fwd
+        if subm and j > 0:
+            # second split of subm don't contain center.
+            mask_j = pair_mask_fwd.clone()
+            mask_j[:, 0] &= ~(1 << center)
+        pair_mask_fwd_splits.append(mask_j)
+        mask_filter = masks[j].item() if (is_mask_split and not subm) else None
+        mask_argsort_fwd_splits.append(
+            _cpu_mask_argsort(mask_j, mask_filter, do_sort))
+    if subm:
+        return (out_inds, indice_num_per_loc, pair_fwd, pair_bwd,
+                pair_mask_fwd_splits, [], mask_argsort_fwd_splits, [], masks)
+    pair_mask_bwd_splits: List[torch.Tensor] = []
+    mask_argsort_bwd_splits: List[torch.Tensor] = []
+    if is_train:
+        pair_mask_bwd = _cpu_pair_mask(pair_bwd)
+        for j in range(mask_split_count):
+            pair_mask_bwd_splits.append(pair_mask_bwd)
+            mask_filter = masks[j].item() if is_mask_split else None
+            mask_argsort_bwd_splits.append(
+                _cpu_mask_argsort(pair_mask_bwd, mask_filter, do_sort))
+    return (out_inds, indice_num_per_loc, pair_fwd, pair_bwd,
+            pair_mask_fwd_splits, pair_mask_bwd_splits,
+            mask_argsort_fwd_splits, mask_argsort_bwd_splits, masks)
+
+
 def get_indice_pairs_implicit_gemm(
         indices: torch.Tensor,
         batch_size: int,
@@ -360,6 +648,11 @@ def get_indice_pairs_implicit_gemm(
     direct_table: a hash-based regular conv pair gen algo to avoid unique operation.
     runs faster than pytorch unique with num_voxel < 1000k.
     """
+    if not indices.is_cuda:
+        return _get_indice_pairs_implicit_gemm_cpu(
+            indices, batch_size, spatial_shape, algo, ksize, stride, padding,
+            dilation, out_padding, subm, transpose, is_train,
+            num_out_act_bound, do_sort)
     stream = get_current_stream()
     if SPCONV_CPP_INDICE_PAIRS_IGEMM:
         thalloc = TorchAllocator(indices.device)
@@ -808,6 +1101,276 @@ def get_indice_pairs_implicit_gemm(
                 mask_argsort_fwd_splits, mask_argsort_bwd_splits, masks)
 
 
+def _cpu_pair_offsets(indice_pairs: torch.Tensor,
+                      indice_pair_num_cpu: List[int]) -> Optional[List[int]]:
+    """start of each kernel offset in csr pairs ([2, total]),
+    None for dense pairs ([2, kv, N]).
+    """
+    if indice_pairs.ndim != 2:
+        return None
+    offsets: List[int] = []
+    offset = 0
+    for nhot in indice_pair_num_cpu:
+        offsets.append(offset)
+        offset += nhot
+    return offsets
+
+
+def _cpu_pair_slices(pair_in: Union[tv.Tensor, torch.Tensor],
+                     pair_out: Union[tv.Tensor, torch.Tensor],
+                     i: int,
+                     nhot: int,
+                     pair_offsets: Optional[List[int]],
+                     subm_half: bool = False):
+    """get (inp_indices, out_indices) of kernel offset i from dense or csr
+    pairs. offsets after center of half subm pairs use pairs of mirrored
+    offset with in/out swapped.
+    """
+    if subm_half and i > len(pair_offsets) // 2:
+        i = len(pair_offsets) - 1 - i
+        pair_in, pair_out = pair_out, pair_in
+    start = 0
+    if pair_offsets is None:
+        pair_in = pair_in[i]
+        pair_out = pair_out[i]
+    else:
+        start = pair_offsets[i]
+    if isinstance(pair_in, torch.Tensor):
+        return (pair_in[start:start + nhot], pair_out[start:start + nhot])
+    return (pair_in.slice_first_axis(start, start + nhot),
+            pair_out.slice_first_axis(start, start + nhot))
+
+
+def _cpu_dtype_is_torch_only(features: torch.Tensor) -> bool:
+    """tensorview can't view cpu bf16 tensors, they use torch gather, mm
+    (fp32 accumulation) and index_add instead of spconv cpu kernels.
+    this path runs per kernel offset and is slower than fp32.
+    """
+    return not features.is_cuda and features.dtype not in _TORCH_DTYPE_TO_TV
+
+
+def _indice_conv_cpu_torch(features: torch.Tensor, filters: torch.Tensor,
+                           out_features: torch.Tensor,
+                           indice_pairs: torch.Tensor,
+                           indice_pair_num_cpu: List[int], inverse: bool,
+                           subm: bool, subm_half: bool, kv_dim: int,
+                           is_KC_not_CK: bool):
+    kv = len(indice_pair_num_cpu)
+    kv_center = kv // 2
+    pair_in = indice_pairs[int(inverse)]
+    pair_out = indice_pairs[int(not inverse)]
+    pair_offsets = _cpu_pair_offsets(indice_pairs, indice_pair_num_cpu)
+    for i, nhot in enumerate(indice_pair_num_cpu):
+        if subm and i == kv_center:
+            continue
+        if subm and i > kv_center:
+            nhot = indice_pair_num_cpu[kv - i - 1]
+        if nhot <= 0:
+            continue
+        inp_indices, out_indices = _cpu_pair_slices(pair_in, pair_out, i,
+                                                    nhot, pair_offsets,
+                                                    subm_half)
+        filters_i = filters.select(kv_dim, i)
+        filters_cur = filters_i if not is_KC_not_CK else filters_i.T
+        out_features.index_add_(
+            0, out_indices.long(),
+            torch_mm(features[inp_indices.long()], filters_cur))
+    return out_features
+
+
+def _indice_conv_backward_cpu_torch(features: torch.Tensor,
+                                    filters: torch.Tensor,
+                                    out_bp: torch.Tensor, din: torch.Tensor,
+                                    dfilters: torch.Tensor,
+                                    indice_pairs: torch.Tensor,
+                                    indice_pair_num_cpu: List[int],
+                                    inverse: bool, subm: bool,
+                                    subm_half: bool, kv_dim: int,
+                                    is_KC_not_CK: bool):
+    kv = len(indice_pair_num_cpu)
+    kv_center = kv // 2
+    pair_in = indice_pairs[int(inverse)]
+    pair_out = indice_pairs[int(not inverse)]
+    pair_offsets = _cpu_pair_offsets(indice_pairs, indice_pair_num_cpu)
+    for i, nhot in enumerate(indice_pair_num_cpu):
+        if subm and i == kv_center:
+            continue
+        if subm and i > kv_center:
+            nhot = indice_pair_num_cpu[kv - i - 1]
+        if nhot <= 0:
+            continue
+        inp_indices, out_indices = _cpu_pair_slices(pair_in, pair_out, i,
+                                                    nhot, pair_offsets,
+                                                    subm_half)
+        inp_indices = inp_indices.long()
+        inp_buffer = features[inp_indices]
+        out_buffer = out_bp[out_indices.long()]
+        filters_i = filters.select(kv_dim, i)
+        dfilters_i = dfilters.select(kv_dim, i)
+        filters_KC = filters_i if is_KC_not_CK else filters_i.T
+        if is_KC_not_CK:
+            # KN @ NC
+            torch_mm(out_buffer.T, inp_buffer, out=dfilters_i)
+        else:
+            # CN @ NK
+            torch_mm(inp_buffer.T, out_buffer, out=dfilters_i)
+        # NK @ KC
+        din.index_add_(0, inp_indices, torch_mm(out_buffer, filters_KC))
+
+
+def _cpu_conv_strategy(
+        output_stationary: bool) -> Optional[CPUConvStrategy]:
+    """strategy of cpu native conv from SPCONV_CPU_* flags, None if it
+    should be selected by CPU_TUNER.
+    """
+    if output_stationary:
+        return CPUConvStrategy.OutputStationary
+    if constants.SPCONV_CPU_AUTOTUNE:
+        return None
+    if not constants.SPCONV_CPU_FUSED_GEMM:
+        return CPUConvStrategy.Unfused
+    if constants.SPCONV_CPU_GROUPED_GEMM:
+        return CPUConvStrategy.Grouped
+    return CPUConvStrategy.Fused
+
+
+def _arena_empty(arena: Optional[CPUArenaAllocator], shape: List[int],
+                 dtype: torch.dtype) -> torch.Tensor:
+    if arena is None:
+        return torch.empty(shape, dtype=dtype)
+    return arena.empty(shape, dtype)
+
+
+def _arena_free(arena: Optional[CPUArenaAllocator],
+                ten: Optional[torch.Tensor]):
+    if arena is not None and ten is not None:
+        arena.free(ten)
+
+
+def _indice_conv_cpu(strategy: CPUConvStrategy,
+                     out_features: torch.Tensor,
+                     features: torch.Tensor,
+                     filters: torch.Tensor,
+                     filters_packed: Optional[torch.Tensor],
+                     indice_pairs: torch.Tensor,
+                     indice_pair_num: torch.Tensor,
+                     indice_pair_num_cpu: List[int],
+                     inverse: bool,
+                     subm: bool,
+                     subm_half: bool,
+                     kv_dim: int,
+                     is_KC_not_CK: bool,
+                     bias_tv: tv.Tensor = tv.Tensor(),
+                     output_add_tv: tv.Tensor = tv.Tensor(),
+                     act_type: tv.gemm.Activation = tv.gemm.Activation.None_,
+                     act_alpha: float = 0.0,
+                     arena: Optional[CPUArenaAllocator] = None):
+    """out_features += conv(features) with one cpu strategy, then
+    epilogue. subm center must be in out_features already.
+    workspaces are taken from arena if exists.
+    """
+    a = torch_tensor_to_tv(features)
+    c = torch_tensor_to_tv(out_features)
+    indice_pairs_tv = torch_tensor_to_tv(indice_pairs)
+    kv = len(indice_pair_num_cpu)
+    kv_center = kv // 2
+    if strategy != CPUConvStrategy.Unfused:
+        tile_size = constants.SPCONV_CPU_FUSED_GEMM_TILE_SIZE
+        indice_pair_num_tv = torch_tensor_to_tv(indice_pair_num)
+        if filters_packed is not None:
+            filters_packed_tv = torch_tensor_to_tv(filters_packed)
+        else:
+            filters_packed_tv = SpconvOps.pack_filters_cpu(
+                torch_tensor_to_tv(filters.contiguous()), ALL_WEIGHT_IS_KRSC,
+                FILTER_HWIO)
+        if strategy == CPUConvStrategy.OutputStationary:
+            table_th = _arena_empty(arena, [out_features.shape[0], kv],
+                                    torch.int32)
+            table = SpconvOps.neighbor_table_cpu(indice_pairs_tv,
+                                                 indice_pair_num_tv,
+                                                 out_features.shape[0],
+                                                 inverse, subm, subm_half,
+                                                 torch_tensor_to_tv(table_th))
+            SpconvOps.indice_conv_output_stationary_cpu(
+                c, a, filters_packed_tv, table,
+                constants.SPCONV_CPU_OUTPUT_STATIONARY_TILE_SIZE, bias_tv,
+                output_add_tv, act_type, act_alpha)
+            _arena_free(arena, table_th)
+        elif strategy == CPUConvStrategy.Grouped:
+            workspace = None
+            workspace_tv = tv.Tensor()
+            if arena is not None:
+                workspace_size = SpconvOps.grouped_workspace_size_cpu(
+                    indice_pairs_tv, indice_pair_num_tv,
+                    out_features.shape[0], out_features.shape[1], c.dtype,
+                    inverse, subm, subm_half)
+                workspace = arena.empty([workspace_size], torch.uint8)
+                workspace_tv = torch_tensor_to_tv(workspace)
+            SpconvOps.indice_conv_grouped_cpu(c, a, filters_packed_tv,
+                                              indice_pairs_tv,
+                                              indice_pair_num_tv, inverse,
+                                              subm, subm_half, tile_size,
+                                              bias_tv,
+                                              output_add_tv, act_type,
+                                              act_alpha, workspace_tv)
+            _arena_free(arena, workspace)
+        else:
+            SpconvOps.indice_conv_cpu(c, a, filters_packed_tv,
+                                      indice_pairs_tv, indice_pair_num_tv,
+                                      inverse, subm, subm_half, tile_size,
+                                      bias_tv, output_add_tv, act_type,
+                                      act_alpha)
+        return out_features
+    if filters_packed is not None:
+        filters = filters_packed
+        kv_dim = 0
+        is_KC_not_CK = False
+    maxnhot = max(indice_pair_num_cpu)
+    pair_in = indice_pairs_tv[int(inverse)]
+    pair_out = indice_pairs_tv[int(not inverse)]
+    inp_buffer = _arena_empty(arena, [maxnhot, features.shape[1]],
+                              features.dtype)
+    out_buffer = _arena_empty(arena, [maxnhot, out_features.shape[1]],
+                              out_features.dtype)
+    inp_buffer_tv = torch_tensor_to_tv(inp_buffer)
+    out_buffer_tv = torch_tensor_to_tv(out_buffer)
+    pair_offsets = _cpu_pair_offsets(indice_pairs, indice_pair_num_cpu)
+    for i, nhot in enumerate(indice_pair_num_cpu):
+        if subm and i == kv_center:
+            continue
+        if subm and i > kv_center:
+            nhot = indice_pair_num_cpu[kv - i - 1]
+        if nhot <= 0:
+            continue
+        inp_indices, out_indices = _cpu_pair_slices(pair_in, pair_out, i,
+                                                    nhot, pair_offsets,
+                                                    subm_half)
+        SpconvOps.gather_cpu(inp_buffer_tv, a, inp_indices)
+        filters_i = filters.select(kv_dim, i)
+        filters_cur = filters_i if not is_KC_not_CK else filters_i.T
+        torch_mm(inp_buffer[:nhot], filters_cur, out=out_buffer[:nhot])
+        SpconvOps.scatter_add_cpu(c, out_buffer_tv, out_indices)
+    _arena_free(arena, inp_buffer)
+    _arena_free(arena, out_buffer)
+    SpconvOps.epilogue_cpu(c, bias_tv, output_add_tv, act_type, act_alpha)
+    return out_features
+
+
+def pack_filters_cpu(filters: torch.Tensor) -> torch.Tensor:
+    """pack filters to contiguous per-offset blocks [kv, C, K], the layout
+    used by cpu gemm. SparseConvolution caches it for cpu inference.
+    """
+    if ALL_WEIGHT_IS_KRSC:
+        out_channel = filters.shape[0]
+        packed = filters.reshape(out_channel, -1,
+                                 filters.shape[-1]).permute(1, 2, 0)
+    elif FILTER_HWIO:
+        packed = filters.reshape(-1, *filters.shape[-2:])
+    else:
+        packed = filters.reshape(-1, *filters.shape[-2:]).transpose(1, 2)
+    return packed.contiguous()
+
+
 def indice_conv(features: torch.Tensor,
                 filters: torch.Tensor,
                 indice_pairs: torch.Tensor,
@@ -820,8 +1383,15 @@ def indice_conv(features: torch.Tensor,
                 bias: Optional[torch.Tensor] = None,
                 act_alpha: float = 0.0,
                 act_beta: float = 0.0,
-                act_type: tv.gemm.Activation = tv.gemm.Activation.None_):
+                act_type: tv.gemm.Activation = tv.gemm.Activation.None_,
+                output_add: Optional[torch.Tensor] = None,
+                filters_packed: Optional[torch.Tensor] = None,
+                arena: Optional[CPUArenaAllocator] = None,
+                subm_half: bool = False):
     # filters: RSKC
+    # filters_packed: [kv, C, K] from pack_filters_cpu, only used on cpu.
+    # arena: cpu workspaces are taken from it if exists.
+    # subm_half: indice_pairs are half csr subm pairs, see get_indice_pairs.
     # stream = get_current_stream()
     # CONV.stream_synchronize(stream)
     # t = time.time()
@@ -829,13 +1399,26 @@ def indice_conv(features: torch.Tensor,
         features = features.contiguous()
     if features.dtype == torch.int8 or features.dtype == torch.qint8:
         raise NotImplementedError("work in progress")
+    if output_add is not None and features.is_cuda:
+        # cuda kernels only fuse bias and act.
+        out_features = indice_conv(features, filters, indice_pairs,
+                                   indice_pair_num, num_activate_out, inverse,
+                                   subm, algo, timer, bias)
+        return _indice_conv_epilogue_(out_features, None, output_add,
+                                      act_alpha, act_type)
+    torch_only = _cpu_dtype_is_torch_only(features)
     bias_tv = tv.Tensor()
-    if bias is not None:
+    if bias is not None and not torch_only:
         bias_tv = torch_tensor_to_tv(bias)
 
-    if SPCONV_CPP_GEMM and GEMM_CPP is not None:
+    # csr pairs and output stationary are only supported by python cpu path.
+    is_csr = indice_pairs.ndim == 2
+    output_stationary = (algo == ConvAlgo.OutputStationary
+                         and not features.is_cuda)
+    if (SPCONV_CPP_GEMM and GEMM_CPP is not None and not is_csr
+            and not output_stationary and not torch_only):
         # print("CPPPPPP!!!", features.device)
-        alloc = TorchAllocator(features.device)
+        alloc = TorchAllocator(features.device, arena=arena)
         ext_mm = TorchSpconvMatmul(alloc)
 
         # from spconv.core_cc.csrc.sparse.convops import SimpleExternalSpconvMatmul
@@ -857,14 +1440,24 @@ def indice_conv(features: torch.Tensor,
             # plain get_arch by cuda api is VERY SLOW.
             arch = get_arch()
             stream = get_current_stream()
+            ConvGemmOps.indice_conv(alloc, ext_mm, GEMM_CPP,
+                                    ALL_WEIGHT_IS_KRSC, FILTER_HWIO,
+                                    features_tv, filters_tv, indice_pairs_tv,
+                                    indice_pair_num_tv, arch,
+                                    num_activate_out, inverse, subm,
+                                    algo.value, stream, bias_tv, act_alpha,
+                                    act_beta, act_type,
+                                    use_tf32=constants.SPCONV_ALLOW_TF32)
+            return alloc.allocated[AllocKeys.OutFeatures]
+        # cpp ops don't support cpu epilogue, apply it after conv.
         ConvGemmOps.indice_conv(alloc, ext_mm, GEMM_CPP, ALL_WEIGHT_IS_KRSC,
                                 FILTER_HWIO, features_tv, filters_tv,
                                 indice_pairs_tv, indice_pair_num_tv, arch,
                                 num_activate_out, inverse, subm, algo.value,
-                                stream, bias_tv, act_alpha, act_beta, act_type,
-                                use_tf32=constants.SPCONV_ALLOW_TF32)
+                                stream, use_tf32=constants.SPCONV_ALLOW_TF32)
         out_features = alloc.allocated[AllocKeys.OutFeatures]
-        return out_features
+        return _indice_conv_epilogue_(out_features, bias, output_add,
+                                      act_alpha, act_type)
     if not features.is_cuda:
         stream = 0
     else:
@@ -872,8 +1465,11 @@ def indice_conv(features: torch.Tensor,
 
     has_bias = bias is not None
     has_act = act_type != tv.gemm.Activation.None_
-    if has_bias or has_act:
-        assert features.is_cuda, "cpu don't support act and bias"
+    output_add_tv = tv.Tensor()
+    if output_add is not None:
+        output_add = output_add.contiguous()
+        if not torch_only:
+            output_add_tv = torch_tensor_to_tv(output_add)
     if not ALL_WEIGHT_IS_KRSC:
         kv_dim = 0
         is_KC_not_CK = not FILTER_HWIO
@@ -894,39 +1490,45 @@ def indice_conv(features: torch.Tensor,
         filter_shape_per_kv = [out_channel, filters.shape[-1]]
 
     kv_center = kv // 2
+    if filters_packed is not None and not features.is_cuda:
+        filters = filters_packed
+        kv_dim = 0
+        is_KC_not_CK = False
+    out_features_static = None
+    if arena is not None and not features.is_cuda:
+        out_features_static = arena.alloc(AllocKeys.OutFeatures,
+                                          [num_activate_out, out_channel],
+                                          features.dtype, False)
     if subm:
         # out_features = torch.zeros((num_activate_out, out_channel),
         #                            dtype=features.dtype,
         #                            device=features.device)
-        if not ALL_WEIGHT_IS_KRSC:
-            if not is_KC_not_CK:
-                out_features = torch.mm(features, filters[kv_center])
-            else:
-                out_features = torch.mm(features, filters[kv_center].T)
-        else:
-            if features.is_cuda or (features.dtype != torch.float16):
-                out_features = torch.mm(features, filters[:, kv_center].T)
-            else:
-                # pytorch 1.12 don't support cpu half mm, f**k pytorch
-                # we need cpu fp16 mm for test only.
-                out_features = torch.empty((features.shape[0], out_channel),
-                                           dtype=features.dtype,
-                                           device=features.device)
-                features_np = torch_tensor_to_tv(features).numpy_view()
-                filters_np = torch_tensor_to_tv(filters).numpy_view()
-                out_features_np = torch_tensor_to_tv(out_features).numpy_view()
-                np.matmul(features_np,
-                          filters_np[:, kv_center].T,
-                          out=out_features_np)
-                # out_features = torch.mm(features, filters[:, kv_center].T)
+        filters_center = filters.select(kv_dim, kv_center)
+        if is_KC_not_CK:
+            filters_center = filters_center.T
+        out_features = torch_mm(features, filters_center,
+                                out=out_features_static)
+    elif out_features_static is not None:
+        out_features = out_features_static.zero_()
     else:
         out_features = torch.zeros((num_activate_out, out_channel),
                                    dtype=features.dtype,
                                    device=features.device)
+    if torch_only:
+        out_features = _indice_conv_cpu_torch(features, filters, out_features,
+                                              indice_pairs,
+                                              indice_pair_num.cpu().tolist(),
+                                              inverse, subm, subm_half, kv_dim,
+                                              is_KC_not_CK)
+        return _indice_conv_epilogue_(out_features, bias, output_add,
+                                      act_alpha, act_type)
     c = torch_tensor_to_tv(out_features)
 
     if kv == 1 and subm:
-        if (has_act and has_bias):
+        if not features.is_cuda:
+            SpconvOps.epilogue_cpu(c, bias_tv, output_add_tv, act_type,
+                                   act_alpha)
+        elif (has_act and has_bias):
             InferenceOps.bias_add_act_inplace(c, bias_tv, act_type, act_alpha, act_beta, stream)
         else:
             if has_act:
@@ -938,8 +1540,8 @@ def indice_conv(features: torch.Tensor,
 
     indice_pair_num_cpu = indice_pair_num.cpu().tolist()
     if subm and all(x == 0 for x in indice_pair_num_cpu):
-        return out_features
-    maxnhot = max(indice_pair_num_cpu)
+        return _indice_conv_epilogue_(out_features, bias, output_add,
+                                      act_alpha, act_type)
 
     inited: bool = subm
     a = torch_tensor_to_tv(features)
@@ -952,39 +1554,26 @@ def indice_conv(features: torch.Tensor,
         # perform gather-mm-scatter_add for cpu data
         assert not filters.is_cuda
         assert not indice_pairs.is_cuda
-        inp_buffer = torch.empty([maxnhot, features.shape[1]],
-                                 dtype=features.dtype)
-        out_buffer = torch.empty([maxnhot, out_features.shape[1]],
-                                 dtype=out_features.dtype)
-        inp_buffer_tv = torch_tensor_to_tv(inp_buffer)
-        out_buffer_tv = torch_tensor_to_tv(out_buffer)
-
-        for i, nhot in enumerate(indice_pair_num_cpu):
-            if subm and i == kv_center:
-                continue
-            if subm and i > kv_center:
-                nhot = indice_pair_num_cpu[kv - i - 1]
-            if nhot <= 0:
-                continue
-            inp_indices = pair_in[i].slice_first_axis(0, nhot)
-            out_indices = pair_out[i].slice_first_axis(0, nhot)
-            SpconvOps.gather_cpu(inp_buffer_tv, a, inp_indices)
-            filters_i = filters.select(kv_dim, i)
-            filters_cur = filters_i if not is_KC_not_CK else filters_i.T
-            if features.dtype == torch.float16:
-                inp_buffer_np = torch_tensor_to_tv(inp_buffer).numpy_view()
-                filters_np = torch_tensor_to_tv(filters).numpy_view()
-                filters_i_np = filters_np[
-                    i] if not ALL_WEIGHT_IS_KRSC else filters_np[:, i]
-                filters_cur_np = filters_i_np if not is_KC_not_CK else filters_i_np.T
-                out_buffer_np = torch_tensor_to_tv(out_buffer).numpy_view()
-                np.matmul(inp_buffer_np[:nhot],
-                          filters_cur_np,
-                          out=out_buffer_np[:nhot])
-            else:
-                torch.mm(inp_buffer[:nhot], filters_cur, out=out_buffer[:nhot])
-            SpconvOps.scatter_add_cpu(c, out_buffer_tv, out_indices)
-
+        strategy = _cpu_conv_strategy(output_stationary)
+        if strategy is None:
+            if filters_packed is None:
+                filters_packed = pack_filters_cpu(filters)
+            key = CPU_TUNER.get_key(features.shape[1], out_channel, kv,
+                                    indice_pair_num_cpu, num_activate_out,
+                                    features.dtype, subm)
+            strategy = CPU_TUNER.get_tuned_strategy(key)
+            if strategy is None:
+                strategy = CPU_TUNER.tune_and_cache(
+                    key, lambda st: _indice_conv_cpu(
+                        st, out_features.clone(), features, filters,
+                        filters_packed, indice_pairs, indice_pair_num,
+                        indice_pair_num_cpu, inverse, subm, subm_half,
+                        kv_dim, is_KC_not_CK, arena=arena))
+        _indice_conv_cpu(strategy, out_features, features, filters,
+                         filters_packed, indice_pairs, indice_pair_num,
+                         indice_pair_num_cpu, inverse, subm, subm_half,
+                         kv_dim, is_KC_not_CK, bias_tv, output_add_tv,
+                         act_type, act_alpha, arena)
         return out_features
 
     profile_idx = kv_center
@@ -1108,7 +1697,8 @@ def indice_conv_backward(features: torch.Tensor,
                          inverse: bool = False,
                          subm: bool = False,
                          algo: ConvAlgo = ConvAlgo.Native,
-                         timer: CUDAKernelTimer = CUDAKernelTimer(False)):
+                         timer: CUDAKernelTimer = CUDAKernelTimer(False),
+                         subm_half: bool = False):
     # print(out_bp.mean(), out_bp.max(), out_bp.min())
     filters_shape = filters.shape
     # TODO handle this in nn.Module to make sure features in backward is contiguous
@@ -1119,8 +1709,13 @@ def indice_conv_backward(features: torch.Tensor,
     assert out_bp.is_contiguous()
     assert filters.is_contiguous()
     assert features.is_contiguous()
-
-    if SPCONV_CPP_GEMM and GEMM_CPP is not None:
+    # csr pairs and output stationary are only supported by python cpu path.
+    is_csr = indice_pairs.ndim == 2
+    output_stationary = (algo == ConvAlgo.OutputStationary
+                         and not features.is_cuda)
+    torch_only = _cpu_dtype_is_torch_only(features)
+    if (SPCONV_CPP_GEMM and GEMM_CPP is not None and not is_csr
+            and not output_stationary and not torch_only):
         alloc = TorchAllocator(features.device)
         ext_mm = TorchSpconvMatmul(alloc)
         alloc.allocated[AllocKeys.Features] = features
@@ -1175,16 +1770,16 @@ def indice_conv_backward(features: torch.Tensor,
         dfilters = torch.zeros_like(filters)
         if not ALL_WEIGHT_IS_KRSC:
             if not is_KC_not_CK:
-                torch.mm(features.T, out_bp, out=dfilters[kv_center])
-                din = torch.mm(out_bp, filters[kv_center].T)
+                torch_mm(features.T, out_bp, out=dfilters[kv_center])
+                din = torch_mm(out_bp, filters[kv_center].T)
             else:
-                torch.mm(out_bp.T, features, out=dfilters[kv_center])
-                din = torch.mm(out_bp, filters[kv_center])
+                torch_mm(out_bp.T, features, out=dfilters[kv_center])
+                din = torch_mm(out_bp, filters[kv_center])
         else:
             # KN @ NC
-            torch.mm(out_bp.T, features, out=dfilters[:, kv_center])
+            torch_mm(out_bp.T, features, out=dfilters[:, kv_center])
             # NK @ KC
-            din = torch.mm(out_bp, filters[:, kv_center])
+            din = torch_mm(out_bp, filters[:, kv_center])
 
     else:
         dfilters = torch.zeros_like(filters)
@@ -1197,11 +1792,19 @@ def indice_conv_backward(features: torch.Tensor,
     pair_in = indice_pairs_tv[int(inverse)]
     pair_out = indice_pairs_tv[int(not inverse)]
 
-    stream = get_current_stream()
+    stream = 0
+    if features.is_cuda:
+        stream = get_current_stream()
     indice_pair_num_cpu = indice_pair_num.cpu().tolist()
     if subm and all(x == 0 for x in indice_pair_num_cpu):
         return (din, dfilters.reshape(filters_shape))
     maxnhot = max(indice_pair_num_cpu)
+    if torch_only:
+        _indice_conv_backward_cpu_torch(features, filters, out_bp, din,
+                                        dfilters, indice_pairs,
+                                        indice_pair_num_cpu, inverse, subm,
+                                        subm_half, kv_dim, is_KC_not_CK)
+        return (din, dfilters.reshape(filters_shape))
 
     filters_tv = torch_tensor_to_tv(filters)
 
@@ -1215,13 +1818,45 @@ def indice_conv_backward(features: torch.Tensor,
         # perform gather-mm-scatter_add for cpu data
         assert not filters.is_cuda
         assert not indice_pairs.is_cuda
+        if constants.SPCONV_CPU_FUSED_GEMM or output_stationary:
+            tile_size = constants.SPCONV_CPU_FUSED_GEMM_TILE_SIZE
+            indice_pair_num_tv = torch_tensor_to_tv(indice_pair_num)
+            # dgrad is forward with in/out swapped and transposed filters.
+            filters_packed_t = SpconvOps.pack_filters_cpu(
+                filters_tv, ALL_WEIGHT_IS_KRSC, FILTER_HWIO, True)
+            if output_stationary:
+                table = SpconvOps.neighbor_table_cpu(indice_pairs_tv,
+                                                     indice_pair_num_tv,
+                                                     features.shape[0],
+                                                     not inverse, subm,
+                                                     subm_half)
+                SpconvOps.indice_conv_output_stationary_cpu(
+                    din_tv, out_bp_tv, filters_packed_t, table,
+                    constants.SPCONV_CPU_OUTPUT_STATIONARY_TILE_SIZE)
+            elif constants.SPCONV_CPU_GROUPED_GEMM:
+                SpconvOps.indice_conv_grouped_cpu(din_tv, out_bp_tv,
+                                                  filters_packed_t,
+                                                  indice_pairs_tv,
+                                                  indice_pair_num_tv,
+                                                  not inverse, subm,
+                                                  subm_half, tile_size)
+            else:
+                SpconvOps.indice_conv_cpu(din_tv, out_bp_tv, filters_packed_t,
+                                          indice_pairs_tv, indice_pair_num_tv,
+                                          not inverse, subm, subm_half,
+                                          tile_size)
+            SpconvOps.indice_conv_weight_grad_cpu(
+                dfilters_tv, features_tv, out_bp_tv, indice_pairs_tv,
+                indice_pair_num_tv, ALL_WEIGHT_IS_KRSC, FILTER_HWIO, inverse,
+                subm, subm_half, tile_size)
+            return (din, dfilters.reshape(filters_shape))
         inp_buffer = torch.empty([maxnhot, features.shape[1]],
                                  dtype=features.dtype)
         out_buffer = torch.empty([maxnhot, out_bp.shape[1]],
                                  dtype=out_bp.dtype)
         inp_buffer_tv = torch_tensor_to_tv(inp_buffer)
         out_buffer_tv = torch_tensor_to_tv(out_buffer)
-
+        pair_offsets = _cpu_pair_offsets(indice_pairs, indice_pair_num_cpu)
         for i, nhot in enumerate(indice_pair_num_cpu):
             if subm and i == kv_center:
                 continue
@@ -1229,8 +1864,8 @@ def indice_conv_backward(features: torch.Tensor,
                 nhot = indice_pair_num_cpu[kv - i - 1]
             if nhot <= 0:
                 continue
-            inp_indices = pair_in[i].slice_first_axis(0, nhot)
-            out_indices = pair_out[i].slice_first_axis(0, nhot)
+            inp_indices, out_indices = _cpu_pair_slices(
+                pair_in, pair_out, i, nhot, pair_offsets, subm_half)
             SpconvOps.gather_cpu(inp_buffer_tv, features_tv, inp_indices)
             SpconvOps.gather_cpu(out_buffer_tv, out_bp_tv, out_indices)
             filters_i = filters.select(kv_dim, i)
@@ -1239,16 +1874,16 @@ def indice_conv_backward(features: torch.Tensor,
             filters_KC = filters_i if is_KC_not_CK else filters_i.T
             if is_KC_not_CK:
                 # KN @ NC
-                torch.mm(out_buffer[:nhot].T,
+                torch_mm(out_buffer[:nhot].T,
                          inp_buffer[:nhot],
                          out=dfilters_i)
             else:
                 # CN @ NK
-                torch.mm(inp_buffer[:nhot].T,
+                torch_mm(inp_buffer[:nhot].T,
                          out_buffer[:nhot],
                          out=dfilters_i)
             # NK @ KC
-            torch.mm(out_buffer[:nhot], filters_KC, out=inp_buffer[:nhot])
+            torch_mm(out_buffer[:nhot], filters_KC, out=inp_buffer[:nhot])
             SpconvOps.scatter_add_cpu(din_tv, inp_buffer_tv, inp_indices)
         return (din, dfilters.reshape(filters_shape))
     arch = get_arch()
@@ -1447,6 +2082,151 @@ def indice_conv_backward(features: torch.Tensor,
     return (din, dfilters.reshape(filters_shape))
 
 
+def _cpu_tile_offsets(mask_tile: torch.Tensor, kv: int,
+                      mask_filter: Optional[int], reverse: bool) -> List[int]:
+    """return kernel offsets used by at least one row of a mask tile.
+    """
+    mask_u = mask_tile.to(torch.int64) & 0xffffffff
+    shifts = torch.arange(32, dtype=torch.int64)
+    active = ((mask_u.unsqueeze(-1) >> shifts) & 1).bool().any(0)
+    offsets = active.reshape(-1)[:kv].nonzero().reshape(-1).tolist()
+    if reverse:
+        offsets = [kv - 1 - k for k in offsets[::-1]]
+    if mask_filter is not None:
+        offsets = [k for k in offsets if (mask_filter >> k) & 1]
+    return offsets
+
+
+def _cpu_mask_tiles(mask: torch.Tensor, mask_argsort: torch.Tensor, kv: int,
+                    mask_filter: Optional[int], reverse: bool = False):
+    tile_size = constants.SPCONV_CPU_IGEMM_TILE_SIZE
+    mask_argsort = mask_argsort.long()
+    for start in range(0, mask_argsort.shape[0], tile_size):
+        rows = mask_argsort[start:start + tile_size]
+        yield rows, _cpu_tile_offsets(mask[rows], kv, mask_filter, reverse)
+
+
+def _cpu_epilogue_(out: torch.Tensor, bias: Optional[torch.Tensor],
+                   act_alpha: float, act_type: tv.gemm.Activation):
+    if bias is not None:
+        out += bias
+    if act_type == tv.gemm.Activation.None_:
+        pass
+    elif act_type == tv.gemm.Activation.ReLU:
+        out.relu_()
+    elif act_type == tv.gemm.Activation.Sigmoid:
+        out.sigmoid_()
+    elif act_type == tv.gemm.Activation.LeakyReLU:
+        torch.nn.functional.leaky_relu_(out, act_alpha)
+    else:
+        raise NotImplementedError
+    return out
+
+
+def _indice_conv_epilogue_(out: torch.Tensor, bias: Optional[torch.Tensor],
+                           output_add: Optional[torch.Tensor],
+                           act_alpha: float, act_type: tv.gemm.Activation):
+    """out = act(out + bias + output_add). cpu tensors are done in one pass
+    by spconv cpu kernel.
+    """
+    if (bias is None and output_add is None
+            and act_type == tv.gemm.Activation.None_):
+        return out
+    if not out.is_cuda and not _cpu_dtype_is_torch_only(out):
+        bias_tv = tv.Tensor()
+        output_add_tv = tv.Tensor()
+        if bias is not None:
+            bias_tv = torch_tensor_to_tv(bias)
+        if output_add is not None:
+            output_add_tv = torch_tensor_to_tv(output_add.contiguous())
+        SpconvOps.epilogue_cpu(torch_tensor_to_tv(out), bias_tv,
+                               output_add_tv, act_type, act_alpha)
+        return out
+    if output_add is not None:
+        out += output_add
+    return _cpu_epilogue_(out, bias, act_alpha, act_type)
+
+
+def _implicit_gemm_cpu(features: torch.Tensor, filters: torch.Tensor,
+                       pair_fwd: torch.Tensor,
+                       pair_mask_fwd_splits: List[torch.Tensor],
+                       mask_argsort_fwd_splits: List[torch.Tensor],
+                       num_activate_out: int, masks: List[np.ndarray],
+                       bias: Optional[torch.Tensor], act_alpha: float,
+                       act_type: tv.gemm.Activation,
+                       output_dtype: torch.dtype):
+    """tiled gather-gemm-scatter on cpu. rows are visited in mask argsort
+    order, so rows in a tile have similar masks and unused kernel offsets
+    of a whole tile are skipped.
+    """
+    out_channel = filters.shape[0]
+    filters = filters.reshape(out_channel, -1, filters.shape[-1])
+    kv = filters.shape[1]
+    num_split = len(pair_mask_fwd_splits)
+    out_features = torch.zeros((num_activate_out, out_channel),
+                               dtype=features.dtype)
+    pair_fwd = pair_fwd.long()
+    for j in range(num_split):
+        mask_filter = masks[j].item() if num_split > 1 else None
+        for rows, offsets in _cpu_mask_tiles(pair_mask_fwd_splits[j],
+                                             mask_argsort_fwd_splits[j], kv,
+                                             mask_filter):
+            for k in offsets:
+                inp = pair_fwd[k, rows]
+                valid = inp >= 0
+                out_rows = rows[valid]
+                out_features[out_rows] += torch.mm(features[inp[valid]],
+                                                   filters[:, k].T)
+    _cpu_epilogue_(out_features, bias, act_alpha, act_type)
+    return out_features.to(output_dtype)
+
+
+def _implicit_gemm_backward_cpu(features: torch.Tensor, filters: torch.Tensor,
+                                out_bp: torch.Tensor, pair_fwd: torch.Tensor,
+                                pair_bwd: torch.Tensor,
+                                pair_mask_fwd_splits: List[torch.Tensor],
+                                pair_mask_bwd_splits: List[torch.Tensor],
+                                mask_argsort_fwd_splits: List[torch.Tensor],
+                                mask_argsort_bwd_splits: List[torch.Tensor],
+                                masks: List[np.ndarray], is_subm: bool):
+    filters_shape = filters.shape
+    out_channel = filters.shape[0]
+    filters = filters.reshape(out_channel, -1, filters.shape[-1])
+    kv = filters.shape[1]
+    num_split = len(pair_mask_fwd_splits)
+    din = torch.zeros_like(features)
+    dfilters = torch.zeros_like(filters)
+    pair_fwd = pair_fwd.long()
+    pair_bwd = pair_bwd.long()
+    for j in range(num_split):
+        mask_filter = masks[j].item() if num_split > 1 else None
+        # dgrad: gather dout by pair_bwd. subm reuse fwd mask with reversed
+        # kernel offsets, same as cuda kernels.
+        if is_subm:
+            mask = pair_mask_fwd_splits[j]
+            mask_argsort = mask_argsort_fwd_splits[j]
+        else:
+            mask = pair_mask_bwd_splits[j]
+            mask_argsort = mask_argsort_bwd_splits[j]
+        for rows, offsets in _cpu_mask_tiles(mask, mask_argsort, kv,
+                                             mask_filter, is_subm):
+            for k in offsets:
+                out = pair_bwd[k, rows]
+                valid = out >= 0
+                din[rows[valid]] += torch.mm(out_bp[out[valid]],
+                                             filters[:, k])
+        # wgrad
+        for rows, offsets in _cpu_mask_tiles(pair_mask_fwd_splits[j],
+                                             mask_argsort_fwd_splits[j], kv,
+                                             mask_filter):
+            for k in offsets:
+                inp = pair_fwd[k, rows]
+                valid = inp >= 0
+                dfilters[:, k] += torch.mm(out_bp[rows[valid]].T,
+                                           features[inp[valid]])
+    return din, dfilters.reshape(filters_shape)
+
+
 def implicit_gemm(features: torch.Tensor,
                   filters: torch.Tensor,
                   pair_fwd: torch.Tensor,
@@ -1467,7 +2247,7 @@ def implicit_gemm(features: torch.Tensor,
                   output_add: Optional[torch.Tensor] = None,
                   output_add_scale: float = 0.0,
                   output_dtype: Optional[torch.dtype] = None):
-    stream = get_current_stream()
+    stream = get_current_stream() if features.is_cuda else 0
     bias_tv = tv.Tensor()
     scale_tv = tv.Tensor()
     output_add_tv = tv.Tensor()
@@ -1487,6 +2267,17 @@ def implicit_gemm(features: torch.Tensor,
     assert filters.is_contiguous()
     if output_dtype is None:
         output_dtype = features.dtype
+    if not features.is_cuda:
+        if is_int8:
+            raise NotImplementedError("cpu implicit gemm don't support int8")
+        out_features = _implicit_gemm_cpu(features, filters, pair_fwd,
+                                          pair_mask_fwd_splits,
+                                          mask_argsort_fwd_splits,
+                                          num_activate_out, masks, bias,
+                                          act_alpha, act_type, output_dtype)
+        # cpu backward don't need mask output.
+        mask_output_fwd = torch.Tensor() if is_train else None
+        return out_features, mask_output_fwd, -1
 
     if SPCONV_CPP_GEMM and CONV_CPP is not None:
         alloc = TorchAllocator(features.device, features.dtype == torch.qint8)
@@ -1692,6 +2483,11 @@ def implicit_gemm_backward(features: torch.Tensor,
     assert out_bp.is_contiguous()
     assert filters.is_contiguous()
     assert features.is_contiguous()
+    if not features.is_cuda:
+        return _implicit_gemm_backward_cpu(
+            features, filters, out_bp, pair_fwd, pair_bwd,
+            pair_mask_fwd_splits, pair_mask_bwd_splits,
+            mask_argsort_fwd_splits, mask_argsort_bwd_splits, masks, is_subm)
     stream = get_current_stream()
 
     if SPCONV_CPP_GEMM and CONV_CPP is not None:
@@ -1918,11 +2714,13 @@ def indice_maxpool(features: torch.Tensor, indice_pairs: torch.Tensor,
     out_features_tv = torch_tensor_to_tv(out_features)
     features_tv = torch_tensor_to_tv(features)
     indice_pairs_tv = torch_tensor_to_tv(indice_pairs)
+    pair_offsets = _cpu_pair_offsets(indice_pairs, indice_pair_num_cpu)
     for i, nhot in enumerate(indice_pair_num_cpu):
         if nhot <= 0:
             continue
-        inp_indices = indice_pairs_tv[0][i].slice_first_axis(0, nhot)
-        out_indices = indice_pairs_tv[1][i].slice_first_axis(0, nhot)
+        inp_indices, out_indices = _cpu_pair_slices(indice_pairs_tv[0],
+                                                    indice_pairs_tv[1], i,
+                                                    nhot, pair_offsets)
         if is_cpu:
             SpconvOps.maxpool_forward_cpu(out_features_tv, features_tv,
                                           out_indices, inp_indices)
@@ -1955,11 +2753,13 @@ def indice_maxpool_backward(features, out_features, out_bp, indice_pairs,
     out_bp_tv = torch_tensor_to_tv(out_bp)
     din_tv = torch_tensor_to_tv(din)
     indice_pairs_tv = torch_tensor_to_tv(indice_pairs)
+    pair_offsets = _cpu_pair_offsets(indice_pairs, indice_pair_num_cpu)
     for i, nhot in enumerate(indice_pair_num_cpu):
         if nhot <= 0:
             continue
-        inp_indices = indice_pairs_tv[0][i].slice_first_axis(0, nhot)
-        out_indices = indice_pairs_tv[1][i].slice_first_axis(0, nhot)
+        inp_indices, out_indices = _cpu_pair_slices(indice_pairs_tv[0],
+                                                    indice_pairs_tv[1], i,
+                                                    nhot, pair_offsets)
         if is_cpu:
             SpconvOps.maxpool_backward_cpu(out_features_tv, features_tv,
                                            out_bp_tv, din_tv, out_indices,
@@ -1972,10 +2772,36 @@ def indice_maxpool_backward(features, out_features, out_bp, indice_pairs,
     return din
 
 
+def _indice_maxpool_implicit_gemm_cpu_pairs(indice_pairs: torch.Tensor):
+    """convert implicit gemm pair [kv, N] to native pairs of each kernel
+    offset. yield (row indices, indices stored in these rows).
+    """
+    for k in range(indice_pairs.shape[0]):
+        rows = (indice_pairs[k] >= 0).nonzero().reshape(-1)
+        if rows.shape[0] == 0:
+            continue
+        yield rows.int(), indice_pairs[k][rows].int()
+
+
 def indice_maxpool_implicit_gemm(features: torch.Tensor,
                                  indice_pairs: torch.Tensor, num_activate_out):
     # torch.cuda.synchronize()
     # t = time.time()
+    if not features.is_cuda:
+        if not features.is_contiguous():
+            features = features.contiguous()
+        out_features = torch.full((num_activate_out, features.shape[-1]),
+                                  torch.finfo(features.dtype).min,
+                                  dtype=features.dtype)
+        out_features_tv = torch_tensor_to_tv(out_features)
+        features_tv = torch_tensor_to_tv(features)
+        # pair_fwd: [kv, num_out]
+        for out_indices, inp_indices in _indice_maxpool_implicit_gemm_cpu_pairs(
+                indice_pairs):
+            SpconvOps.maxpool_forward_cpu(out_features_tv, features_tv,
+                                          torch_tensor_to_tv(out_indices),
+                                          torch_tensor_to_tv(inp_indices))
+        return out_features
     stream = get_current_stream()
     # CONV.stream_synchronize(stream)
     # t = time.time()
@@ -2012,17 +2838,25 @@ def indice_maxpool_implicit_gemm_backward(features, out_features, out_bp,
     # t = time.time()
     out_channel = features.shape[-1]
     din = torch.zeros_like(features)
-    assert features.is_cuda
     if not out_bp.is_contiguous():
         out_bp = out_bp.contiguous()
     if not features.is_contiguous():
         features = features.contiguous()
 
-    stream = get_current_stream()
     out_features_tv = torch_tensor_to_tv(out_features)
     features_tv = torch_tensor_to_tv(features)
     out_bp_tv = torch_tensor_to_tv(out_bp)
     din_tv = torch_tensor_to_tv(din)
+    if not features.is_cuda:
+        # pair_bwd: [kv, num_in]
+        for inp_indices, out_indices in _indice_maxpool_implicit_gemm_cpu_pairs(
+                indice_pairs):
+            SpconvOps.maxpool_backward_cpu(out_features_tv, features_tv,
+                                           out_bp_tv, din_tv,
+                                           torch_tensor_to_tv(out_indices),
+                                           torch_tensor_to_tv(inp_indices))
+        return din
+    stream = get_current_stream()
     indice_pairs_tv = torch_tensor_to_tv(indice_pairs)
     SpconvOps.maxpool_implicit_gemm_backward(out_features_tv, features_tv,
                                              out_bp_tv, din_tv,
@@ -2035,6 +2869,20 @@ def indice_avgpool_implicit_gemm(features: torch.Tensor,
                                  calc_count: bool):
     # torch.cuda.synchronize()
     # t = time.time()
+    if not features.is_cuda:
+        out_features = torch.zeros((num_activate_out, features.shape[-1]),
+                                   dtype=features.dtype)
+        count_out = torch.zeros((num_activate_out, ), dtype=torch.int32)
+        # pair_fwd: [kv, num_out]
+        for out_indices, inp_indices in _indice_maxpool_implicit_gemm_cpu_pairs(
+                indice_pairs):
+            out_features.index_add_(0, out_indices, features[inp_indices.long()])
+            count_out[out_indices.long()] += 1
+        out_features /= count_out.clamp(min=1).unsqueeze(1).to(
+            features.dtype)
+        if not calc_count:
+            count_out = torch.Tensor()
+        return out_features, count_out
     stream = get_current_stream()
     # CONV.stream_synchronize(stream)
     # t = time.time()
@@ -2081,6 +2929,13 @@ def indice_avgpool_implicit_gemm_backward(out_bp, indice_pairs, count_out):
     din = torch.zeros((indice_pairs.shape[1], out_bp.shape[1]),
                       dtype=out_bp.dtype,
                       device=out_bp.device)
+    if not out_bp.is_cuda:
+        out_bp = out_bp / count_out.clamp(min=1).unsqueeze(1).to(out_bp.dtype)
+        # pair_bwd: [kv, num_in]
+        for inp_indices, out_indices in _indice_maxpool_implicit_gemm_cpu_pairs(
+                indice_pairs):
+            din.index_add_(0, inp_indices, out_bp[out_indices.long()])
+        return din
     assert out_bp.is_cuda
     if not out_bp.is_contiguous():
         out_bp = out_bp.contiguous()
@@ -0,0 +1,601 @@
+# Copyright 2021 Yan Yan
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""network-level kernel map plan.
+
+a plan is built once from a SparseSequential or a fx GraphModule: layers
+whose kernel maps must be identical (same input coordinates, i.e. same
+stride chain, and same conv params) are grouped. given input coordinates,
+KernelMapPlan.generate computes every map of the network up front, so
+layers never generate pairs during forward, even if they don't share
+indice keys.
+
+plan_static_memory plans cpu inference memory of a network from recorded
+max voxel counts: buffers of every layer get fixed offsets in one
+preallocated arena by liveness analysis over the layer sequence.
+"""
+
+from concurrent.futures import Executor, Future
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import torch
+import torch.fx
+from torch import nn
+
+from spconv import constants
+from spconv.constants import AllocKeys
+from spconv.core import ConvAlgo, CPUConvStrategy
+from spconv.pytorch import ops
+from spconv.pytorch.conv import SparseConvolution
+from spconv.pytorch.core import (STATIC_ARENA_ALIGN, STATIC_ARENA_WORKSPACE,
+                                 ImplicitGemmIndiceData, IndiceData,
+                                 KernelMapCache, SparseConvTensor,
+                                 StaticCPUArena, _align_up)
+from spconv.pytorch.modules import SparseModule, SparseSequential
+from spconv.pytorch.pool import SparseAvgPool, SparseMaxPool
+
+
+class _PlanStep:
+    def __init__(self, src: int, dst: Optional[int], module: nn.Module,
+                 subm: bool, transposed: bool, out_padding: List[int]):
+        # kernel map of this step is generated from coordinates of level src,
+        # dst is level of output coordinates of regular conv.
+        self.src = src
+        self.dst = dst
+        self.module = module
+        self.subm = subm
+        self.transposed = transposed
+        self.out_padding = out_padding
+        self.names: List[str] = []
+        self.modules: List[nn.Module] = []
+
+
+class KernelMapPlan:
+    """kernel maps of a network, grouped by input coordinates and conv
+    params. use plan_kernel_maps to create it.
+    """
+    def __init__(self):
+        self.steps: List[_PlanStep] = []
+        self._step_dict: Dict[tuple, _PlanStep] = {}
+        self._num_levels = 1
+        # indice key of regular conv/pool -> level of its input coordinates
+        self._key_levels: Dict[str, int] = {}
+
+    @property
+    def groups(self) -> List[List[str]]:
+        """names of layers that share one kernel map."""
+        return [step.names for step in self.steps]
+
+    def _add_layer(self, name: str, mod: nn.Module,
+                   src: Optional[int]) -> Optional[int]:
+        if src is None:
+            return None
+        if isinstance(mod, SparseConvolution):
+            if mod.inverse:
+                return self._key_levels.get(mod.indice_key)
+            if mod.conv1x1:
+                return src
+            subm = mod.subm
+            transposed = mod.transposed
+            out_padding = mod.output_padding
+        else:
+            # native pool always use regular conv pairs
+            subm = mod.subm and mod.algo != ConvAlgo.Native
+            transposed = False
+            out_padding = [0] * mod.ndim
+        key = (src, mod.algo, tuple(mod.kernel_size), tuple(mod.stride),
+               tuple(mod.padding), tuple(mod.dilation), tuple(out_padding),
+               subm, transposed)
+        if key not in self._step_dict:
+            dst = None
+            if not subm:
+                dst = self._num_levels
+                self._num_levels += 1
+            step = _PlanStep(src, dst, mod, subm, transposed, out_padding)
+            self._step_dict[key] = step
+            self.steps.append(step)
+        step = self._step_dict[key]
+        step.names.append(name)
+        step.modules.append(mod)
+        if subm:
+            return src
+        if mod.indice_key is not None:
+            self._key_levels[mod.indice_key] = src
+        return step.dst
+
+    def _add_module(self, name: str, mod: nn.Module,
+                    src: Optional[int]) -> Optional[int]:
+        if isinstance(mod, (SparseConvolution, SparseMaxPool, SparseAvgPool)):
+            return self._add_layer(name, mod, src)
+        if isinstance(mod, SparseSequential):
+            for child_name, child in mod._modules.items():
+                prefix = f"{name}." if name else ""
+                src = self._add_module(prefix + child_name, child, src)
+            return src
+        if isinstance(mod, SparseModule):
+            # unknown sparse module may change coordinates.
+            return None
+        return src
+
+    def _add_graph(self, gm: torch.fx.GraphModule):
+        levels: Dict[torch.fx.Node, Optional[int]] = {}
+        for node in gm.graph.nodes:
+            src: Optional[int] = None
+            if node.op == "placeholder":
+                if not levels:
+                    src = 0
+            else:
+                arg_nodes = [a for a in node.args if isinstance(a, torch.fx.Node)]
+                srcs = [levels.get(a) for a in arg_nodes]
+                srcs = [s for s in srcs if s is not None]
+                if srcs:
+                    src = srcs[0]
+                if node.op == "call_module":
+                    mod = gm.get_submodule(node.target)
+                    src = self._add_module(node.target, mod, src)
+            levels[node] = src
+
+    def generate(self,
+                 x: SparseConvTensor,
+                 executor: Optional[Executor] = None) -> SparseConvTensor:
+        """compute all kernel maps of the plan from coordinates of x.
+        if executor is given, maps are generated by one background job in
+        plan order and this function returns immediately. layers wait for
+        their map in KernelMapCache.get, so pair generation of next layers
+        overlaps with compute of current layer.
+        Returns:
+            shadow copy of x whose kernel_map_cache contains all maps. maps of
+            subm layers with indice_key are also added to indice_dict if
+            executor isn't given.
+        """
+        res = x.shadow_copy()
+        res.indice_dict = x.indice_dict.copy()
+        if res.kernel_map_cache is None:
+            res.kernel_map_cache = KernelMapCache()
+        if executor is None:
+            self._generate_steps(res, res.indice_dict)
+            return res
+        step_futures = [Future() for _ in self.steps]
+        for f in step_futures:
+            res.kernel_map_cache.add_pending(f)
+        executor.submit(self._generate_steps, res, None, step_futures)
+        return res
+
+    def _generate_steps(self,
+                        x: SparseConvTensor,
+                        indice_dict: Optional[dict] = None,
+                        step_futures: Optional[List[Future]] = None):
+        cache = x.kernel_map_cache
+        levels: List[Optional[Tuple[torch.Tensor, List[int]]]] = [None] * self._num_levels
+        levels[0] = (x.indices, x.spatial_shape)
+        for i, step in enumerate(self.steps):
+            try:
+                data = self._run_step(x, cache, step, levels)
+            except BaseException as e:
+                if step_futures is None:
+                    raise e
+                for f in step_futures[i:]:
+                    f.set_exception(e)
+                return
+            if step_futures is not None:
+                step_futures[i].set_result(None)
+            if data is None:
+                continue
+            if step.dst is not None:
+                levels[step.dst] = (data.out_indices, data.out_spatial_shape)
+            if step.subm and indice_dict is not None:
+                for m in step.modules:
+                    if m.indice_key is not None and m.indice_key not in indice_dict:
+                        indice_dict[m.indice_key] = data
+
+    def _run_step(self, x: SparseConvTensor, cache: KernelMapCache,
+                  step: _PlanStep, levels: list):
+        mod = step.module
+        level = levels[step.src]
+        if level is None:
+            return None
+        indices, spatial_shape = level
+        # same as is_train of layer forward
+        is_train = (not step.subm) or mod.training
+        if mod.algo in (ConvAlgo.Native, ConvAlgo.OutputStationary):
+            is_train = True
+        key = cache.get_key(indices, x.batch_size, spatial_shape, mod.algo,
+                            mod.kernel_size, mod.stride, mod.padding,
+                            mod.dilation, step.out_padding, step.subm,
+                            step.transposed, is_train)
+        # don't wait for pending jobs, this may run in one of them.
+        data = cache.get(key, wait_pending=False)
+        if data is None:
+            data = self._generate_step(x, step, indices, spatial_shape,
+                                       is_train)
+            cache.put(key, data)
+        return data
+
+    def _generate_step(
+        self, x: SparseConvTensor, step: _PlanStep, indices: torch.Tensor,
+        spatial_shape: List[int], is_train: bool
+    ) -> Union[IndiceData, ImplicitGemmIndiceData]:
+        mod = step.module
+        if step.subm:
+            out_spatial_shape = spatial_shape
+        elif step.transposed:
+            out_spatial_shape = ops.get_deconv_output_size(
+                spatial_shape, mod.kernel_size, mod.stride, mod.padding,
+                mod.dilation, step.out_padding)
+        else:
+            out_spatial_shape = ops.get_conv_output_size(
+                spatial_shape, mod.kernel_size, mod.stride, mod.padding,
+                mod.dilation)
+        if mod.algo in (ConvAlgo.Native, ConvAlgo.OutputStationary):
+            outids, indice_pairs, indice_pair_num = ops.get_indice_pairs(
+                indices, x.batch_size, spatial_shape, ConvAlgo.Native,
+                mod.kernel_size, mod.stride, mod.padding, mod.dilation,
+                step.out_padding, step.subm, step.transposed)
+            return IndiceData(outids,
+                              indices,
+                              indice_pairs,
+                              indice_pair_num,
+                              spatial_shape,
+                              out_spatial_shape,
+                              is_subm=step.subm,
+                              algo=mod.algo,
+                              ksize=mod.kernel_size,
+                              stride=mod.stride,
+                              padding=mod.padding,
+                              dilation=mod.dilation,
+                              subm_half=ops.cpu_subm_pairs_are_half(
+                                  indices, step.subm))
+        res = ops.get_indice_pairs_implicit_gemm(
+            indices,
+            x.batch_size,
+            spatial_shape,
+            mod.algo,
+            ksize=mod.kernel_size,
+            stride=mod.stride,
+            padding=mod.padding,
+            dilation=mod.dilation,
+            out_padding=step.out_padding,
+            subm=step.subm,
+            transpose=step.transposed,
+            is_train=is_train,
+            alloc=x.thrust_allocator,
+            timer=x._timer)
+        return ImplicitGemmIndiceData(res[0],
+                                      indices,
+                                      res[2],
+                                      res[3],
+                                      pair_mask_fwd_splits=res[4],
+                                      pair_mask_bwd_splits=res[5],
+                                      mask_argsort_fwd_splits=res[6],
+                                      mask_argsort_bwd_splits=res[7],
+                                      masks=res[8],
+                                      is_subm=step.subm,
+                                      spatial_shape=spatial_shape,
+                                      out_spatial_shape=out_spatial_shape,
+                                      algo=mod.algo,
+                                      ksize=mod.kernel_size,
+                                      stride=mod.stride,
+                                      padding=mod.padding,
+                                      dilation=mod.dilation)
+
+
+def plan_kernel_maps(
+        model: Union[SparseSequential, torch.fx.GraphModule]) -> KernelMapPlan:
+    """walk model once and group layers whose kernel maps must be identical.
+    supports (nested) SparseSequential and fx GraphModule whose spconv
+    layers are leaf modules. layers after an unknown SparseModule
+    (e.g. tables) aren't planned, they generate their maps during forward.
+
+    Example:
+        plan = plan_kernel_maps(net)
+        out = net(plan.generate(x))
+    """
+    plan = KernelMapPlan()
+    if isinstance(model, torch.fx.GraphModule):
+        plan._add_graph(model)
+    else:
+        plan._add_module("", model, 0)
+    return plan
+
+
+class _MemBuffer:
+    def __init__(self, layer: str, name: str, nbytes: int, step: int):
+        # buffer is live from layer step start to end (inclusive).
+        self.layer = layer
+        self.name = name
+        self.nbytes = nbytes
+        self.start = step
+        self.end = step
+        self.offset = -1
+
+
+class _KeyMap:
+    def __init__(self, src: int, dst: int, num_pairs: int,
+                 buffers: List[_MemBuffer]):
+        # kernel map saved in indice_dict by a keyed layer.
+        self.src = src
+        self.dst = dst
+        self.num_pairs = num_pairs
+        self.buffers = buffers
+
+
+def _assign_offsets(buffers: List[_MemBuffer]) -> int:
+    """greedy by size: place large buffers first, every buffer at lowest
+    offset that doesn't overlap buffers live at same time.
+    """
+    placed: List[_MemBuffer] = []
+    total = 0
+    for buf in sorted(buffers, key=lambda b: (-b.nbytes, b.start)):
+        conflicts = [
+            b for b in placed if b.start <= buf.end and buf.start <= b.end
+        ]
+        conflicts.sort(key=lambda b: b.offset)
+        offset = 0
+        for b in conflicts:
+            if b.offset - offset >= buf.nbytes:
+                break
+            offset = max(offset, _align_up(b.offset + b.nbytes))
+        buf.offset = offset
+        placed.append(buf)
+        total = max(total, offset + buf.nbytes)
+    return _align_up(total)
+
+
+class StaticMemoryPlan:
+    """fixed offsets of cpu inference memory (output features, indices,
+    kernel maps and workspaces) of planned layers in one preallocated
+    arena. only tensors created by python ops are planned, see
+    plan_static_memory. use plan_static_memory to create it.
+    """
+    def __init__(self, max_num_voxels: int, dtype: torch.dtype):
+        self.max_num_voxels = max_num_voxels
+        self.dtype = dtype
+        self.csr = constants.SPCONV_CPU_CSR_KERNEL_MAP
+        self.buffers: List[_MemBuffer] = []
+        self.arena: Optional[StaticCPUArena] = None
+        self._itemsize = torch.empty([0], dtype=dtype).element_size()
+        self._num_steps = 0
+        self._level_voxels: List[int] = [max_num_voxels]
+        # output indices buffer of every level, input indices aren't planned.
+        self._level_buffers: List[Optional[_MemBuffer]] = [None]
+        self._key_maps: Dict[str, _KeyMap] = {}
+        self._prev_features: Optional[_MemBuffer] = None
+        self._layer_buffers: Dict[nn.Module, Tuple[str, Dict[str,
+                                                              _MemBuffer]]] = {}
+
+    @property
+    def nbytes(self) -> int:
+        """size of arena."""
+        assert self.arena is not None
+        return self.arena.nbytes
+
+    @property
+    def peak_nbytes(self) -> int:
+        """max total size of buffers live at one step, lower bound of
+        nbytes.
+        """
+        return max((sum(b.nbytes for b in self.buffers
+                        if b.start <= t <= b.end)
+                    for t in range(self._num_steps + 1)),
+                   default=0)
+
+    def bind(self, x: SparseConvTensor) -> SparseConvTensor:
+        """shadow copy of x whose planned layers use memory of this plan.
+        outputs of planned layers (features, indices and maps in
+        indice_dict) are views of the arena, they are valid until next
+        forward, clone what you keep.
+        """
+        if x.indices.is_cuda:
+            raise ValueError("static memory plan only supports cpu tensors")
+        if x.features.dtype != self.dtype:
+            raise ValueError(
+                f"plan is created for {self.dtype}, got {x.features.dtype}")
+        if x.indices.shape[0] > self.max_num_voxels:
+            raise ValueError(
+                f"{x.indices.shape[0]} voxels exceeds planned maximum "
+                f"{self.max_num_voxels}")
+        if x.kernel_map_cache is not None:
+            raise ValueError("kernel maps cached across forwards can't live "
+                             "in a static arena, remove kernel_map_cache")
+        res = x.shadow_copy()
+        res.cpu_arena = self.arena
+        return res
+
+    def _add_buffer(self, bufs: Dict[str, _MemBuffer], layer: str,
+                    name: str, nbytes: int) -> _MemBuffer:
+        buf = _MemBuffer(layer, name, nbytes, self._num_steps - 1)
+        self.buffers.append(buf)
+        bufs[name] = buf
+        return buf
+
+    def _use_level(self, level: int, step: int):
+        buf = self._level_buffers[level]
+        if buf is not None:
+            buf.end = max(buf.end, step)
+
+    def _num_voxels(self, name: str, mod: nn.Module) -> int:
+        num = mod.get_max_num_voxels()
+        if num is None or int(num.max().item()) <= 0:
+            raise ValueError(
+                f"layer {name} has no recorded voxel count, create it with "
+                "record_voxel_count=True and run representative frames.")
+        return int(num.max().item())
+
+    def _workspace_nbytes(self, mod: SparseConvolution, kv: int, n_in: int,
+                          n_out: int, num_pairs: int) -> int:
+        # pairs of one kernel offset never exceed number of inputs or outputs.
+        n_max = max(n_in, n_out)
+        acc_size = 8 if self.dtype == torch.float64 else 4
+        sizes = {
+            CPUConvStrategy.Unfused:
+            _align_up(n_max * mod.in_channels * self._itemsize) +
+            n_max * mod.out_channels * self._itemsize,
+            # tiles of fused gemm are allocated inside the kernel.
+            CPUConvStrategy.Fused: 0,
+            CPUConvStrategy.Grouped:
+            _align_up(n_out * kv * 4) + num_pairs * mod.out_channels * acc_size,
+            CPUConvStrategy.OutputStationary: n_out * kv * 4,
+        }
+        strategy = ops._cpu_conv_strategy(
+            mod.algo == ConvAlgo.OutputStationary)
+        if strategy is None:
+            # autotune runs every strategy.
+            return max(sizes.values()) + STATIC_ARENA_ALIGN
+        return sizes[strategy] + STATIC_ARENA_ALIGN
+
+    def _add_pairs(self, bufs: Dict[str, _MemBuffer], name: str, kv: int,
+                   n_in: int, num_pairs: int) -> List[_MemBuffer]:
+        # csr [2, total] or dense [2, kv, N] pairs and pair num [kv], int32
+        pair_size = num_pairs if self.csr else kv * n_in
+        return [
+            self._add_buffer(bufs, name, AllocKeys.PairFwd, 2 * pair_size * 4),
+            self._add_buffer(bufs, name, AllocKeys.IndiceNumPerLoc, kv * 4)
+        ]
+
+    def _add_layer(self, name: str, mod: nn.Module, src: int) -> int:
+        step = self._num_steps
+        self._num_steps += 1
+        # output features of previous layer are consumed here.
+        if self._prev_features is not None:
+            self._prev_features.end = step
+            self._prev_features = None
+        self._use_level(src, step)
+        is_conv = isinstance(mod, SparseConvolution)
+        planned = (is_conv
+                   and mod.algo in (ConvAlgo.Native, ConvAlgo.OutputStationary)
+                   and not mod.conv1x1
+                   and getattr(mod, "dense_fallback_threshold", None) is None)
+        kv = int(np.prod(mod.kernel_size))
+        n_in = self._level_voxels[src]
+        key = mod.indice_key
+        bufs: Dict[str, _MemBuffer] = {}
+        num_pairs = 0
+        if is_conv and mod.inverse:
+            key_map = self._key_maps.get(key)
+            if key_map is None:
+                raise ValueError(
+                    f"inverse conv {name} needs indice key {key} of a "
+                    "previous layer")
+            dst = key_map.src
+            num_pairs = key_map.num_pairs
+        elif is_conv and mod.conv1x1:
+            dst = src
+        elif mod.subm:
+            dst = src
+            key_map = self._key_maps.get(key) if key is not None else None
+            if key_map is not None:
+                num_pairs = key_map.num_pairs
+            else:
+                # center isn't stored in csr subm pairs.
+                num_pairs = (kv - 1) * n_in
+                pair_bufs = []
+                if planned:
+                    pair_bufs = self._add_pairs(bufs, name, kv, n_in,
+                                                num_pairs)
+                if key is not None:
+                    self._key_maps[key] = _KeyMap(src, dst, num_pairs,
+                                                  pair_bufs)
+        else:
+            dst = len(self._level_voxels)
+            n_out = self._num_voxels(name, mod)
+            self._level_voxels.append(n_out)
+            level_buf = None
+            if planned:
+                ndim = len(mod.kernel_size)
+                # dense generator writes candidates of all offsets first.
+                num_out_inds = n_out if self.csr else kv * n_in
+                level_buf = self._add_buffer(bufs, name, AllocKeys.OutIndices,
+                                             num_out_inds * (ndim + 1) * 4)
+            self._level_buffers.append(level_buf)
+            num_pairs = kv * n_in
+            pair_bufs = []
+            if planned:
+                pair_bufs = self._add_pairs(bufs, name, kv, n_in, num_pairs)
+            if key is not None:
+                self._key_maps[key] = _KeyMap(src, dst, num_pairs, pair_bufs)
+        n_out = self._level_voxels[dst]
+        self._use_level(dst, step)
+        if planned:
+            self._prev_features = self._add_buffer(
+                bufs, name, AllocKeys.OutFeatures,
+                n_out * mod.out_channels * self._itemsize)
+            self._add_buffer(
+                bufs, name, STATIC_ARENA_WORKSPACE,
+                self._workspace_nbytes(mod, kv, n_in, n_out, num_pairs))
+            self._layer_buffers[mod] = (name, bufs)
+        return dst
+
+    def _add_module(self, name: str, mod: nn.Module, src: int) -> int:
+        if isinstance(mod, (SparseConvolution, SparseMaxPool, SparseAvgPool)):
+            return self._add_layer(name, mod, src)
+        if isinstance(mod, SparseSequential):
+            for child_name, child in mod._modules.items():
+                prefix = f"{name}." if name else ""
+                src = self._add_module(prefix + child_name, child, src)
+            return src
+        if isinstance(mod, SparseModule):
+            raise ValueError(
+                f"can't analyze liveness of unknown sparse module {name}")
+        return src
+
+    def _finish(self, out_level: int):
+        # outputs of forward are valid until next forward.
+        last_step = self._num_steps
+        if self._prev_features is not None:
+            self._prev_features.end = last_step
+        for key_map in self._key_maps.values():
+            for buf in key_map.buffers:
+                buf.end = last_step
+            self._use_level(key_map.src, last_step)
+            self._use_level(key_map.dst, last_step)
+        self._use_level(out_level, last_step)
+        nbytes = _assign_offsets(self.buffers)
+        layer_slots = {
+            mod: (name, {k: (b.offset, b.nbytes)
+                         for k, b in bufs.items()})
+            for mod, (name, bufs) in self._layer_buffers.items()
+        }
+        self.arena = StaticCPUArena(nbytes, layer_slots)
+
+
+def plan_static_memory(model: SparseSequential,
+                       max_num_voxels: int,
+                       dtype: torch.dtype = torch.float32) -> StaticMemoryPlan:
+    """plan cpu inference memory of a (nested) SparseSequential for inputs
+    with at most max_num_voxels voxels. voxel counts of other coordinate
+    levels come from get_max_num_voxels of regular conv/pool layers, so
+    they must be created with record_voxel_count=True and see
+    representative frames first.
+
+    output features, output indices, kernel maps and workspaces of
+    native and output stationary conv layers (eval mode) get fixed offsets
+    in one arena allocated here. other layers (implicit gemm, pool,
+    conv1x1, dense fallback) and elementwise modules still allocate by
+    torch. plan after setting SPCONV_CPU_* flags, workspace size depends
+    on selected cpu strategy.
+
+    only memory requested by python ops (tensors passed to cpu kernels)
+    is planned. buffers private to a cpu kernel are still allocated by
+    every call: hash tables of pair generation, per-thread gemm tiles,
+    fp32 copies of reduced precision filters.
+    sorted pairs (SPCONV_CPU_PAIR_SORT_KEY) are allocated by torch too.
+
+    Example:
+        plan = plan_static_memory(net.eval(), 200000)
+        out = net(plan.bind(x))
+    """
+    plan = StaticMemoryPlan(max_num_voxels, dtype)
+    out_level = plan._add_module("", model, 0)
+    plan._finish(out_level)
+    return plan
@@ -76,7 +76,9 @@ class SparseMaxPool(SparseModule):
         if kv > 128:
             assert algo == ConvAlgo.Native, "implicit gemm don't support kv >= 32 for now"
         if CPU_ONLY_BUILD:
-            assert algo == ConvAlgo.Native, "cpu only build only support native algorithm"
+            assert algo in (ConvAlgo.Native, ConvAlgo.MaskImplicitGemm,
+                            ConvAlgo.MaskSplitImplicitGemm
+                            ), "cpu only build only support native and mask implicit gemm algorithm"
 
         self.algo = algo
 
@@ -143,11 +145,27 @@ class SparseMaxPool(SparseModule):
         if input._timer is not None and self._sparse_unique_name:
             profile_ctx = input._timer.namespace(self._sparse_unique_name)
         with profile_ctx:
-            if self.algo == ConvAlgo.Native:
-                outids, indice_pairs, indice_pairs_num = ops.get_indice_pairs(
-                    indices, batch_size, spatial_shape, ConvAlgo.Native,
+            cache = input.kernel_map_cache
+            cache_key = None
+            cached_data = None
+            if cache is not None:
+                # native pool always use regular conv pairs
+                subm = self.subm and self.algo != ConvAlgo.Native
+                cache_key = cache.get_key(
+                    indices, batch_size, spatial_shape, self.algo,
                     self.kernel_size, self.stride, self.padding, self.dilation,
-                    out_padding, False)
+                    out_padding, subm, False, (not subm) or self.training)
+                cached_data = cache.get(cache_key)
+            if self.algo == ConvAlgo.Native:
+                if cached_data is not None:
+                    outids = cached_data.out_indices
+                    indice_pairs = cached_data.indice_pairs
+                    indice_pairs_num = cached_data.indice_pair_num
+                else:
+                    outids, indice_pairs, indice_pairs_num = ops.get_indice_pairs(
+                        indices, batch_size, spatial_shape, ConvAlgo.Native,
+                        self.kernel_size, self.stride, self.padding,
+                        self.dilation, out_padding, False)
                 if input.benchmark:
                     torch.cuda.synchronize()
                     interval = time.time() - t
@@ -155,21 +173,25 @@ class SparseMaxPool(SparseModule):
                         self.name]["indice_gen_time"].append(interval)
                     t = time.time()
 
+                indice_data = cached_data
+                if indice_data is None:
+                    indice_data = IndiceData(outids,
+                                             indices,
+                                             indice_pairs,
+                                             indice_pairs_num,
+                                             spatial_shape,
+                                             out_spatial_shape,
+                                             is_subm=False,
+                                             algo=self.algo,
+                                             ksize=self.kernel_size,
+                                             stride=self.stride,
+                                             padding=self.padding,
+                                             dilation=self.dilation)
+                    if cache_key is not None:
+                        cache.put(cache_key, indice_data)
                 if self.indice_key is not None:
                     datas = input.find_indice_pair(self.indice_key)
                     if datas is None:
-                        indice_data = IndiceData(outids,
-                                                 indices,
-                                                 indice_pairs,
-                                                 indice_pairs_num,
-                                                 spatial_shape,
-                                                 out_spatial_shape,
-                                                 is_subm=False,
-                                                 algo=self.algo,
-                                                 ksize=self.kernel_size,
-                                                 stride=self.stride,
-                                                 padding=self.padding,
-                                                 dilation=self.dilation)
                         indice_dict[self.indice_key] = indice_data
                     else:
                         raise ValueError(
@@ -180,31 +202,36 @@ class SparseMaxPool(SparseModule):
                                                   indice_pairs_num.to(device),
                                                   outids.shape[0])
             else:
-                with input._timer.namespace("gen_pairs"):
-                    res = ops.get_indice_pairs_implicit_gemm(
-                        indices,
-                        batch_size,
-                        spatial_shape,
-                        self.algo,
-                        ksize=self.kernel_size,
-                        stride=self.stride,
-                        padding=self.padding,
-                        dilation=self.dilation,
-                        out_padding=out_padding,
-                        subm=self.subm,
-                        is_train=(not self.subm) or self.training,
-                        alloc=input.thrust_allocator,
-                        timer=input._timer)
-                outids = res[0]
-                num_inds_per_loc = res[1]
-                pair_fwd = res[2]
-                pair_bwd = res[3]
-                pair_mask_fwd_splits = res[4]
-                pair_mask_bwd_splits = res[5]
-                mask_argsort_fwd_splits = res[6]
-                mask_argsort_bwd_splits = res[7]
-                masks = res[8]
-                if self.indice_key is not None:
+                if cached_data is not None:
+                    indice_data = cached_data
+                    outids = indice_data.out_indices
+                    pair_fwd = indice_data.pair_fwd
+                    pair_bwd = indice_data.pair_bwd
+                else:
+                    with input._timer.namespace("gen_pairs"):
+                        res = ops.get_indice_pairs_implicit_gemm(
+                            indices,
+                            batch_size,
+                            spatial_shape,
+                            self.algo,
+                            ksize=self.kernel_size,
+                            stride=self.stride,
+                            padding=self.padding,
+                            dilation=self.dilation,
+                            out_padding=out_padding,
+                            subm=self.subm,
+                            is_train=(not self.subm) or self.training,
+                            alloc=input.thrust_allocator,
+                            timer=input._timer)
+                    outids = res[0]
+                    num_inds_per_loc = res[1]
+                    pair_fwd = res[2]
+                    pair_bwd = res[3]
+                    pair_mask_fwd_splits = res[4]
+                    pair_mask_bwd_splits = res[5]
+                    mask_argsort_fwd_splits = res[6]
+                    mask_argsort_bwd_splits = res[7]
+                    masks = res[8]
                     indice_data = ImplicitGemmIndiceData(
                         outids,
                         indices,
@@ -223,6 +250,9 @@ class SparseMaxPool(SparseModule):
                         stride=self.stride,
                         padding=self.padding,
                         dilation=self.dilation)
+                    if cache_key is not None:
+                        cache.put(cache_key, indice_data)
+                if self.indice_key is not None:
                     msg = f"your indice key {self.indice_key} already exists in this sparse tensor."
                     assert self.indice_key not in indice_dict, msg
                     indice_dict[self.indice_key] = indice_data
@@ -358,31 +388,46 @@ class SparseAvgPool(SparseModule):
         if input._timer is not None and self._sparse_unique_name:
             profile_ctx = input._timer.namespace(self._sparse_unique_name)
         with profile_ctx:
-            with input._timer.namespace("gen_pairs"):
-                res = ops.get_indice_pairs_implicit_gemm(
-                    indices,
-                    batch_size,
-                    spatial_shape,
-                    self.algo,
-                    ksize=self.kernel_size,
-                    stride=self.stride,
-                    padding=self.padding,
-                    dilation=self.dilation,
-                    out_padding=out_padding,
-                    subm=self.subm,
-                    is_train=(not self.subm) or self.training,
-                    alloc=input.thrust_allocator,
-                    timer=input._timer)
-            outids = res[0]
-            num_inds_per_loc = res[1]
-            pair_fwd = res[2]
-            pair_bwd = res[3]
-            pair_mask_fwd_splits = res[4]
-            pair_mask_bwd_splits = res[5]
-            mask_argsort_fwd_splits = res[6]
-            mask_argsort_bwd_splits = res[7]
-            masks = res[8]
-            if self.indice_key is not None:
+            cache = input.kernel_map_cache
+            cache_key = None
+            cached_data = None
+            if cache is not None:
+                cache_key = cache.get_key(
+                    indices, batch_size, spatial_shape, self.algo,
+                    self.kernel_size, self.stride, self.padding, self.dilation,
+                    out_padding, self.subm, False, (not self.subm)
+                    or self.training)
+                cached_data = cache.get(cache_key)
+            if cached_data is not None:
+                indice_data = cached_data
+                outids = indice_data.out_indices
+                pair_fwd = indice_data.pair_fwd
+                pair_bwd = indice_data.pair_bwd
+            else:
+                with input._timer.namespace("gen_pairs"):
+                    res = ops.get_indice_pairs_implicit_gemm(
+                        indices,
+                        batch_size,
+                        spatial_shape,
+                        self.algo,
+                        ksize=self.kernel_size,
+                        stride=self.stride,
+                        padding=self.padding,
+                        dilation=self.dilation,
+                        out_padding=out_padding,
+                        subm=self.subm,
+                        is_train=(not self.subm) or self.training,
+                        alloc=input.thrust_allocator,
+                        timer=input._timer)
+                outids = res[0]
+                num_inds_per_loc = res[1]
+                pair_fwd = res[2]
+                pair_bwd = res[3]
+                pair_mask_fwd_splits = res[4]
+                pair_mask_bwd_splits = res[5]
+                mask_argsort_fwd_splits = res[6]
+                mask_argsort_bwd_splits = res[7]
+                masks = res[8]
                 indice_data = ImplicitGemmIndiceData(
                     outids,
                     indices,
@@ -401,6 +446,9 @@ class SparseAvgPool(SparseModule):
                     stride=self.stride,
                     padding=self.padding,
                     dilation=self.dilation)
+                if cache_key is not None:
+                    cache.put(cache_key, indice_data)
+            if self.indice_key is not None:
                 msg = f"your indice key {self.indice_key} already exists in this sparse tensor."
                 assert self.indice_key not in indice_dict, msg
                 indice_dict[self.indice_key] = indice_data
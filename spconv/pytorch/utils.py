@@ -12,7 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import List, Union
+from typing import List, Optional, Union
 import torch
 from cumm import tensorview as tv
 
@@ -20,6 +20,84 @@ from spconv.core_cc.csrc.sparse.all import SpconvOps
 from spconv.pytorch.cppcore import torch_tensor_to_tv, get_current_stream
 
 
+def _curve_bits(spatial_shape: List[int]) -> int:
+    bits = 1
+    while (1 << bits) < max(spatial_shape):
+        bits += 1
+    return bits
+
+
+def _interleave_bits(coords: List[torch.Tensor], bits: int) -> torch.Tensor:
+    """interleave bits of coords, highest bit of coords[0] goes first.
+    """
+    code = torch.zeros_like(coords[0])
+    for bit in range(bits - 1, -1, -1):
+        for c in coords:
+            code = (code << 1) | ((c >> bit) & 1)
+    return code
+
+
+def _hilbert_transpose(coords: List[torch.Tensor],
+                       bits: int) -> List[torch.Tensor]:
+    """convert coords to transposed hilbert index (Skilling, 2004).
+    """
+    x = [c.clone() for c in coords]
+    n = len(x)
+    q = 1 << (bits - 1)
+    while q > 1:
+        p = q - 1
+        for i in range(n):
+            flip = (x[i] & q) != 0
+            t = (x[0] ^ x[i]) & p
+            x[0] = torch.where(flip, x[0] ^ p, x[0] ^ t)
+            if i != 0:
+                x[i] = torch.where(flip, x[i], x[i] ^ t)
+        q >>= 1
+    for i in range(1, n):
+        x[i] = x[i] ^ x[i - 1]
+    t = torch.zeros_like(x[0])
+    q = 1 << (bits - 1)
+    while q > 1:
+        t = torch.where((x[n - 1] & q) != 0, t ^ (q - 1), t)
+        q >>= 1
+    return [c ^ t for c in x]
+
+
+def space_filling_curve_code(indices: torch.Tensor,
+                             spatial_shape: List[int],
+                             curve: str = "morton") -> torch.Tensor:
+    """get int64 code of [N, ndim + 1] indices (batch index in indices[:, 0]).
+    sort by code visits voxels of each batch along the space-filling curve.
+    Args:
+        indices: [N, ndim + 1] indices.
+        spatial_shape: spatial shape of indices.
+        curve: "morton" (z-order) or "hilbert". hilbert curve has better
+            locality, morton curve is faster to compute.
+    """
+    ndim = indices.shape[1] - 1
+    assert len(spatial_shape) == ndim
+    bits = _curve_bits(spatial_shape)
+    assert bits * ndim <= 48, "spatial shape too large for space-filling curve"
+    indices_i64 = indices.long()
+    coords = [indices_i64[:, i + 1] for i in range(ndim)]
+    if curve == "morton":
+        code = _interleave_bits(coords, bits)
+    elif curve == "hilbert":
+        code = _interleave_bits(_hilbert_transpose(coords, bits), bits)
+    else:
+        raise ValueError(f"unknown curve {curve}, available: morton, hilbert")
+    return (indices_i64[:, 0] << (bits * ndim)) | code
+
+
+def space_filling_curve_argsort(indices: torch.Tensor,
+                                spatial_shape: List[int],
+                                curve: str = "morton") -> torch.Tensor:
+    """get permutation that sorts indices along space-filling curve.
+    """
+    code = space_filling_curve_code(indices, spatial_shape, curve)
+    return torch.argsort(code)
+
+
 class PointToVoxel(object):
     """WARNING: you MUST construct PointToVoxel AFTER set device.
     """
@@ -29,8 +107,16 @@ class PointToVoxel(object):
                  num_point_features: int,
                  max_num_voxels: int,
                  max_num_points_per_voxel: int,
-                 device: torch.device = torch.device("cpu:0")):
+                 device: torch.device = torch.device("cpu:0"),
+                 reorder_curve: Optional[str] = None):
+        """
+        Args:
+            reorder_curve: if not None, voxels are sorted along this
+                space-filling curve ("morton" or "hilbert"), see
+                space_filling_curve_code.
+        """
         self.ndim = len(vsize_xyz)
+        self.reorder_curve = reorder_curve
 
         self.device = device
         vsize, grid_size, grid_stride, coors_range = SpconvOps.calc_point2voxel_meta_data(
@@ -153,8 +239,25 @@ class PointToVoxel(object):
                                                 clear_voxels)
                 num_voxels = res[0].shape[0]
 
-            return (self.voxels[:num_voxels].clone(), self.indices[:num_voxels].clone(),
-                    self.num_per_voxel[:num_voxels].clone(), pc_voxel_id)
+            voxels = self.voxels[:num_voxels].clone()
+            indices = self.indices[:num_voxels].clone()
+            num_per_voxel = self.num_per_voxel[:num_voxels].clone()
+            if self.reorder_curve is not None:
+                indices_with_batch = torch.nn.functional.pad(indices, (1, 0))
+                perm = space_filling_curve_argsort(indices_with_batch,
+                                                   list(self.grid_size[::-1]),
+                                                   self.reorder_curve)
+                voxels = voxels[perm]
+                indices = indices[perm]
+                num_per_voxel = num_per_voxel[perm]
+                perm_inv = torch.empty_like(perm)
+                perm_inv[perm] = torch.arange(perm.shape[0],
+                                              dtype=perm.dtype,
+                                              device=perm.device)
+                pc_voxel_id_valid = pc_voxel_id != -1
+                pc_voxel_id[pc_voxel_id_valid] = perm_inv[
+                    pc_voxel_id[pc_voxel_id_valid]]
+            return (voxels, indices, num_per_voxel, pc_voxel_id)
 
 
 def gather_features_by_pc_voxel_id(seg_res_features: torch.Tensor, pc_voxel_id: torch.Tensor, invalid_value: Union[int, float] = 0):
@@ -0,0 +1,65 @@
+# Copyright 2021 Yan Yan
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""benchmark cpu native conv with different pair sort keys.
+"""
+
+import time
+
+import torch
+
+from spconv import constants
+from spconv.core import ConvAlgo
+from spconv.pytorch import ops
+from benchmark_cpu_hash import waymo_indices
+
+
+def bench_conv(indices: torch.Tensor, spatial_shape, channels: int,
+               subm: bool, times: int = 5):
+    ksize = [3] * 3
+    stride = [1 if subm else 2] * 3
+    features = torch.randn(indices.shape[0], channels)
+    weight = torch.randn(channels, *ksize, channels)
+    res = {}
+    out_ref = None
+    for key in ["", "in", "out"]:
+        constants.SPCONV_CPU_PAIR_SORT_KEY = key
+        out_inds, pair, pair_num = ops.get_indice_pairs(
+            indices, 1, spatial_shape, ConvAlgo.Native, ksize, stride,
+            [1] * 3, [1] * 3, [0] * 3, subm)
+        run = lambda: ops.indice_conv(features, weight, pair, pair_num,
+                                      out_inds.shape[0], subm=subm)
+        out = run()
+        if out_ref is None:
+            out_ref = out
+        else:
+            assert torch.allclose(out, out_ref, atol=1e-3)
+        t = time.time()
+        for _ in range(times):
+            run()
+        res[key if key else "none"] = (time.time() - t) / times * 1000
+    constants.SPCONV_CPU_PAIR_SORT_KEY = ""
+    return res
+
+
+def main():
+    indices, spatial_shape = waymo_indices(0.1)
+    for subm in [True, False]:
+        for channels in [16, 64]:
+            res = bench_conv(indices, spatial_shape, channels, subm)
+            msg = ", ".join(f"{k}: {v:.2f}ms" for k, v in res.items())
+            print(f"N={indices.shape[0]}, subm={subm}, C={channels}: {msg}")
+
+
+if __name__ == "__main__":
+    main()
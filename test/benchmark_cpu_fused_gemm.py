@@ -0,0 +1,74 @@
+# Copyright 2021 Yan Yan
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""benchmark cpu native indice conv (forward and backward) with fused
+gather-gemm-scatter kernel (SPCONV_CPU_FUSED_GEMM) against gather, torch.mm
+and scatter add per kernel offset, grouped fused kernel
+(SPCONV_CPU_GROUPED_GEMM) and output stationary algorithm.
+"""
+
+import time
+
+import numpy as np
+import torch
+
+from spconv import constants
+from spconv.core import ConvAlgo
+from spconv.pytorch import ops
+from spconv.test_utils import generate_sparse_data
+
+
+def timeit(fn, times: int = 5):
+    fn()
+    t = time.time()
+    for _ in range(times):
+        fn()
+    return (time.time() - t) / times * 1000
+
+
+def main():
+    shape = [120, 120, 40]
+    np.random.seed(484)
+    sparse_dict = generate_sparse_data(shape, [100000], 4)
+    indices = torch.from_numpy(
+        np.ascontiguousarray(sparse_dict["indices"][:, [3, 0, 1, 2]]).astype(
+            np.int32))
+    for subm, s in [(True, 1), (False, 2)]:
+        outids, pairs, pair_num = ops.get_indice_pairs(
+            indices, 1, shape, ConvAlgo.Native, [3] * 3, [s] * 3, [1] * 3,
+            [1] * 3, [0] * 3, subm)
+        num_out = outids.shape[0]
+        for C in [16, 32, 64]:
+            features = torch.randn(indices.shape[0], C)
+            filters = torch.randn(C, 3, 3, 3, C)
+            out_bp = torch.randn(num_out, C)
+            for name, algo, fused, grouped in [
+                ("unfused", ConvAlgo.Native, False, False),
+                ("fused", ConvAlgo.Native, True, False),
+                ("grouped", ConvAlgo.Native, True, True),
+                ("output_stationary", ConvAlgo.OutputStationary, True, False),
+            ]:
+                constants.SPCONV_CPU_FUSED_GEMM = fused
+                constants.SPCONV_CPU_GROUPED_GEMM = grouped
+                t_fwd = timeit(lambda: ops.indice_conv(
+                    features, filters, pairs, pair_num, num_out, False, subm,
+                    algo))
+                t_bwd = timeit(lambda: ops.indice_conv_backward(
+                    features, filters, out_bp, pairs, pair_num, False, subm,
+                    algo))
+                print(f"subm={subm} C={C} {name}: "
+                      f"fwd {t_fwd:.2f}ms, bwd {t_bwd:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# Copyright 2021 Yan Yan
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""compare hash tables of cpu subm indice generator.
+"""
+
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+from cumm import tensorview as tv
+
+from spconv.core import ConvAlgo, CPUHashType
+from spconv.pytorch import ops
+from spconv.utils import Point2VoxelCPU3d
+
+
+def waymo_indices(vsize: float = 0.1):
+    gen = Point2VoxelCPU3d([vsize, vsize, vsize], [-80, -80, -2, 80, 80, 6],
+                           3, 400000, 1)
+    data = np.load(Path(__file__).parent / "data" / "benchmark-pc.npz")
+    pc = np.ascontiguousarray(data["pc"])
+    _, indices_tv, _ = gen.point_to_voxel(tv.from_numpy(pc))
+    coors = indices_tv.numpy()
+    N = coors.shape[0]
+    coors = np.concatenate([np.full([N, 1], 0, coors.dtype), coors], axis=1)
+    return torch.from_numpy(coors), list(gen.grid_size)
+
+
+def bench_hash(indices: torch.Tensor, spatial_shape, ksize: int, times: int = 10):
+    ksizes = [ksize] * 3
+    res = {}
+    pair_ref = None
+    for hash_type in CPUHashType:
+        run = lambda: ops.get_indice_pairs(indices, 1, spatial_shape,
+                                           ConvAlgo.Native, ksizes, [1] * 3,
+                                           [0] * 3, [1] * 3, [0] * 3, True,
+                                           cpu_hash_type=hash_type)
+        _, pair, _ = run()
+        if pair_ref is None:
+            pair_ref = pair
+        else:
+            assert torch.equal(pair, pair_ref)
+        t = time.time()
+        for _ in range(times):
+            run()
+        res[hash_type.name] = (time.time() - t) / times * 1000
+    return res
+
+
+def main():
+    for vsize in [0.1, 0.2, 0.4]:
+        indices, spatial_shape = waymo_indices(vsize)
+        volume = int(np.prod(spatial_shape))
+        for ksize in [3, 5]:
+            res = bench_hash(indices, spatial_shape, ksize)
+            msg = ", ".join(f"{k}: {v:.2f}ms" for k, v in res.items())
+            print(f"N={indices.shape[0]}, volume={volume}, k={ksize}: {msg}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# Copyright 2021 Yan Yan
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""benchmark cpu inference latency with kernel maps generated on a
+background thread (SparseSequential.enable_kernel_map_pipeline).
+"""
+
+import time
+
+import numpy as np
+import torch
+
+import spconv.pytorch as spconv
+from spconv.core import ConvAlgo
+from spconv.test_utils import generate_sparse_data
+
+
+def backbone(algo: ConvAlgo):
+    layers = []
+    channels = [16, 32, 64, 64]
+    prev = 4
+    for i, c in enumerate(channels):
+        if i > 0:
+            layers.append(
+                spconv.SparseConv3d(prev, c, 3, 2, padding=1, bias=False,
+                                    algo=algo))
+            layers.append(torch.nn.ReLU())
+        layers.append(
+            spconv.SubMConv3d(c if i > 0 else prev, c, 3, bias=False,
+                              indice_key=f"subm{i}", algo=algo))
+        layers.append(torch.nn.ReLU())
+        layers.append(
+            spconv.SubMConv3d(c, c, 3, bias=False, indice_key=f"subm{i}",
+                              algo=algo))
+        layers.append(torch.nn.ReLU())
+        prev = c
+    return spconv.SparseSequential(*layers).eval()
+
+
+def bench(net, x, times: int = 5):
+    with torch.no_grad():
+        net(x)
+        t = time.time()
+        for _ in range(times):
+            net(x)
+    return (time.time() - t) / times * 1000
+
+
+def main():
+    shape = [400, 400, 40]
+    np.random.seed(484)
+    sparse_dict = generate_sparse_data(shape, [100000], 4)
+    features = torch.from_numpy(
+        np.ascontiguousarray(sparse_dict["features"]).astype(np.float32))
+    indices = torch.from_numpy(
+        np.ascontiguousarray(sparse_dict["indices"][:, [3, 0, 1, 2]]).astype(
+            np.int32))
+    x = spconv.SparseConvTensor(features, indices, shape, 1)
+    for algo in [ConvAlgo.Native, ConvAlgo.MaskImplicitGemm]:
+        net = backbone(algo)
+        t_serial = bench(net, x)
+        net.enable_kernel_map_pipeline()
+        t_pipeline = bench(net, x)
+        print(f"{algo.name}: serial {t_serial:.2f}ms, "
+              f"pipeline {t_pipeline:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# Copyright 2021 Yan Yan
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""benchmark cpu inference throughput of model replicas running in python
+threads. cpu ops release the GIL, so throughput should scale with thread
+count until cores are saturated.
+"""
+
+import copy
+import threading
+import time
+
+import numpy as np
+import torch
+
+import spconv.pytorch as spconv
+from spconv.core import ConvAlgo
+from benchmark_cpu_pipeline import backbone
+from spconv.test_utils import generate_sparse_data
+
+
+def throughput(nets, inputs, frames_per_thread: int):
+    def run(net, x):
+        with torch.no_grad():
+            for _ in range(frames_per_thread):
+                net(x)
+
+    threads = [
+        threading.Thread(target=run, args=(net, x))
+        for net, x in zip(nets, inputs)
+    ]
+    t = time.time()
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    return len(threads) * frames_per_thread / (time.time() - t)
+
+
+def main():
+    shape = [400, 400, 40]
+    np.random.seed(484)
+    sparse_dict = generate_sparse_data(shape, [50000], 4)
+    features = torch.from_numpy(
+        np.ascontiguousarray(sparse_dict["features"]).astype(np.float32))
+    indices = torch.from_numpy(
+        np.ascontiguousarray(sparse_dict["indices"][:, [3, 0, 1, 2]]).astype(
+            np.int32))
+    # each replica uses one intra-op thread, so scaling comes from
+    # python threads only.
+    torch.set_num_threads(1)
+    net = backbone(ConvAlgo.Native)
+    for num_threads in [1, 2, 4, 8]:
+        nets = [copy.deepcopy(net) for _ in range(num_threads)]
+        inputs = [
+            spconv.SparseConvTensor(features, indices, shape, 1)
+            for _ in range(num_threads)
+        ]
+        fps = throughput(nets, inputs, 3)
+        print(f"threads={num_threads}: {fps:.2f} frames/s")
+
+
+if __name__ == "__main__":
+    main()
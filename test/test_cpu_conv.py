@@ -0,0 +1,850 @@
+# Copyright 2021 Yan Yan
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compare cpu algorithms with cpu native algorithm.
+"""
+
+import contextlib
+import copy
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+import torch
+from cumm import tensorview as tv
+
+import spconv.pytorch as spconv
+from spconv import constants
+from spconv.core import ConvAlgo, CPUConvStrategy, CPUHashType
+from spconv.core_cc.csrc.sparse.all import SpconvOps
+from spconv.pytorch.cppcore import torch_tensor_to_tv
+from spconv.pytorch.cpu_tuner import CPU_TUNER, CPUConvTuner
+from spconv.pytorch.utils import PointToVoxel, space_filling_curve_code
+from spconv.test_utils import TestCase, generate_sparse_data, params_grid
+
+
+def _sparse_input(shape, num_points, num_channels, seed=484):
+    np.random.seed(seed)
+    sparse_dict = generate_sparse_data(shape, num_points, num_channels)
+    features = np.ascontiguousarray(sparse_dict["features"]).astype(
+        np.float32)
+    indices = np.ascontiguousarray(
+        sparse_dict["indices"][:, [3, 0, 1, 2]]).astype(np.int32)
+    return torch.from_numpy(features), torch.from_numpy(indices)
+
+
+def _run_net(net, features, indices, shape, batch_size):
+    features = features.clone().requires_grad_(True)
+    x = spconv.SparseConvTensor(features, indices, shape, batch_size)
+    out = net(x)
+    dout = torch.from_numpy(
+        np.random.RandomState(5).uniform(-1, 1, out.features.shape)).to(
+            out.features.dtype)
+    out.features.backward(dout)
+    weight_grads = [m.weight.grad for m in net.modules() if hasattr(m, "weight")]
+    return out.dense(), features.grad, weight_grads
+
+
+def _make_net(algo, IC, OC, k, s, seed=48848):
+    torch.manual_seed(seed)
+    return spconv.SparseSequential(
+        spconv.SubMConv3d(IC, OC, k, bias=False, indice_key="subm0", algo=algo),
+        spconv.SparseConv3d(OC, OC, k, s, padding=1, bias=False,
+                            indice_key="down0", algo=algo),
+        spconv.SubMConv3d(OC, OC, k, bias=False, algo=algo),
+        spconv.SparseInverseConv3d(OC, OC, k, indice_key="down0", bias=False,
+                                   algo=algo),
+    )
+
+
+@contextlib.contextmanager
+def _cpu_flags(flags):
+    prev = {name: getattr(constants, name) for name in flags}
+    for name, value in flags.items():
+        setattr(constants, name, value)
+    try:
+        yield
+    finally:
+        for name, value in prev.items():
+            setattr(constants, name, value)
+
+
+def _run_net_with_flags(flags, features, indices, shape, bs, k=3, s=2,
+                        algo=ConvAlgo.Native):
+    with _cpu_flags(flags):
+        return _run_net(_make_net(algo, 8, 16, k, s), features, indices,
+                        shape, bs)
+
+
+def _assert_net_close(test_case, res, res_ref):
+    out, din, dw = res
+    out_ref, din_ref, dw_ref = res_ref
+    test_case.assertAllClose(out.detach().numpy(), out_ref.detach().numpy(),
+                             atol=1e-4)
+    test_case.assertAllClose(din.numpy(), din_ref.numpy(), atol=1e-4)
+    for g, g_ref in zip(dw, dw_ref):
+        test_case.assertAllClose(g.numpy(), g_ref.numpy(), atol=1e-3)
+
+
+def test_cpu_implicit_gemm():
+    test_case = TestCase()
+    shape = [19, 18, 17]
+    algos = [
+        ConvAlgo.MaskImplicitGemm, ConvAlgo.MaskSplitImplicitGemm,
+        ConvAlgo.OutputStationary
+    ]
+    for bs, k, s, algo in params_grid([1, 2], [3], [1, 2], algos):
+        features, indices = _sparse_input(shape, [1000] * bs, 8)
+        res_ref = _run_net_with_flags({}, features, indices, shape, bs, k, s)
+        res = _run_net_with_flags({}, features, indices, shape, bs, k, s,
+                                  algo)
+        _assert_net_close(test_case, res, res_ref)
+
+
+def test_cpu_reduced_precision():
+    test_case = TestCase()
+    shape = [19, 18, 17]
+    features, indices = _sparse_input(shape, [1000] * 2, 8)
+    # fp16 use fused kernels with fp32 accumulation, bf16 use torch mm.
+    for algo, dtype in params_grid([ConvAlgo.Native, ConvAlgo.OutputStationary],
+                                   [torch.float16, torch.bfloat16]):
+        ref = _run_net(_make_net(algo, 8, 16, 3, 2), features, indices,
+                       shape, 2)
+        res = _run_net(_make_net(algo, 8, 16, 3, 2).to(dtype),
+                       features.to(dtype), indices, shape, 2)
+        rtol = 5e-3 if dtype == torch.float16 else 3e-2
+        for a, a_ref in zip([res[0], res[1], *res[2]],
+                            [ref[0], ref[1], *ref[2]]):
+            a_ref = a_ref.detach().numpy()
+            test_case.assertAllClose(a.detach().float().numpy(), a_ref,
+                                     atol=rtol * np.abs(a_ref).max())
+
+
+def test_cpu_inference_epilogue():
+    test_case = TestCase()
+    shape = [19, 18, 17]
+    features, indices = _sparse_input(shape, [1000] * 2, 8)
+    x = spconv.SparseConvTensor(features, indices, shape, 2)
+    acts = {
+        tv.gemm.Activation.ReLU: torch.relu,
+        tv.gemm.Activation.LeakyReLU:
+        lambda t: torch.nn.functional.leaky_relu(t, 0.1),
+        tv.gemm.Activation.Sigmoid: torch.sigmoid,
+    }
+    # (algo, fused, grouped)
+    variants = [(ConvAlgo.Native, True, False), (ConvAlgo.Native, True, True),
+                (ConvAlgo.Native, False, False),
+                (ConvAlgo.OutputStationary, True, False)]
+    for (algo, fused, grouped), subm, act in params_grid(
+            variants, [True, False], list(acts.keys())):
+        conv_cls = spconv.SubMConv3d if subm else spconv.SparseConv3d
+        torch.manual_seed(48848)
+        conv = conv_cls(8, 16, 3, padding=1, algo=algo).eval()
+        conv.act_type = act
+        conv.act_alpha = 0.1
+        conv_ref = conv_cls(8, 16, 3, padding=1, bias=False, algo=algo).eval()
+        conv_ref.weight.data.copy_(conv.weight.data)
+        flags = {
+            "SPCONV_CPU_FUSED_GEMM": fused,
+            "SPCONV_CPU_GROUPED_GEMM": grouped
+        }
+        with _cpu_flags(flags), torch.no_grad():
+            out_ref = conv_ref(x)
+            add = out_ref.replace_feature(torch.randn(out_ref.features.shape))
+            out = conv(x)
+            out_add = conv(x, add)
+        res = out_ref.features + conv.bias.detach()
+        test_case.assertAllClose(out.features.numpy(),
+                                 acts[act](res).numpy(), atol=1e-4)
+        test_case.assertAllClose(out_add.features.numpy(),
+                                 acts[act](res + add.features).numpy(),
+                                 atol=1e-4)
+
+
+def test_cpu_packed_weight_cache():
+    test_case = TestCase()
+    shape = [19, 18, 17]
+    features, indices = _sparse_input(shape, [1000] * 2, 8)
+    x = spconv.SparseConvTensor(features, indices, shape, 2)
+    for subm in [True, False]:
+        conv_cls = spconv.SubMConv3d if subm else spconv.SparseConv3d
+        torch.manual_seed(48848)
+        conv = conv_cls(8, 16, 3, padding=1, algo=ConvAlgo.Native).eval()
+        with torch.no_grad():
+            packed = conv._packed_weight_cpu(conv.weight)
+            # packed weights are reused while weight is unchanged.
+            assert conv._packed_weight_cpu(conv.weight) is packed
+            out = conv(x)
+            conv.train()
+            out_ref = conv(x)
+            conv.eval()
+        test_case.assertAllClose(out.features.numpy(),
+                                 out_ref.features.numpy(), atol=1e-4)
+        # packed weights cached in eval mode are refreshed after weight
+        # update.
+        with torch.no_grad():
+            conv.weight.mul_(2)
+            assert conv._packed_weight_cpu(conv.weight) is not packed
+            out = conv(x)
+        test_case.assertAllClose(
+            out.features.numpy(),
+            (out_ref.features * 2 - conv.bias.detach()).numpy(),
+            atol=1e-4)
+
+
+def test_cpu_arena_allocator():
+    test_case = TestCase()
+    shape = [19, 18, 17]
+    features, indices = _sparse_input(shape, [1000] * 2, 8)
+    x = spconv.SparseConvTensor(features, indices, shape, 2)
+    arena = spconv.CPUArenaAllocator()
+    x_arena = spconv.SparseConvTensor(features, indices, shape, 2,
+                                      cpu_arena=arena)
+    # (algo, fused, grouped)
+    variants = [(ConvAlgo.Native, True, False), (ConvAlgo.Native, True, True),
+                (ConvAlgo.Native, False, False),
+                (ConvAlgo.OutputStationary, True, False)]
+    for (algo, fused, grouped), subm in params_grid(variants, [True, False]):
+        conv_cls = spconv.SubMConv3d if subm else spconv.SparseConv3d
+        torch.manual_seed(48848)
+        conv = conv_cls(8, 16, 3, padding=1, algo=algo).eval()
+        flags = {
+            "SPCONV_CPU_FUSED_GEMM": fused,
+            "SPCONV_CPU_GROUPED_GEMM": grouped
+        }
+        with _cpu_flags(flags), torch.no_grad():
+            out = conv(x)
+            # second run reuses workspaces freed by first one.
+            out_arena = [conv(x_arena) for i in range(2)]
+        for res in out_arena:
+            test_case.assertAllEqual(res.features.numpy(),
+                                     out.features.numpy())
+    # workspaces are returned to arena and reused by later layers.
+    assert arena.nbytes_in_use == 0
+    assert arena.hits > 0 and arena.nbytes_reserved > 0
+
+
+def test_cpu_dense_fallback():
+    test_case = TestCase()
+    shape = [10, 9, 8]
+    features, indices = _sparse_input(shape, [360] * 2, 8)
+    x = spconv.SparseConvTensor(features, indices, shape, 2)
+    assert indices.shape[0] / (2 * np.prod(shape)) > 0.4
+
+    def make_keyless_net():
+        torch.manual_seed(48848)
+        return spconv.SparseSequential(
+            spconv.SubMConv3d(8, 16, 3, bias=False, algo=ConvAlgo.Native),
+            spconv.SparseConv3d(16, 16, 3, 2, padding=1, bias=False,
+                                algo=ConvAlgo.Native),
+            spconv.SparseConv3d(16, 16, 2, 2, bias=False,
+                                algo=ConvAlgo.Native),
+        )
+
+    # regular conv with indice_key and inverse conv of _make_net stay sparse.
+    for make_net in [make_keyless_net,
+                     lambda: _make_net(ConvAlgo.Native, 8, 16, 3, 2)]:
+        res_ref = _run_net(make_net(), features, indices, shape, 2)
+        net = make_net()
+        net.enable_dense_fallback(threshold=0.0)
+        res = _run_net(net, features, indices, shape, 2)
+        _assert_net_close(test_case, res, res_ref)
+    # inference with bias, act and add_input.
+    for subm in [True, False]:
+        conv_cls = spconv.SubMConv3d if subm else spconv.SparseConv3d
+        conv = conv_cls(8, 16, 3, padding=1, algo=ConvAlgo.Native).eval()
+        conv.act_type = tv.gemm.Activation.LeakyReLU
+        conv.act_alpha = 0.1
+        with torch.no_grad():
+            out_ref = conv(x)
+            add = out_ref.replace_feature(torch.randn(out_ref.features.shape))
+            out_add_ref = conv(x, add)
+            conv.enable_dense_fallback(threshold=0.4)
+            assert conv._use_dense_fallback(x, False)
+            out = conv(x)
+            out_add = conv(x, add)
+        assert torch.equal(out.indices, out_ref.indices)
+        test_case.assertAllClose(out.features.numpy(),
+                                 out_ref.features.numpy(), atol=1e-4)
+        test_case.assertAllClose(out_add.features.numpy(),
+                                 out_add_ref.features.numpy(), atol=1e-4)
+
+
+@pytest.mark.parametrize("csr", [False, True])
+def test_cpu_hash_types(csr):
+    test_case = TestCase()
+    # auto selects DirectTable for the small grid and LinearProbing for
+    # the large one.
+    for shape in [[19, 18, 17], [120, 110, 100]]:
+        features, indices = _sparse_input(shape, [1000] * 2, 8)
+        for k in [3, 5]:
+            res = {}
+            for hash_type in CPUHashType:
+                _, pair, pair_num = spconv.ops.get_indice_pairs(
+                    indices, 2, shape, ConvAlgo.Native, [k] * 3, [1] * 3,
+                    [k // 2] * 3, [1] * 3, [0] * 3, True,
+                    cpu_hash_type=hash_type, csr=csr)
+                res[hash_type] = (pair, pair_num)
+            pair_ref, pair_num_ref = res[CPUHashType.UnorderedMap]
+            assert pair_num_ref.sum() > 0
+            for pair, pair_num in res.values():
+                test_case.assertAllEqual(pair_num.numpy(),
+                                         pair_num_ref.numpy())
+                test_case.assertAllEqual(pair.numpy(), pair_ref.numpy())
+
+
+def test_cpu_csr_kernel_map():
+    test_case = TestCase()
+    shape = [19, 18, 17]
+    features, indices = _sparse_input(shape, [1000] * 2, 8)
+    for subm, s in [(True, 1), (False, 1), (False, 2)]:
+        out_inds, pair, pair_num = spconv.ops.get_indice_pairs(
+            indices, 2, shape, ConvAlgo.Native, [3] * 3, [s] * 3, [1] * 3,
+            [1] * 3, [0] * 3, subm, csr=False)
+        out_inds_csr, pair_csr, pair_num_csr = spconv.ops.get_indice_pairs(
+            indices, 2, shape, ConvAlgo.Native, [3] * 3, [s] * 3, [1] * 3,
+            [1] * 3, [0] * 3, subm, csr=True, subm_half=False)
+        assert pair_csr.shape == (2, int(pair_num_csr.sum()))
+        test_case.assertAllEqual(out_inds_csr.numpy(), out_inds.numpy())
+        center = pair.shape[1] // 2
+        offset = 0
+        for k in range(pair.shape[1]):
+            nhot = int(pair_num_csr[k])
+            if subm and k == center:
+                assert nhot == 0
+                continue
+            ref = pair[:, k, :nhot]
+            test_case.assertAllEqual(pair_csr[:, offset:offset + nhot].numpy(),
+                                     ref.numpy())
+            offset += nhot
+    for bs, k, s in params_grid([1, 2], [3], [1, 2]):
+        features, indices = _sparse_input(shape, [1000] * bs, 8)
+        # reference: dense pairs with gather-mm-scatter_add per offset.
+        res_ref = _run_net_with_flags(
+            {
+                "SPCONV_CPU_CSR_KERNEL_MAP": False,
+                "SPCONV_CPU_FUSED_GEMM": False
+            }, features, indices, shape, bs, k, s)
+        res = _run_net_with_flags(
+            {
+                "SPCONV_CPU_CSR_KERNEL_MAP": True,
+                "SPCONV_CPU_SUBM_HALF_KERNEL_MAP": False
+            }, features, indices, shape, bs, k, s)
+        _assert_net_close(test_case, res, res_ref)
+
+
+def test_cpu_subm_half_kernel_map():
+    test_case = TestCase()
+    shape = [19, 18, 17]
+    features, indices = _sparse_input(shape, [1000] * 2, 8)
+    for subm, s in [(True, 1), (False, 1), (False, 2)]:
+        res = []
+        for subm_half in [False, True]:
+            res.append(
+                spconv.ops.get_indice_pairs(indices, 2, shape,
+                                            ConvAlgo.Native, [3] * 3, [s] * 3,
+                                            [1] * 3, [1] * 3, [0] * 3, subm,
+                                            csr=True, subm_half=subm_half))
+            assert spconv.ops.cpu_subm_pairs_are_half(
+                indices, subm, True, subm_half) == (subm and subm_half)
+        (_, pair_csr, pair_num_csr), (_, pair_half, pair_num_half) = res
+        test_case.assertAllEqual(pair_num_half.numpy(), pair_num_csr.numpy())
+        if subm:
+            num_half = int(pair_num_csr[:pair_num_csr.shape[0] // 2].sum())
+            test_case.assertAllEqual(pair_half.numpy(),
+                                     pair_csr[:, :num_half].numpy())
+        else:
+            test_case.assertAllEqual(pair_half.numpy(), pair_csr.numpy())
+    # half pairs are only generated for csr cpu subm pairs.
+    assert not spconv.ops.cpu_subm_pairs_are_half(indices, True, False, True)
+    for bs in [1, 2]:
+        features, indices = _sparse_input(shape, [1000] * bs, 8)
+        res_ref = _run_net_with_flags(
+            {
+                "SPCONV_CPU_CSR_KERNEL_MAP": True,
+                "SPCONV_CPU_SUBM_HALF_KERNEL_MAP": False
+            }, features, indices, shape, bs)
+        for fused, grouped in [(False, False), (True, False), (True, True)]:
+            res = _run_net_with_flags(
+                {
+                    "SPCONV_CPU_CSR_KERNEL_MAP": True,
+                    "SPCONV_CPU_SUBM_HALF_KERNEL_MAP": True,
+                    "SPCONV_CPU_FUSED_GEMM": fused,
+                    "SPCONV_CPU_GROUPED_GEMM": grouped
+                }, features, indices, shape, bs)
+            _assert_net_close(test_case, res, res_ref)
+
+
+def test_cpu_grouped_gemm():
+    test_case = TestCase()
+    shape = [19, 18, 17]
+    for bs, k, s in params_grid([1, 2], [3], [1, 2]):
+        features, indices = _sparse_input(shape, [1000] * bs, 8)
+        # reference: dense pairs with gather-mm-scatter_add per offset.
+        res_ref = _run_net_with_flags(
+            {
+                "SPCONV_CPU_CSR_KERNEL_MAP": False,
+                "SPCONV_CPU_FUSED_GEMM": False
+            }, features, indices, shape, bs, k, s)
+        for csr in [False, True]:
+            res = _run_net_with_flags(
+                {
+                    "SPCONV_CPU_CSR_KERNEL_MAP": csr,
+                    "SPCONV_CPU_FUSED_GEMM": True,
+                    "SPCONV_CPU_GROUPED_GEMM": True
+                }, features, indices, shape, bs, k, s)
+            _assert_net_close(test_case, res, res_ref)
+
+
+def test_cpu_autotune(tmp_path):
+    test_case = TestCase()
+    shape = [19, 18, 17]
+    features, indices = _sparse_input(shape, [1000] * 2, 8)
+    res_ref = _run_net_with_flags({"SPCONV_CPU_FUSED_GEMM": False}, features,
+                                  indices, shape, 2)
+    cache_path = str(tmp_path / "cpu_tune_cache.json")
+    cache_path_prev = CPU_TUNER.cache_path
+    results_prev = CPU_TUNER._results
+    # CPU_TUNER is process-global, restore it so later tests aren't tuned.
+    CPU_TUNER.cache_path = cache_path
+    CPU_TUNER._results = None
+    try:
+        with _cpu_flags({"SPCONV_CPU_AUTOTUNE": True}):
+            res = _run_net(_make_net(ConvAlgo.Native, 8, 16, 3, 2),
+                           features, indices, shape, 2)
+            # subm layers time dense fallback against sparse conv.
+            net = _make_net(ConvAlgo.Native, 8, 16, 3, 2)
+            net.enable_dense_fallback(threshold=0.0)
+            res_dense = _run_net(net, features, indices, shape, 2)
+        results = dict(CPU_TUNER._results)
+    finally:
+        CPU_TUNER.cache_path = cache_path_prev
+        CPU_TUNER._results = results_prev
+    _assert_net_close(test_case, res, res_ref)
+    _assert_net_close(test_case, res_dense, res_ref)
+    dense_results = [v for k, v in results.items() if k.startswith("dense,")]
+    assert len(dense_results) > 0
+    assert all(v in (CPUConvStrategy.Dense, CPUConvStrategy.Sparse)
+               for v in dense_results)
+    assert len(dense_results) < len(results)
+    # autotune results are persisted and loaded by a new tuner.
+    tuner = CPUConvTuner(cache_path)
+    for key, strategy in results.items():
+        assert tuner.get_tuned_strategy(key) == strategy
+
+
+def test_cpu_batch_sharded_kernel_map():
+    test_case = TestCase()
+    shape = [19, 18, 17]
+    _, indices = _sparse_input(shape, [1000] * 3, 8)
+    # rows of samples are interleaved, sharded pairs still follow row order.
+    interleaved = indices[torch.randperm(indices.shape[0],
+                                         generator=torch.Generator().manual_seed(5))]
+    assert (interleaved[1:, 0] < interleaved[:-1, 0]).any()
+    for inds, (subm, s, transpose), csr, subm_half in params_grid(
+        [indices, interleaved], [(True, 1, False), (False, 1, False),
+                                 (False, 2, False), (False, 2, True)],
+        [True, False], [False, True]):
+        res = [
+            spconv.ops.get_indice_pairs(inds, 3, shape, ConvAlgo.Native,
+                                        [3] * 3, [s] * 3, [1] * 3, [1] * 3,
+                                        [0] * 3, subm, transpose, csr=csr,
+                                        subm_half=subm_half,
+                                        batch_sharded=sharded)
+            for sharded in [False, True]
+        ]
+        for a, b in zip(res[0], res[1]):
+            test_case.assertAllEqual(a.numpy(), b.numpy())
+
+
+def test_cpu_space_filling_curve():
+    test_case = TestCase()
+    grid = torch.tensor([[0, i, j] for i in range(4) for j in range(4)])
+    morton_order = [[0, 0], [0, 1], [1, 0], [1, 1], [0, 2], [0, 3], [1, 2],
+                    [1, 3], [2, 0], [2, 1], [3, 0], [3, 1], [2, 2], [2, 3],
+                    [3, 2], [3, 3]]
+    hilbert_order = [[0, 0], [1, 0], [1, 1], [0, 1], [0, 2], [0, 3], [1, 3],
+                     [1, 2], [2, 2], [2, 3], [3, 3], [3, 2], [3, 1], [2, 1],
+                     [2, 0], [3, 0]]
+    for curve, order in [("morton", morton_order),
+                         ("hilbert", hilbert_order)]:
+        code = space_filling_curve_code(grid, [4, 4], curve)
+        assert grid[torch.argsort(code), 1:].tolist() == order
+    # batch index goes before spatial code.
+    inds = torch.tensor([[1, 0, 0], [0, 3, 3], [0, 1, 2]])
+    assert space_filling_curve_code(inds, [4, 4], "morton").tolist() == [16, 15, 6]
+    # consecutive voxels of hilbert curve are neighbors.
+    grid3d = torch.tensor([[0, i, j, k] for i in range(8) for j in range(8)
+                           for k in range(8)])
+    code = space_filling_curve_code(grid3d, [8, 8, 8], "hilbert")
+    coords = grid3d[torch.argsort(code), 1:]
+    assert (coords[1:] - coords[:-1]).abs().sum(1).eq(1).all()
+
+    shape = [19, 18, 17]
+    features, indices = _sparse_input(shape, [1000] * 2, 8)
+    x = spconv.SparseConvTensor(features, indices, shape, 2)
+    torch.manual_seed(48848)
+    subm_net = spconv.SparseSequential(
+        spconv.SubMConv3d(8, 16, 3, algo=ConvAlgo.Native),
+        spconv.SubMConv3d(16, 16, 3, algo=ConvAlgo.Native)).eval()
+    net = _make_net(ConvAlgo.Native, 8, 16, 3, 2).eval()
+    for curve in ["morton", "hilbert"]:
+        x_re, perm = x.reorder(curve)
+        assert not torch.equal(perm, torch.arange(perm.shape[0]))
+        test_case.assertAllEqual(x_re.indices.numpy(), indices[perm].numpy())
+        test_case.assertAllEqual(x_re.features.numpy(), features[perm].numpy())
+        with torch.no_grad():
+            out_ref = subm_net(x)
+            out = subm_net(x_re)
+            test_case.assertAllEqual(out.indices.numpy(),
+                                     out_ref.indices[perm].numpy())
+            test_case.assertAllClose(out.features.numpy(),
+                                     out_ref.features[perm].numpy(),
+                                     atol=1e-4)
+            perm_inv = torch.empty_like(perm)
+            perm_inv[perm] = torch.arange(perm.shape[0])
+            test_case.assertAllClose(out.features[perm_inv].numpy(),
+                                     out_ref.features.numpy(), atol=1e-4)
+            test_case.assertAllClose(net(x_re).dense().numpy(),
+                                     net(x).dense().numpy(), atol=1e-4)
+    # pc_voxel_id of PointToVoxel points to reordered voxels.
+    pc = torch.from_numpy(
+        np.random.RandomState(50).uniform(-1.2, 1.2,
+                                          [5000, 4]).astype(np.float32))
+    gen_args = ([0.1, 0.1, 0.1], [-1, -1, -1, 1, 1, 1], 4, 20000, 5)
+    voxels_ref, inds_ref, num_ref, pc_id_ref = PointToVoxel(
+        *gen_args).generate_voxel_with_id(pc)
+    for curve in ["morton", "hilbert"]:
+        voxels, inds, num, pc_id = PointToVoxel(
+            *gen_args, reorder_curve=curve).generate_voxel_with_id(pc)
+        code = space_filling_curve_code(
+            torch.nn.functional.pad(inds, (1, 0)), [20] * 3, curve)
+        assert (code[1:] > code[:-1]).all()
+        valid = pc_id_ref != -1
+        assert torch.equal(pc_id != -1, valid) and not valid.all()
+        test_case.assertAllEqual(inds[pc_id[valid]].numpy(),
+                                 inds_ref[pc_id_ref[valid]].numpy())
+        test_case.assertAllEqual(num[pc_id[valid]].numpy(),
+                                 num_ref[pc_id_ref[valid]].numpy())
+        test_case.assertAllEqual(voxels[pc_id[valid]].numpy(),
+                                 voxels_ref[pc_id_ref[valid]].numpy())
+
+
+def test_cpu_pair_sort():
+    test_case = TestCase()
+    shape = [19, 18, 17]
+    features, indices = _sparse_input(shape, [1000] * 2, 8)
+    res_ref = _run_net_with_flags({}, features, indices, shape, 2)
+    for csr, key, fused in params_grid([False, True], ["in", "out"],
+                                       [False, True]):
+        res = _run_net_with_flags(
+            {
+                "SPCONV_CPU_CSR_KERNEL_MAP": csr,
+                "SPCONV_CPU_PAIR_SORT_KEY": key,
+                "SPCONV_CPU_FUSED_GEMM": fused
+            }, features, indices, shape, 2)
+        _assert_net_close(test_case, res, res_ref)
+
+
+def test_cpu_gather_scatter_runs():
+    test_case = TestCase()
+    # contiguous runs, single rows and reversed runs.
+    inds_small = [5, 6, 7, 8, 2, 20, 19, 18, 11, 12, 0, 30, 31, 25, 9]
+    rng = np.random.RandomState(50)
+    blocks = np.split(rng.permutation(20000), np.arange(0, 20000, 50)[1:])
+    # sort some blocks to get long runs across parallel chunks.
+    inds_large = np.concatenate([
+        np.sort(b) if i % 3 == 0 else (np.sort(b)[::-1] if i % 3 == 1 else b)
+        for i, b in enumerate(blocks)
+    ])
+    for inds, dtype in params_grid(
+        [inds_small, inds_large], [torch.float32, torch.float64,
+                                   torch.float16]):
+        inds_th = torch.tensor(inds, dtype=torch.int32)
+        num = int(inds_th.max()) + 3
+        inp = torch.randn(num, 13).to(dtype)
+        out = torch.empty(len(inds), 13, dtype=dtype)
+        SpconvOps.gather_cpu(torch_tensor_to_tv(out), torch_tensor_to_tv(inp),
+                             torch_tensor_to_tv(inds_th))
+        test_case.assertAllEqual(out.numpy(), inp[inds_th.long()].numpy())
+        buf = torch.randn(len(inds), 13).to(dtype)
+        out = torch.randn(num, 13).to(dtype)
+        out_ref = out.clone()
+        out_ref[inds_th.long()] += buf
+        SpconvOps.scatter_add_cpu(torch_tensor_to_tv(out),
+                                  torch_tensor_to_tv(buf),
+                                  torch_tensor_to_tv(inds_th))
+        test_case.assertAllEqual(out.numpy(), out_ref.numpy())
+
+
+def test_cpu_kernel_map_cache():
+    test_case = TestCase()
+    shape = [19, 18, 17]
+    features, indices = _sparse_input(shape, [1000] * 2, 8)
+    for algo in [ConvAlgo.Native, ConvAlgo.MaskImplicitGemm]:
+        net = spconv.SparseSequential(
+            _make_net(algo, 8, 16, 3, 2),
+            spconv.SparseMaxPool3d(3, 2, padding=1, algo=algo)).eval()
+        cache = spconv.KernelMapCache()
+        res = []
+        for i in range(2):
+            x = spconv.SparseConvTensor(features, indices, shape, 2,
+                                        kernel_map_cache=cache)
+            with torch.no_grad():
+                res.append(net(x).dense())
+            # maxpool has same params as down0 on the same indices, so its
+            # kernel map is a hit even in first run.
+            assert cache.hits == 1 + 4 * i and cache.misses == 3
+        test_case.assertAllEqual(res[0].numpy(), res[1].numpy())
+        # maps larger than max_bytes are never cached.
+        cache = spconv.KernelMapCache(max_bytes=1)
+        x = spconv.SparseConvTensor(features, indices, shape, 2,
+                                    kernel_map_cache=cache)
+        with torch.no_grad():
+            net(x)
+        assert len(cache) == 0 and cache.nbytes == 0
+
+
+def test_cpu_kernel_map_plan():
+    test_case = TestCase()
+    shape = [19, 18, 17]
+    features, indices = _sparse_input(shape, [1000] * 2, 8)
+    for algo in [ConvAlgo.Native, ConvAlgo.MaskImplicitGemm]:
+        net = spconv.SparseSequential(
+            _make_net(algo, 8, 16, 3, 2),
+            # same map as subm0 without indice key
+            spconv.SubMConv3d(16, 16, 3, bias=False, algo=algo),
+            spconv.SparseMaxPool3d(3, 2, padding=1, algo=algo)).eval()
+        plan = spconv.plan_kernel_maps(net)
+        assert plan.groups == [["0.0", "1"], ["0.1", "2"], ["0.2"]]
+        x = spconv.SparseConvTensor(features, indices, shape, 2)
+        x_plan = plan.generate(x)
+        cache = x_plan.kernel_map_cache
+        assert cache.misses == 3 and "subm0" in x_plan.indice_dict
+        with torch.no_grad():
+            out_ref = net(x).dense()
+            out = net(x_plan).dense()
+        # no pair is generated during forward.
+        assert cache.misses == 3
+        test_case.assertAllEqual(out.numpy(), out_ref.numpy())
+    # layers after avg pool are planned too.
+    torch.manual_seed(48848)
+    net = spconv.SparseSequential(
+        spconv.SubMConv3d(8, 16, 3, bias=False, algo=ConvAlgo.Native),
+        spconv.SparseAvgPool3d(2, 2),
+        spconv.SubMConv3d(16, 16, 3, bias=False, algo=ConvAlgo.Native)).eval()
+    plan = spconv.plan_kernel_maps(net)
+    assert plan.groups == [["0"], ["1"], ["2"]]
+    x = spconv.SparseConvTensor(features, indices, shape, 2)
+    x_plan = plan.generate(x)
+    cache = x_plan.kernel_map_cache
+    with torch.no_grad():
+        out_ref = net(x).dense()
+        out = net(x_plan).dense()
+    assert cache.misses == 3 and cache.hits == 3
+    test_case.assertAllEqual(out.numpy(), out_ref.numpy())
+
+
+class _PipelineError(Exception):
+    pass
+
+
+def test_cpu_kernel_map_pipeline():
+    test_case = TestCase()
+    shape = [19, 18, 17]
+    features, indices = _sparse_input(shape, [1000] * 2, 8)
+    x = spconv.SparseConvTensor(features, indices, shape, 2)
+    for algo in [ConvAlgo.Native, ConvAlgo.MaskImplicitGemm]:
+        net = spconv.SparseSequential(
+            _make_net(algo, 8, 16, 3, 2),
+            spconv.SubMConv3d(16, 16, 3, bias=False, algo=algo),
+            spconv.SparseMaxPool3d(3, 2, padding=1, algo=algo)).eval()
+        with torch.no_grad():
+            out_ref = net(x).dense()
+        net.enable_kernel_map_pipeline()
+        with torch.no_grad():
+            out = net(x).dense()
+        test_case.assertAllEqual(out.numpy(), out_ref.numpy())
+    # exception of background job is raised by the layer waiting for it,
+    # and the executor is free for next frames.
+    executor = ThreadPoolExecutor(1)
+    net.enable_kernel_map_pipeline(executor=executor)
+    get_indice_pairs = spconv.ops.get_indice_pairs
+    main_thread = threading.current_thread()
+
+    def get_indice_pairs_failed(*args, **kwargs):
+        if threading.current_thread() is not main_thread:
+            raise _PipelineError
+        return get_indice_pairs(*args, **kwargs)
+
+    spconv.ops.get_indice_pairs = get_indice_pairs_failed
+    try:
+        with pytest.raises(_PipelineError):
+            with torch.no_grad():
+                net(x)
+    finally:
+        spconv.ops.get_indice_pairs = get_indice_pairs
+    assert executor.submit(lambda: 1).result(timeout=60) == 1
+    with torch.no_grad():
+        out = net(x).dense()
+    test_case.assertAllEqual(out.numpy(), out_ref.numpy())
+    executor.shutdown(wait=True)
+
+
+def test_cpu_static_memory_plan():
+    test_case = TestCase()
+    shape = [19, 18, 17]
+    features, indices = _sparse_input(shape, [1000] * 2, 8)
+    # static memory plan from recorded voxel counts
+    for algo in [ConvAlgo.Native, ConvAlgo.OutputStationary]:
+        torch.manual_seed(48848)
+        net = spconv.SparseSequential(
+            spconv.SubMConv3d(8, 16, 3, indice_key="subm0", algo=algo),
+            torch.nn.ReLU(),
+            spconv.SparseConv3d(16, 16, 3, 2, padding=1, indice_key="down0",
+                                record_voxel_count=True, algo=algo),
+            spconv.SubMConv3d(16, 16, 3, algo=algo),
+            spconv.SparseInverseConv3d(16, 8, 3, indice_key="down0",
+                                       algo=algo)).eval()
+        x = spconv.SparseConvTensor(features, indices, shape, 2)
+        with torch.no_grad():
+            out_ref = net(x).features.clone()
+        plan = spconv.plan_static_memory(net, features.shape[0])
+        assert plan.peak_nbytes <= plan.nbytes < sum(
+            b.nbytes for b in plan.buffers)
+        buf = plan.arena.buffer
+
+        def in_arena(t: torch.Tensor):
+            return 0 <= t.data_ptr() - buf.data_ptr() < plan.nbytes
+
+        layers = [net[0], net[2], net[3], net[4]]
+        for i in range(2):
+            with torch.no_grad():
+                out = net(plan.bind(x))
+            assert in_arena(out.features)
+            test_case.assertAllEqual(out.features.numpy(), out_ref.numpy())
+            # named memory of planned layers has a slot in the arena.
+            for mod in layers:
+                assert plan.arena.layer(mod).num_unplanned == 0
+            for data in out.indice_dict.values():
+                assert in_arena(data.indice_pairs)
+                assert in_arena(data.indice_pair_num)
+                if not data.is_subm:
+                    assert in_arena(data.out_indices)
+        x_large = spconv.SparseConvTensor(
+            *_sparse_input(shape, [2000] * 2, 8), shape, 2)
+        with pytest.raises(ValueError):
+            plan.bind(x_large)
+
+
+def test_cpu_derive_subm_kernel_map():
+    test_case = TestCase()
+    shape = [19, 18, 17]
+    features, indices = _sparse_input(shape, [1000] * 2, 8)
+    for csr, subm_half in [(False, False), (True, False), (True, True)]:
+        pairs = {}
+        for k, d in [(5, 1), (3, 1), (3, 2), (1, 1)]:
+            pairs[(k, d)] = spconv.ops.get_indice_pairs(
+                indices, 2, shape, ConvAlgo.Native, [k] * 3, [1] * 3,
+                [k // 2 * d] * 3, [d] * 3, [0] * 3, True, csr=csr,
+                subm_half=subm_half)
+        _, pair_src, pair_num_src = pairs[(5, 1)]
+        for k, d in [(3, 1), (3, 2), (1, 1)]:
+            _, pair_ref, pair_num_ref = pairs[(k, d)]
+            pair, pair_num = spconv.ops.derive_subm_indice_pairs(
+                pair_src, pair_num_src, [5] * 3, [1] * 3, [k] * 3, [d] * 3,
+                subm_half)
+            test_case.assertAllEqual(pair_num.numpy(), pair_num_ref.numpy())
+            test_case.assertAllEqual(pair.numpy(), pair_ref.numpy())
+    assert spconv.ops.subm_kernel_offset_map([3] * 3, [1] * 3, [5] * 3,
+                                             [2] * 3) is None
+    for key in [None, "subm5"]:
+        # smaller subm layer derives its map from keyed 5x5x5 map.
+        torch.manual_seed(50)
+        net = spconv.SparseSequential(
+            spconv.SubMConv3d(8, 16, 5, bias=False, indice_key=key,
+                              algo=ConvAlgo.Native),
+            spconv.SubMConv3d(16, 16, 3, bias=False, algo=ConvAlgo.Native),
+            spconv.SubMConv3d(16, 16, 3, dilation=2, bias=False,
+                              algo=ConvAlgo.Native))
+        res = _run_net(net, features, indices, shape, 2)
+        if key is None:
+            res_ref = res
+            continue
+        _assert_net_close(test_case, res, res_ref)
+
+
+def test_cpu_parallel_weight_grad():
+    test_case = TestCase()
+    shape = [19, 18, 17]
+    features, indices = _sparse_input(shape, [1000] * 2, 8)
+    # reference: gather-mm-scatter_add per offset.
+    res_ref = _run_net_with_flags({"SPCONV_CPU_FUSED_GEMM": False}, features,
+                                  indices, shape, 2)
+    num_threads_prev = torch.get_num_threads()
+    try:
+        for num_threads in [1, 2, 3, 8]:
+            # spconv kernels share the openmp runtime of torch.
+            torch.set_num_threads(num_threads)
+            res = _run_net_with_flags({"SPCONV_CPU_FUSED_GEMM": True},
+                                      features, indices, shape, 2)
+            _assert_net_close(test_case, res, res_ref)
+            # partials are summed in chunk order, so results are
+            # reproducible for a fixed thread count.
+            res_again = _run_net_with_flags({"SPCONV_CPU_FUSED_GEMM": True},
+                                            features, indices, shape, 2)
+            for g, g_again in zip(res[2], res_again[2]):
+                test_case.assertAllEqual(g.numpy(), g_again.numpy())
+    finally:
+        torch.set_num_threads(num_threads_prev)
+
+
+def test_cpu_nogil_threads():
+    test_case = TestCase()
+    shape = [19, 18, 17]
+    features, indices = _sparse_input(shape, [1000] * 2, 8)
+    pc = torch.from_numpy(
+        np.random.RandomState(50).uniform(-1.2, 1.2,
+                                          [5000, 4]).astype(np.float32))
+    gen_args = ([0.1, 0.1, 0.1], [-1, -1, -1, 1, 1, 1], 4, 20000, 5)
+    net = spconv.SparseSequential(
+        _make_net(ConvAlgo.Native, 8, 16, 3, 2),
+        spconv.SparseMaxPool3d(3, 2, padding=1,
+                               algo=ConvAlgo.Native)).eval()
+
+    def run(net, gen):
+        x = spconv.SparseConvTensor(features, indices, shape, 2)
+        with torch.no_grad():
+            out = net(x).dense()
+        return out, gen.generate_voxel_with_id(pc)
+
+    out_ref, voxel_res_ref = run(net, PointToVoxel(*gen_args))
+    num_threads = 4
+    barrier = threading.Barrier(num_threads)
+
+    def run_in_thread(net, gen):
+        barrier.wait()
+        return [run(net, gen) for _ in range(3)]
+
+    with ThreadPoolExecutor(num_threads) as executor:
+        futures = [
+            executor.submit(run_in_thread, copy.deepcopy(net),
+                            PointToVoxel(*gen_args))
+            for _ in range(num_threads)
+        ]
+        results = [f.result(timeout=600) for f in futures]
+    for out, voxel_res in sum(results, []):
+        test_case.assertAllEqual(out.numpy(), out_ref.numpy())
+        for a, a_ref in zip(voxel_res, voxel_res_ref):
+            test_case.assertAllEqual(a.numpy(), a_ref.numpy())